@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Optional, Dict, Any
+from fastapi import UploadFile
+from config import settings
+from project_source import archive_suffix
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from an upload per write
+READ_CHUNK_SIZE = 1024 * 1024
+# Unreferenced blobs younger than this are never collected, so a freshly stored blob is
+# linked before it could be
+MIN_UNUSED_SECONDS = 300
+# Directory under the store root recording which users have sent each blob's bytes
+OWNERS_DIR = 'owners'
+
+class ArchiveStore:
+    """Content-addressed store for uploaded archives.
+
+    Each archive is kept once, named by its SHA-256 digest. Every deployment that uses one
+    gets a hardlink to the blob in the upload directory, so the blob's link count is its
+    reference count: removing a deployment's copy releases it. Unreferenced blobs stay
+    around for re-uploads until they pass the retention period or the store is over its
+    disk budget.
+
+    A blob can be claimed by digest alone only by users who uploaded its bytes before;
+    anyone else has to send the data, which is then deduplicated as usual.
+    """
+
+    def __init__(self, root: str, retention: float, budget_bytes: int, interval: float):
+        self.root = root
+        self.retention = retention
+        self.budget_bytes = budget_bytes
+        self.interval = interval
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def save_upload(self, upload: UploadFile, destination_dir: str, user_id: str) -> str:
+        """Stream an uploaded file into the store, hashing as it is written, and link it for a deployment"""
+        temp_path = os.path.join(destination_dir, f".{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        try:
+            with open(temp_path, 'wb') as f:
+                while True:
+                    chunk = await upload.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    await asyncio.to_thread(_write_hashed, f, digest, chunk)
+            return self._adopt(temp_path, digest.hexdigest(), upload.filename, destination_dir, user_id)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    async def store_file(self, path: str, destination_dir: str, filename: str, user_id: str,
+                         expected_digest: Optional[str] = None) -> str:
+        """Move a file assembled elsewhere on the same filesystem into the store and link it"""
+        digest = await asyncio.to_thread(_file_digest, path)
+        if expected_digest and digest != expected_digest.lower():
+            raise ValueError("Uploaded file does not match its declared SHA-256 digest")
+        return self._adopt(path, digest, filename, destination_dir, user_id)
+
+    def contains(self, digest: str, filename: str, user_id: str) -> bool:
+        """Whether the user can claim a stored archive by its digest without sending it"""
+        return (_is_digest(digest) and os.path.exists(self._blob_path(digest, filename))
+                and os.path.exists(self._owner_path(digest, filename, user_id)))
+
+    def link_existing(self, digest: str, filename: str, destination_dir: str, user_id: str) -> Optional[str]:
+        """Link an archive the user stored before for a deployment, or None if they have not"""
+        if not _is_digest(digest) or not os.path.exists(self._owner_path(digest, filename, user_id)):
+            return None
+        return self._link_stored(digest, filename, destination_dir)
+
+    def _link_stored(self, digest: str, filename: str, destination_dir: str) -> Optional[str]:
+        try:
+            return self._link(self._blob_path(digest, filename), destination_dir, filename)
+        except FileNotFoundError:
+            return None
+
+    def _adopt(self, temp_path: str, digest: str, filename: str, destination_dir: str, user_id: str) -> str:
+        """Turn a fully written file into a deployment's link, storing it unless its digest is stored already"""
+        # The user has sent these bytes, so they may claim the blob by digest from now on
+        self._add_owner(digest, filename, user_id)
+        # Linking first means a concurrent collection can never leave us without the data
+        link_path = self._link_stored(digest, filename, destination_dir)
+        if link_path:
+            os.remove(temp_path)
+            metrics.archive_store_uploads_total.inc(outcome="deduplicated")
+            logger.info(f"Upload matches stored archive {digest[:12]}, reusing it")
+            return link_path
+
+        blob_path = self._blob_path(digest, filename)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(temp_path, blob_path)
+        metrics.archive_store_uploads_total.inc(outcome="stored")
+        return self._link(blob_path, destination_dir, filename)
+
+    def _owner_path(self, digest: str, filename: str, user_id: str) -> str:
+        # Hashed so any user ID makes a safe file name
+        owner = hashlib.sha256(user_id.encode()).hexdigest()[:32]
+        return os.path.join(self._owners_dir(os.path.basename(self._blob_path(digest, filename))), owner)
+
+    def _owners_dir(self, blob_name: str) -> str:
+        return os.path.join(self.root, OWNERS_DIR, blob_name)
+
+    def _add_owner(self, digest: str, filename: str, user_id: str):
+        owner_path = self._owner_path(digest, filename, user_id)
+        os.makedirs(os.path.dirname(owner_path), exist_ok=True)
+        open(owner_path, 'a').close()
+
+    def _blob_path(self, digest: str, filename: str) -> str:
+        digest = digest.lower()
+        return os.path.join(self.root, digest[:2], digest + archive_suffix(filename))
+
+    def _link(self, blob_path: str, destination_dir: str, filename: str) -> str:
+        """Hardlink a blob into the upload directory, taking a reference on it"""
+        link_path = os.path.join(destination_dir, f"{uuid.uuid4().hex}_{os.path.basename(filename)}")
+        os.link(blob_path, link_path)
+        # Last use, for retention and least-recently-used eviction
+        os.utime(blob_path)
+        return link_path
+
+    def start(self):
+        """Start the periodic collection loop"""
+        if self.interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Archive store collector started (every {self.interval}s)")
+
+    async def stop(self):
+        """Stop the periodic collection loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.collect)
+            except Exception as e:
+                logger.warning(f"Archive store collection failed: {e}")
+
+    def collect(self) -> Dict[str, Any]:
+        """Remove unreferenced blobs past retention, then the least recently used while over budget"""
+        now = time.time()
+        total = 0
+        candidates = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root and OWNERS_DIR in dirnames:
+                dirnames.remove(OWNERS_DIR)
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                total += stat.st_size
+                # The store's own entry is the only link: no deployment uses it
+                if stat.st_nlink <= 1 and now - stat.st_mtime > MIN_UNUSED_SECONDS:
+                    candidates.append((stat.st_mtime, stat.st_size, path))
+
+        removed = 0
+        reclaimed = 0
+        for mtime, size, path in sorted(candidates):
+            if now - mtime < self.retention and total <= self.budget_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove archive {path}: {e}")
+                continue
+            shutil.rmtree(self._owners_dir(os.path.basename(path)), ignore_errors=True)
+            total -= size
+            removed += 1
+            reclaimed += size
+
+        summary = {
+            'removed_archives': removed,
+            'bytes_reclaimed': reclaimed,
+            'bytes_stored': total,
+            'disk_budget_bytes': self.budget_bytes,
+            'completed_at': now
+        }
+        self.last_run = summary
+        metrics.archive_store_reclaimed_bytes_total.inc(reclaimed)
+        if removed:
+            logger.info(f"Archive store removed {removed} unused archives, reclaimed {reclaimed / (1024 * 1024):.1f} MB")
+        return summary
+
+def _is_digest(value: str) -> bool:
+    return bool(re.fullmatch(r'[0-9a-fA-F]{64}', value or ''))
+
+def _write_hashed(f, digest, chunk: bytes):
+    digest.update(chunk)
+    f.write(chunk)
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Global archive store instance
+archive_store = ArchiveStore(
+    root=os.path.join(settings.UPLOAD_DIR, 'archives'),
+    retention=settings.ARCHIVE_STORE_RETENTION,
+    budget_bytes=settings.ARCHIVE_STORE_BUDGET_MB * 1024 * 1024,
+    interval=settings.ARCHIVE_STORE_GC_INTERVAL
+)
@@ -0,0 +1,183 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List
+from config import settings
+from docker_service import docker_service
+from firebase_config import firebase_service
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ETA basis until real build durations have been observed
+DEFAULT_BUILD_SECONDS = 120.0
+# Weight of the newest build duration in the moving average
+BUILD_DURATION_SMOOTHING = 0.2
+# ETA drift worth rewriting a queued build's record for
+ETA_REPUBLISH_SECONDS = 15
+
+class BuildScheduler:
+    """Admits builds up to a concurrency limit, sharing slots fairly between users.
+
+    Weighted fair queuing: each build gets a virtual finish tag that starts after the
+    submitting user's previous build, so a user with many queued builds is interleaved
+    with everyone else instead of holding every slot in turn.
+    """
+
+    def __init__(self, max_concurrency: int, cpus_per_build: float, memory_per_build: int):
+        self.max_concurrency = max_concurrency
+        self.cpus_per_build = cpus_per_build
+        self.memory_per_build = memory_per_build
+        self.limit: Optional[int] = None
+        self.running: Dict[str, str] = {}
+        self._started: Dict[str, float] = {}
+        self.average_build_seconds = DEFAULT_BUILD_SECONDS
+        self._queue: List[list] = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        # Queue fields last written to each deployment record
+        self._published: Dict[str, Dict[str, Any]] = {}
+        self._publish_lock = asyncio.Lock()
+        metrics.build_queue_length.set_function(lambda: len(self._queue))
+        metrics.builds_running.set_function(lambda: len(self.running))
+
+    @asynccontextmanager
+    async def slot(self, deployment_id: str, user_id: str, weight: float = 1.0):
+        """Wait for a build slot, holding it for the duration of the block"""
+        if self.limit is None:
+            self.limit = await asyncio.to_thread(self._derive_limit)
+            logger.info(f"Build concurrency limit: {self.limit}")
+
+        future = asyncio.get_running_loop().create_future()
+        start_tag = max(self._virtual_time, self._last_finish.get(user_id, 0.0))
+        finish_tag = start_tag + 1.0 / weight
+        self._last_finish[user_id] = finish_tag
+        entry = [finish_tag, next(self._sequence), deployment_id, user_id, future]
+        heapq.heappush(self._queue, entry)
+        enqueued = time.monotonic()
+
+        self._dispatch()
+        await self._publish_positions()
+        try:
+            await future
+        except BaseException:
+            # Cancelled while queued (or just as the slot was granted)
+            if deployment_id in self.running:
+                self.running.pop(deployment_id, None)
+                self._started.pop(deployment_id, None)
+                self._dispatch()
+            elif entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            await self._publish_positions()
+            raise
+
+        metrics.build_queue_wait_seconds.observe(time.monotonic() - enqueued)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.running.pop(deployment_id, None)
+            self._started.pop(deployment_id, None)
+            self._record_duration(time.monotonic() - started)
+            self._dispatch()
+            await self._publish_positions()
+
+    def _dispatch(self):
+        """Hand free slots to the queued builds with the smallest finish tags"""
+        while self._queue and len(self.running) < (self.limit or 1):
+            finish_tag, _, deployment_id, user_id, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self._virtual_time = max(self._virtual_time, finish_tag)
+            self.running[deployment_id] = user_id
+            self._started[deployment_id] = time.monotonic()
+            future.set_result(None)
+
+        if not self._queue and not self.running:
+            # Idle: forget history so tags don't grow without bound
+            self._virtual_time = 0.0
+            self._last_finish.clear()
+
+    def _record_duration(self, seconds: float):
+        self.average_build_seconds += BUILD_DURATION_SMOOTHING * (seconds - self.average_build_seconds)
+
+    def queue_positions(self) -> Dict[str, Dict[str, Any]]:
+        """1-based queue position and estimated wait for every queued build"""
+        # Seconds until each slot frees up, counting what running builds have already done
+        now = time.monotonic()
+        free_at = [max(0.0, self.average_build_seconds - (now - started)) for started in self._started.values()]
+        free_at += [0.0] * max(0, (self.limit or 1) - len(free_at))
+        heapq.heapify(free_at)
+
+        positions = {}
+        for position, entry in enumerate(sorted(self._queue), start=1):
+            wait = heapq.heappop(free_at)
+            heapq.heappush(free_at, wait + self.average_build_seconds)
+            positions[entry[2]] = {
+                'queue_position': position,
+                'queue_eta_seconds': round(wait)
+            }
+        return positions
+
+    async def _publish_positions(self):
+        """Write changed queue positions onto the deployment records, clearing them once admitted"""
+        async with self._publish_lock:
+            positions = self.queue_positions()
+            updates = {
+                deployment_id: fields for deployment_id, fields in positions.items()
+                if self._outdated(self._published.get(deployment_id), fields)
+            }
+            for deployment_id in self._published.keys() - positions.keys():
+                updates[deployment_id] = {'queue_position': None, 'queue_eta_seconds': None}
+            if not updates:
+                return
+
+            written = await firebase_service.update_existing_deployments(updates)
+            if written is None:
+                # Keep the old state so the next publish retries these
+                logger.warning("Could not publish build queue positions")
+                return
+            # Deleted records were skipped; remember them too so they aren't retried on every publish
+            for deployment_id in updates:
+                if deployment_id in positions:
+                    self._published[deployment_id] = positions[deployment_id]
+                else:
+                    self._published.pop(deployment_id, None)
+
+    @staticmethod
+    def _outdated(published: Optional[Dict[str, Any]], fields: Dict[str, Any]) -> bool:
+        """Whether a record's queue fields differ enough from the current ones to rewrite"""
+        if published is None or published['queue_position'] != fields['queue_position']:
+            return True
+        return abs(published['queue_eta_seconds'] - fields['queue_eta_seconds']) >= ETA_REPUBLISH_SECONDS
+
+    def _derive_limit(self) -> int:
+        """Concurrent builds the Docker hosts can take, by their scarcer resource"""
+        if self.max_concurrency > 0:
+            return self.max_concurrency
+
+        total = 0
+        for host in docker_service.hosts:
+            try:
+                memory, cpus = host.capacity()
+            except Exception as e:
+                logger.warning(f"Could not read capacity of Docker host {host.name}: {e}")
+                continue
+            total += max(1, min(int(cpus // self.cpus_per_build), memory // self.memory_per_build))
+
+        if not total:
+            total = int((os.cpu_count() or 1) // self.cpus_per_build)
+        return max(1, total)
+
+# Global build scheduler instance
+build_scheduler = BuildScheduler(
+    max_concurrency=settings.BUILD_MAX_CONCURRENCY,
+    cpus_per_build=settings.BUILD_CPUS_PER_SLOT,
+    memory_per_build=settings.BUILD_MEMORY_PER_SLOT_MB * 1024 * 1024
+)
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+class DeploymentCancelled(asyncio.CancelledError):
+    """Raised inside a pipeline stage once its deployment has been cancelled"""
+
+class CancelToken:
+    """Cancellation flag shared by a pipeline task and the worker threads it runs blocking stages in"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], Any]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Mark cancelled and run the registered interrupt callbacks"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run(callback)
+
+    def on_cancel(self, callback: Callable[[], Any]) -> Callable[[], None]:
+        """Register a callback that interrupts blocking work; returns a function that unregisters it"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        # Already cancelled: interrupt straight away
+        self._run(callback)
+        return lambda: None
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise DeploymentCancelled()
+
+    def _unregister(self, callback: Callable[[], Any]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def _run(self, callback: Callable[[], Any]):
+        try:
+            callback()
+        except Exception as e:
+            logger.debug(f"Cancel callback failed: {e}")
+
+async def run_cancellable(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run blocking work in a thread; if the caller is cancelled, wait for the thread to wind
+    down before re-raising so cleanup never races with it"""
+    future = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        try:
+            await future
+        except BaseException:
+            pass
+        raise
+
+class DeploymentTaskRegistry:
+    """Running deployment pipelines, so a request can cancel one mid-stage"""
+
+    def __init__(self):
+        self._tasks: Dict[str, Tuple[asyncio.Task, CancelToken]] = {}
+
+    async def run(self, deployment_id: str, pipeline: Callable[..., Any], *args):
+        """Run a pipeline as its own task, passing it a cancel token"""
+        token = CancelToken()
+        task = asyncio.create_task(pipeline(*args, cancel_token=token))
+        self._tasks[deployment_id] = (task, token)
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                # The runner itself is being cancelled (shutdown): stop the pipeline too
+                token.cancel()
+                task.cancel()
+                raise
+        finally:
+            entry = self._tasks.get(deployment_id)
+            if entry and entry[0] is task:
+                del self._tasks[deployment_id]
+
+    def is_running(self, deployment_id: str) -> bool:
+        entry = self._tasks.get(deployment_id)
+        return bool(entry) and not entry[0].done()
+
+    def cancel(self, deployment_id: str) -> bool:
+        """Interrupt a running pipeline; False if none is running for the deployment"""
+        entry = self._tasks.get(deployment_id)
+        if not entry or entry[0].done():
+            return False
+        task, token = entry
+        token.cancel()
+        task.cancel()
+        return True
+
+# Global deployment task registry
+deployment_tasks = DeploymentTaskRegistry()
@@ -25,6 +25,16 @@ class Settings:
     
     # Docker Configuration
     DOCKER_SOCKET: str = os.getenv("DOCKER_SOCKET", "unix://var/run/docker.sock")
+    # Comma-separated "name=url[|address]" entries; empty means DOCKER_SOCKET only
+    DOCKER_HOSTS: str = os.getenv("DOCKER_HOSTS", "")
+    # Keep-alive connections per Docker host for the async API client, and its request timeout
+    DOCKER_API_POOL_SIZE: int = int(os.getenv("DOCKER_API_POOL_SIZE", "32"))
+    DOCKER_API_TIMEOUT: float = float(os.getenv("DOCKER_API_TIMEOUT", "60"))
+    
+    # Startup Configuration (Firebase and Docker are connected in the background after startup)
+    WARMUP_RETRY_INTERVAL: float = float(os.getenv("WARMUP_RETRY_INTERVAL", "5"))
+    READINESS_CHECK_TIMEOUT: float = float(os.getenv("READINESS_CHECK_TIMEOUT", "2"))
+    READINESS_CACHE_SECONDS: float = float(os.getenv("READINESS_CACHE_SECONDS", "5"))
     
     # Deployment Configuration
     BASE_DOMAIN: str = os.getenv("BASE_DOMAIN", "localhost")
@@ -32,10 +42,105 @@ class Settings:
     DEPLOYMENT_PORT_RANGE_START: int = int(os.getenv("DEPLOYMENT_PORT_RANGE_START", "3000"))
     DEPLOYMENT_PORT_RANGE_END: int = int(os.getenv("DEPLOYMENT_PORT_RANGE_END", "4000"))
     
+    # Build Scheduling Configuration (max concurrency 0 derives it from Docker host CPU/memory)
+    BUILD_MAX_CONCURRENCY: int = int(os.getenv("BUILD_MAX_CONCURRENCY", "0"))
+    BUILD_CPUS_PER_SLOT: float = float(os.getenv("BUILD_CPUS_PER_SLOT", "2"))
+    BUILD_MEMORY_PER_SLOT_MB: int = int(os.getenv("BUILD_MEMORY_PER_SLOT_MB", "2048"))
+    
+    # Routing Configuration
+    NGINX_CONF_DIR: str = os.getenv("NGINX_CONF_DIR", "/etc/nginx/conf.d")
+    NGINX_ROUTING_MODE: str = os.getenv("NGINX_ROUTING_MODE", "server")  # "server" or "map"
+    NGINX_RELOAD_DEBOUNCE: float = float(os.getenv("NGINX_RELOAD_DEBOUNCE", "2"))
+    NGINX_ACTIVITY_LOG: str = os.getenv("NGINX_ACTIVITY_LOG", "/var/log/nginx/zipp_activity.log")
+    
+    # Replica Configuration
+    MAX_REPLICAS: int = int(os.getenv("MAX_REPLICAS", "10"))
+    UPSTREAM_KEEPALIVE: int = int(os.getenv("UPSTREAM_KEEPALIVE", "16"))
+    UPSTREAM_MAX_FAILS: int = int(os.getenv("UPSTREAM_MAX_FAILS", "3"))
+    UPSTREAM_FAIL_TIMEOUT: int = int(os.getenv("UPSTREAM_FAIL_TIMEOUT", "10"))
+    # Seconds old containers keep serving in-flight requests after a redeploy switches traffic
+    REDEPLOY_DRAIN_SECONDS: float = float(os.getenv("REDEPLOY_DRAIN_SECONDS", "10"))
+    
+    # Bulk Operations Configuration
+    BULK_MAX_ITEMS: int = int(os.getenv("BULK_MAX_ITEMS", "100"))
+    BULK_MAX_CONCURRENCY: int = int(os.getenv("BULK_MAX_CONCURRENCY", "8"))
+    
+    # Scale-to-zero Configuration (0 disables idle shutdown)
+    SCALE_TO_ZERO_IDLE_SECONDS: int = int(os.getenv("SCALE_TO_ZERO_IDLE_SECONDS", "0"))
+    SCALE_TO_ZERO_CHECK_INTERVAL: float = float(os.getenv("SCALE_TO_ZERO_CHECK_INTERVAL", "60"))
+    WAKE_TIMEOUT: float = float(os.getenv("WAKE_TIMEOUT", "30"))
+    
     # Storage Configuration
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "./uploads")
     CLONE_DIR: str = os.getenv("CLONE_DIR", "./clones")
     
+    # Chunked Upload Configuration (sessions idle for the TTL are removed)
+    UPLOAD_CHUNK_SIZE_MB: int = int(os.getenv("UPLOAD_CHUNK_SIZE_MB", "8"))
+    UPLOAD_MAX_CHUNK_SIZE_MB: int = int(os.getenv("UPLOAD_MAX_CHUNK_SIZE_MB", "64"))
+    UPLOAD_MAX_SIZE_MB: int = int(os.getenv("UPLOAD_MAX_SIZE_MB", "2048"))
+    UPLOAD_SESSION_TTL: float = float(os.getenv("UPLOAD_SESSION_TTL", "86400"))
+    UPLOAD_SWEEP_INTERVAL: float = float(os.getenv("UPLOAD_SWEEP_INTERVAL", "900"))
+    
+    # Archive Store Configuration (uploads are stored once per SHA-256 digest under UPLOAD_DIR)
+    ARCHIVE_STORE_RETENTION: float = float(os.getenv("ARCHIVE_STORE_RETENTION", str(7 * 86400)))
+    ARCHIVE_STORE_BUDGET_MB: int = int(os.getenv("ARCHIVE_STORE_BUDGET_MB", "10240"))
+    ARCHIVE_STORE_GC_INTERVAL: float = float(os.getenv("ARCHIVE_STORE_GC_INTERVAL", "3600"))
+    
+    # Reconciliation Configuration (interval 0 reconciles at startup only)
+    RECONCILE_INTERVAL: float = float(os.getenv("RECONCILE_INTERVAL", "900"))
+    RECONCILE_GRACE_SECONDS: float = float(os.getenv("RECONCILE_GRACE_SECONDS", "3600"))
+    RECONCILE_MAX_CONCURRENCY: int = int(os.getenv("RECONCILE_MAX_CONCURRENCY", "8"))
+    
+    # Image Garbage Collection Configuration (interval 0 disables)
+    IMAGE_GC_INTERVAL: float = float(os.getenv("IMAGE_GC_INTERVAL", "3600"))
+    IMAGE_GC_KEEP_PER_DEPLOYMENT: int = int(os.getenv("IMAGE_GC_KEEP_PER_DEPLOYMENT", "3"))
+    IMAGE_GC_DISK_BUDGET_MB: int = int(os.getenv("IMAGE_GC_DISK_BUDGET_MB", "10240"))
+    
+    # User Counter Verification Configuration (interval 0 disables)
+    COUNTER_VERIFY_INTERVAL: float = float(os.getenv("COUNTER_VERIFY_INTERVAL", "3600"))
+    
+    # Image Registry Configuration (empty REGISTRY_ADDRESS disables pushing; GC interval 0 disables cleanup)
+    REGISTRY_ADDRESS: str = os.getenv("REGISTRY_ADDRESS", "")
+    REGISTRY_API_URL: str = os.getenv("REGISTRY_API_URL", "")
+    REGISTRY_REPOSITORY: str = os.getenv("REGISTRY_REPOSITORY", "zipp/deployments")
+    REGISTRY_USERNAME: str = os.getenv("REGISTRY_USERNAME", "")
+    REGISTRY_PASSWORD: str = os.getenv("REGISTRY_PASSWORD", "")
+    REGISTRY_KEEP_PER_DEPLOYMENT: int = int(os.getenv("REGISTRY_KEEP_PER_DEPLOYMENT", "3"))
+    REGISTRY_GC_INTERVAL: float = float(os.getenv("REGISTRY_GC_INTERVAL", "3600"))
+    
+    # Container Stats Configuration
+    STATS_SAMPLE_INTERVAL: float = float(os.getenv("STATS_SAMPLE_INTERVAL", "15"))
+    STATS_HISTORY_SIZE: int = int(os.getenv("STATS_HISTORY_SIZE", "240"))
+    STATS_MAX_CONCURRENCY: int = int(os.getenv("STATS_MAX_CONCURRENCY", "8"))
+    
+    # Right-sizing Configuration
+    RIGHTSIZING_MIN_SAMPLES: int = int(os.getenv("RIGHTSIZING_MIN_SAMPLES", "40"))
+    RIGHTSIZING_HEADROOM: float = float(os.getenv("RIGHTSIZING_HEADROOM", "1.3"))
+    
+    # Container Logs Configuration
+    LOGS_DEFAULT_TAIL: int = int(os.getenv("LOGS_DEFAULT_TAIL", "1000"))
+    LOGS_MAX_BYTES: int = int(os.getenv("LOGS_MAX_BYTES", str(1024 * 1024)))
+    
+    # Deployment Events Configuration (empty EVENTS_REDIS_URL keeps events within one instance)
+    EVENTS_REDIS_URL: str = os.getenv("EVENTS_REDIS_URL", "")
+    EVENTS_REDIS_CHANNEL: str = os.getenv("EVENTS_REDIS_CHANNEL", "zipp:deployment-events")
+    EVENTS_QUEUE_SIZE: int = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+    EVENTS_HEARTBEAT_SECONDS: float = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+    
+    # Rate Limiting Configuration (token buckets per user, or per IP for sign-in; 0 per minute disables a budget)
+    RATE_LIMIT_DEPLOY_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_DEPLOY_PER_MINUTE", "6"))
+    RATE_LIMIT_DEPLOY_BURST: int = int(os.getenv("RATE_LIMIT_DEPLOY_BURST", "10"))
+    RATE_LIMIT_READ_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_READ_PER_MINUTE", "300"))
+    RATE_LIMIT_READ_BURST: int = int(os.getenv("RATE_LIMIT_READ_BURST", "60"))
+    RATE_LIMIT_STREAM_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_STREAM_PER_MINUTE", "30"))
+    RATE_LIMIT_STREAM_BURST: int = int(os.getenv("RATE_LIMIT_STREAM_BURST", "10"))
+    RATE_LIMIT_AUTH_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_AUTH_PER_MINUTE", "30"))
+    RATE_LIMIT_AUTH_BURST: int = int(os.getenv("RATE_LIMIT_AUTH_BURST", "20"))
+    RATE_LIMIT_MAX_BUCKETS: int = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+    RATE_LIMIT_REDIS_URL: str = os.getenv("RATE_LIMIT_REDIS_URL", "")
+    # Comma-separated proxy IPs/CIDRs whose X-Real-IP header names the client
+    RATE_LIMIT_TRUSTED_PROXIES: str = os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "127.0.0.1,::1")
+    
     @property
     def firebase_credentials(self) -> dict:
         """Return Firebase credentials as a dictionary for service account initialization."""
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import time
+from typing import Optional, Dict, Any
+from config import settings
+from firebase_config import firebase_service
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class UserCounterVerifier:
+    """Repairs drift in the per-user deployment counters.
+
+    The counters move by atomic increments with every deployment write made through
+    FirebaseService, so they only drift when a record is changed some other way. Each pass
+    recounts from the deployment records and rewrites the counters of users that disagree.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the periodic verification loop"""
+        if self.interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"User counter verifier started (every {self.interval}s)")
+
+    async def stop(self):
+        """Stop the periodic verification loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.verify()
+            except Exception as e:
+                logger.warning(f"User counter verification failed: {e}")
+
+    async def verify(self) -> Dict[str, Any]:
+        """Compare every user's counters with their deployment records and repair the ones that drifted"""
+        recorded = await firebase_service.get_user_counters()
+        expected = await firebase_service.count_deployments_by_user()
+        if recorded is None or expected is None:
+            raise RuntimeError("could not read users or deployments")
+
+        empty = {'deployments_count': 0, 'active_deployments': 0}
+        drifted = [uid for uid, counters in recorded.items() if counters != expected.get(uid, empty)]
+        repaired = 0
+        for uid in drifted:
+            # Recounted in a transaction, so writes since the scan above are not lost
+            if await firebase_service.recount_user_deployments(uid) is not None:
+                repaired += 1
+
+        summary = {
+            'users_checked': len(recorded),
+            'users_drifted': len(drifted),
+            'users_repaired': repaired,
+            'completed_at': time.time()
+        }
+        self.last_run = summary
+        metrics.user_counter_repairs_total.inc(repaired)
+        if drifted:
+            logger.info(f"Repaired deployment counters of {repaired} of {len(drifted)} users that drifted")
+        return summary
+
+# Global user counter verifier instance
+counter_verifier = UserCounterVerifier(interval=settings.COUNTER_VERIFY_INTERVAL)
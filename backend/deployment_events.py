@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any, Set
+from config import settings
+import metrics
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    # Optional: without it events only reach clients connected to the same instance
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds between attempts to resubscribe after the Redis connection drops
+REDIS_RETRY_INTERVAL = 5
+
+class EventSubscription:
+    """One client's stream of events for a single deployment or for all of a user's deployments"""
+
+    def __init__(self, user_id: str, deployment_ids: Set[str], follow_new: bool, queue_size: int):
+        self.user_id = user_id
+        self.deployment_ids = deployment_ids
+        # Subscriptions to all deployments pick up ones the user creates later
+        self.follow_new = follow_new
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        deployment_id = event['deployment_id']
+        if deployment_id in self.deployment_ids:
+            return True
+        if self.follow_new and event.get('user_id') == self.user_id:
+            self.deployment_ids.add(deployment_id)
+            return True
+        return False
+
+    def put(self, event: Dict[str, Any]):
+        """Queue an event; a client that falls behind loses its oldest events, not the latest ones"""
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+class DeploymentEventBus:
+    """Publishes deployment record changes to subscribed clients.
+
+    Every write to a deployment record publishes an event. Without Redis, events go straight
+    to this process's subscribers. With Redis they go through a channel every API instance
+    listens on, so clients see changes made by any instance.
+    """
+
+    def __init__(self, redis_url: str, channel: str, queue_size: int):
+        self.redis_url = redis_url
+        self.channel = channel
+        self.queue_size = queue_size
+        self._subscriptions: Set[EventSubscription] = set()
+        self._redis = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Set[asyncio.Task] = set()
+
+    def publish(self, deployment_id: str, event_type: str, changes: Optional[Dict[str, Any]] = None,
+                user_id: Optional[str] = None):
+        """Announce a change to a deployment record; never blocks the caller"""
+        event = {
+            'type': event_type,
+            'deployment_id': deployment_id,
+            'changes': _event_changes(changes or {}),
+            'timestamp': time.time()
+        }
+        if user_id:
+            event['user_id'] = user_id
+
+        if self._redis is None:
+            self._deliver(event)
+            return
+        task = asyncio.get_running_loop().create_task(self._publish_redis(event))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    def subscribe(self, user_id: str, deployment_id: Optional[str] = None) -> EventSubscription:
+        """Subscribe to one deployment, or to all of a user's deployments (add the existing ones' IDs)"""
+        if deployment_id:
+            subscription = EventSubscription(user_id, {deployment_id}, False, self.queue_size)
+        else:
+            subscription = EventSubscription(user_id, set(), True, self.queue_size)
+        self._subscriptions.add(subscription)
+        metrics.deployment_event_subscribers.set(len(self._subscriptions))
+        return subscription
+
+    def unsubscribe(self, subscription: EventSubscription):
+        self._subscriptions.discard(subscription)
+        metrics.deployment_event_subscribers.set(len(self._subscriptions))
+
+    def _deliver(self, event: Dict[str, Any]):
+        for subscription in list(self._subscriptions):
+            if subscription.matches(event):
+                subscription.put(event)
+                if event['type'] == 'deleted':
+                    subscription.deployment_ids.discard(event['deployment_id'])
+
+    async def _publish_redis(self, event: Dict[str, Any]):
+        try:
+            await self._redis.publish(self.channel, json.dumps(event))
+        except Exception as e:
+            # Local subscribers still hear about it
+            logger.warning(f"Could not publish deployment event to Redis: {e}")
+            self._deliver(event)
+
+    def start(self):
+        """Connect the Redis fan-out, when configured"""
+        if not self.redis_url:
+            return
+        if redis is None:
+            logger.warning("EVENTS_REDIS_URL is set but the redis package is not installed; "
+                           "deployment events stay within this instance")
+            return
+        if self._task is None or self._task.done():
+            self._redis = redis.from_url(self.redis_url)
+            self._task = asyncio.create_task(self._listen())
+            logger.info(f"Deployment events fan out through Redis channel {self.channel}")
+
+    async def stop(self):
+        """Stop listening on Redis and close the connection"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._redis is not None:
+            client, self._redis = self._redis, None
+            await client.aclose()
+
+    async def _listen(self):
+        """Relay events published by every instance to this instance's subscribers"""
+        while True:
+            try:
+                async with self._redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self._deliver(json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Deployment event subscription to Redis failed: {e}")
+                await asyncio.sleep(REDIS_RETRY_INTERVAL)
+
+def snapshot_event(deployment_id: str, deployment_data: Dict[str, Any]) -> Dict[str, Any]:
+    """An event carrying a deployment's current state, sent when a client subscribes"""
+    return {
+        'type': 'snapshot',
+        'deployment_id': deployment_id,
+        'changes': _event_changes({key: value for key, value in deployment_data.items() if key != 'id'}),
+        'timestamp': time.time()
+    }
+
+def _event_changes(update_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The JSON-safe part of a record write; build logs are reduced to their latest line"""
+    changes = {}
+    for key, value in update_data.items():
+        if key == 'user_id':
+            continue
+        if key == 'build_logs':
+            if value:
+                changes['latest_log'] = value[-1]
+            continue
+        if isinstance(value, datetime):
+            changes[key] = value.isoformat()
+        elif value is None or isinstance(value, (str, int, float, bool, list, dict)):
+            changes[key] = value
+        # Server-side sentinels such as SERVER_TIMESTAMP have no client-side value
+    return changes
+
+# Global deployment event bus
+deployment_events = DeploymentEventBus(
+    redis_url=settings.EVENTS_REDIS_URL,
+    channel=settings.EVENTS_REDIS_CHANNEL,
+    queue_size=settings.EVENTS_QUEUE_SIZE
+)
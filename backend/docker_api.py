@@ -0,0 +1,325 @@
+import asyncio
+import json
+import logging
+import struct
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, AsyncIterator, AsyncIterable, Iterator, Union
+from urllib.parse import urlparse, quote
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Bytes handed to the event loop per hop when a blocking iterator feeds a request body
+BODY_BATCH_SIZE = 1024 * 1024
+# Base64 of "{}": no credentials, for registries that do not require them
+ANONYMOUS_REGISTRY_AUTH = "e30="
+
+class DockerAPIError(Exception):
+    """An error response from the Docker Engine API"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+class DockerNotFound(DockerAPIError):
+    """The container or image does not exist"""
+
+class AsyncDockerClient:
+    """asyncio-native client for one Docker daemon's Engine API.
+
+    Requests share a pool of keep-alive connections to the daemon socket, so concurrent
+    operations run side by side on the event loop instead of each holding a thread and a
+    connection of its own. Streaming endpoints (build, logs, stats, events) are async
+    iterators that close their connection when the caller stops iterating.
+    """
+
+    def __init__(self, base_url: str, pool_size: int, timeout: float):
+        parsed = urlparse(base_url)
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        if parsed.scheme == "unix":
+            transport = httpx.AsyncHTTPTransport(uds=parsed.path, limits=limits)
+            url = "http://docker"
+        elif parsed.scheme in ("tcp", "http"):
+            transport = httpx.AsyncHTTPTransport(limits=limits)
+            url = f"http://{parsed.netloc}"
+        elif parsed.scheme == "https":
+            transport = httpx.AsyncHTTPTransport(limits=limits)
+            url = f"https://{parsed.netloc}"
+        else:
+            raise ValueError(f"Unsupported Docker host URL: {base_url}")
+        self.base_url = base_url
+        self.timeout = timeout
+        self._http = httpx.AsyncClient(transport=transport, base_url=url, timeout=timeout)
+        self._prefix: Optional[str] = None
+        self._version_lock: Optional[asyncio.Lock] = None
+
+    async def close(self):
+        await self._http.aclose()
+
+    # System
+
+    async def ping(self) -> bool:
+        response = await self._http.get("/_ping")
+        await _raise_for_status(response)
+        return True
+
+    async def version(self) -> Dict[str, Any]:
+        response = await self._http.get("/version")
+        await _raise_for_status(response)
+        return response.json()
+
+    async def events(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     filters: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield daemon events as they happen (or up to `until`)"""
+        params = {'since': _timestamp(since), 'until': _timestamp(until), 'filters': _filters(filters)}
+        async with self._stream("GET", "/events", params=params) as response:
+            async for event in _json_lines(response):
+                yield event
+
+    # Containers
+
+    async def list_containers(self, all: bool = False,
+                              filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        return await self._json("GET", "/containers/json", params={'all': all, 'filters': _filters(filters)})
+
+    async def inspect_container(self, container_id: str) -> Dict[str, Any]:
+        return await self._json("GET", f"/containers/{quote(container_id)}/json")
+
+    async def create_container(self, config: Dict[str, Any], name: Optional[str] = None) -> str:
+        """Create a container from an Engine API container config and return its ID"""
+        created = await self._json("POST", "/containers/create", params={'name': name}, json=config)
+        return created['Id']
+
+    async def start_container(self, container_id: str):
+        await self._json("POST", f"/containers/{quote(container_id)}/start")
+
+    async def stop_container(self, container_id: str, timeout: Optional[int] = None):
+        # The daemon waits up to `timeout` before killing, so the request must outlast it
+        wait = (timeout if timeout is not None else 10) + self.timeout
+        await self._json("POST", f"/containers/{quote(container_id)}/stop", params={'t': timeout}, timeout=wait)
+
+    async def remove_container(self, container_id: str, force: bool = False):
+        await self._json("DELETE", f"/containers/{quote(container_id)}", params={'force': force})
+
+    async def update_container(self, container_id: str, resources: Dict[str, Any]):
+        """Change a container's resource limits (Memory, MemorySwap, CpuPeriod, CpuQuota, ...)"""
+        await self._json("POST", f"/containers/{quote(container_id)}/update", json=resources)
+
+    async def container_logs(self, container_id: str, follow: bool = False, tail: Optional[int] = None,
+                             since: Optional[datetime] = None, until: Optional[datetime] = None) -> AsyncIterator[bytes]:
+        """Yield a container's stdout and stderr output as raw chunks"""
+        info = await self.inspect_container(container_id)
+        params = {
+            'stdout': True,
+            'stderr': True,
+            'follow': follow,
+            'tail': tail if tail is not None else 'all',
+            'since': _timestamp(since),
+            'until': _timestamp(until),
+        }
+        async with self._stream("GET", f"/containers/{quote(container_id)}/logs", params=params) as response:
+            if info.get('Config', {}).get('Tty'):
+                async for chunk in response.aiter_bytes():
+                    yield chunk
+            else:
+                async for chunk in _demultiplex(response):
+                    yield chunk
+
+    async def stats(self, container_id: str) -> Dict[str, Any]:
+        """One stats reading; the daemon waits for a second sample so CPU deltas are filled in"""
+        return await self._json("GET", f"/containers/{quote(container_id)}/stats", params={'stream': False})
+
+    async def stream_stats(self, container_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """Yield a stats reading about every second until the caller stops"""
+        async with self._stream("GET", f"/containers/{quote(container_id)}/stats", params={'stream': True}) as response:
+            async for reading in _json_lines(response):
+                yield reading
+
+    # Images
+
+    async def build(self, context: AsyncIterable[bytes], tag: Optional[str] = None,
+                    labels: Optional[Dict[str, str]] = None, dockerfile: Optional[str] = None,
+                    rm: bool = True, forcerm: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """Send an uncompressed tar build context as it is produced and yield the build output.
+
+        Leaving the iteration early closes the connection, which makes the daemon abort the build.
+        """
+        params = {
+            't': tag,
+            'labels': json.dumps(labels) if labels else None,
+            'dockerfile': dockerfile,
+            'rm': rm,
+            'forcerm': forcerm,
+        }
+        async with self._stream("POST", "/build", params=params, content=context,
+                                headers={'Content-Type': 'application/x-tar'}) as response:
+            async for chunk in _json_lines(response):
+                yield chunk
+
+    async def inspect_image(self, image: str) -> Dict[str, Any]:
+        return await self._json("GET", f"/images/{quote(image, safe='/:@')}/json")
+
+    async def tag_image(self, image: str, repository: str, tag: str):
+        await self._json("POST", f"/images/{quote(image, safe='/:@')}/tag", params={'repo': repository, 'tag': tag})
+
+    async def push_image(self, repository: str, tag: str,
+                         auth: str = ANONYMOUS_REGISTRY_AUTH) -> AsyncIterator[Dict[str, Any]]:
+        """Push a tag to its registry and yield the progress output; the last `aux` entry has the digest"""
+        async with self._stream("POST", f"/images/{quote(repository, safe='/:')}/push", params={'tag': tag},
+                                headers={'X-Registry-Auth': auth}) as response:
+            async for chunk in _json_lines(response):
+                yield chunk
+
+    async def pull_image(self, repository: str, reference: str,
+                         auth: str = ANONYMOUS_REGISTRY_AUTH) -> AsyncIterator[Dict[str, Any]]:
+        """Pull an image by tag or digest and yield the progress output"""
+        async with self._stream("POST", "/images/create", params={'fromImage': repository, 'tag': reference},
+                                headers={'X-Registry-Auth': auth}) as response:
+            async for chunk in _json_lines(response):
+                yield chunk
+
+    async def remove_image(self, image: str, force: bool = False):
+        await self._json("DELETE", f"/images/{quote(image)}", params={'force': force})
+
+    # Transport
+
+    async def _json(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                    json: Any = None, timeout: Optional[float] = None) -> Any:
+        response = await self._http.request(
+            method,
+            await self._url(path),
+            params=_params(params),
+            json=json,
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        )
+        await _raise_for_status(response)
+        if response.status_code in (204, 304) or not response.content:
+            return None
+        return response.json()
+
+    def _stream(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                **kwargs) -> "_StreamedResponse":
+        return _StreamedResponse(self, method, path, _params(params), kwargs)
+
+    async def _url(self, path: str) -> str:
+        """Path under the API version the daemon speaks, negotiated on first use"""
+        if self._prefix is None:
+            if self._version_lock is None:
+                self._version_lock = asyncio.Lock()
+            async with self._version_lock:
+                if self._prefix is None:
+                    self._prefix = f"/v{(await self.version())['ApiVersion']}"
+        return self._prefix + path
+
+class _StreamedResponse:
+    """Async context manager sending a request and closing its streamed response on exit"""
+
+    def __init__(self, client: AsyncDockerClient, method: str, path: str,
+                 params: Dict[str, Any], kwargs: Dict[str, Any]):
+        self._client = client
+        self._method = method
+        self._path = path
+        self._params = params
+        self._kwargs = kwargs
+        self._response: Optional[httpx.Response] = None
+
+    async def __aenter__(self) -> httpx.Response:
+        request = self._client._http.build_request(
+            self._method,
+            await self._client._url(self._path),
+            params=self._params,
+            # Streams may stay quiet for a long time (follow, events, long build steps)
+            timeout=httpx.Timeout(self._client.timeout, read=None),
+            **self._kwargs
+        )
+        self._response = await self._client._http.send(request, stream=True)
+        try:
+            await _raise_for_status(self._response)
+        except BaseException:
+            await self._response.aclose()
+            raise
+        return self._response
+
+    async def __aexit__(self, *exc_info):
+        await self._response.aclose()
+
+async def iterate_in_thread(iterator: Iterator[bytes], batch_size: int = BODY_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """Drive a blocking byte iterator from worker threads, a batch at a time, for use as a request body"""
+    batches = _batched(iterator, batch_size)
+    while True:
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            return
+        yield batch
+
+def _batched(iterator: Iterator[bytes], batch_size: int) -> Iterator[bytes]:
+    pending = []
+    size = 0
+    for chunk in iterator:
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= batch_size:
+            yield b"".join(pending)
+            pending = []
+            size = 0
+    if pending:
+        yield b"".join(pending)
+
+async def _raise_for_status(response: httpx.Response):
+    # 304 is how the daemon says a container was already started or stopped
+    if response.status_code < 400 or response.status_code == 304:
+        return
+    await response.aread()
+    try:
+        message = response.json().get('message', response.text)
+    except ValueError:
+        message = response.text
+    error = DockerNotFound if response.status_code == 404 else DockerAPIError
+    raise error(response.status_code, message.strip())
+
+async def _json_lines(response: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+    buffer = b""
+    async for chunk in response.aiter_bytes():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if buffer.strip():
+        yield json.loads(buffer)
+
+async def _demultiplex(response: httpx.Response) -> AsyncIterator[bytes]:
+    """Strip the 8-byte frame headers Docker puts on non-TTY stdout/stderr output"""
+    buffer = b""
+    async for chunk in response.aiter_bytes():
+        buffer += chunk
+        while len(buffer) >= 8:
+            _, length = struct.unpack(">BxxxL", buffer[:8])
+            if len(buffer) < 8 + length:
+                break
+            yield buffer[8:8 + length]
+            buffer = buffer[8 + length:]
+
+def _params(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Query parameters without unset values, booleans the way the daemon expects"""
+    result = {}
+    for key, value in (params or {}).items():
+        if value is None:
+            continue
+        result[key] = int(value) if isinstance(value, bool) else value
+    return result
+
+def _filters(filters: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not filters:
+        return None
+    return json.dumps({key: value if isinstance(value, list) else [value] for key, value in filters.items()})
+
+def _timestamp(value: Optional[Union[datetime, int, float]]) -> Optional[int]:
+    """Unix seconds for the daemon; datetimes without a zone are taken as UTC, not server-local time"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    return int(value)
@@ -4,95 +4,201 @@ import shutil
 import uuid
 import asyncio
 import logging
-from typing import Optional, Dict, Any, List, Tuple
-from git import Repo
-import zipfile
+from typing import Optional, Dict, Any, List, Set, Tuple, AsyncIterator, Union
+from datetime import datetime
+from git import Repo, Git
 import tempfile
 from pathlib import Path
 from config import settings
-from models import DeploymentStatus, DeploymentType
+from models import DeploymentStatus, DeploymentType, ResourceTier
+from metrics import stage_timer
+from host_pool import host_pool, DockerHost
+from cancellation import CancelToken, run_cancellable
+from project_source import ProjectSource, ArchiveSource, TarballSource, as_source, open_archive_source
+from docker_api import DockerNotFound, iterate_in_thread
+from image_registry import image_registry
+import metrics
 import json
 import random
+import signal
+import subprocess
+from collections import deque
 
 logger = logging.getLogger(__name__)
 
+# Labels applied to deployment images and containers
+LABEL_DEPLOYMENT_ID = "zipp.deployment_id"
+LABEL_USER_ID = "zipp.user_id"
+
+# Resource limits for deployment containers, by tier; CPU quota is per CONTAINER_CPU_PERIOD
+CONTAINER_CPU_PERIOD = 100000
+RESOURCE_TIERS = {
+    ResourceTier.MICRO.value: {'mem_limit': "128m", 'cpu_quota': 25000},
+    ResourceTier.SMALL.value: {'mem_limit': "512m", 'cpu_quota': 50000},
+    ResourceTier.MEDIUM.value: {'mem_limit': "1g", 'cpu_quota': 100000},
+    ResourceTier.LARGE.value: {'mem_limit': "2g", 'cpu_quota': 200000},
+}
+# The limits every container had before tiers existed
+DEFAULT_RESOURCE_TIER = ResourceTier.SMALL.value
+
+# Default tier for each detected project type
+PROJECT_TYPE_TIERS = {
+    'static': ResourceTier.MICRO.value,
+    'react': ResourceTier.MICRO.value,  # Built assets served by nginx
+    'python': ResourceTier.SMALL.value,
+    'nodejs': ResourceTier.SMALL.value,
+    'nextjs': ResourceTier.MEDIUM.value,
+}
+
+def parse_memory(limit: str) -> int:
+    """Convert a Docker memory string such as "512m" to bytes"""
+    units = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    limit = limit.strip().lower()
+    if limit[-1] in units:
+        return int(float(limit[:-1]) * units[limit[-1]])
+    return int(limit)
+
+def deployment_replicas(deployment: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The containers serving a deployment; records from before replicas only have the primary"""
+    if deployment.get('replica_set'):
+        return deployment['replica_set']
+    if deployment.get('container_id'):
+        return [{
+            'container_id': deployment['container_id'],
+            'port': deployment.get('port'),
+            'docker_host': deployment.get('docker_host')
+        }]
+    return []
+
+def dockerfile_base_images(dockerfile: str) -> List[str]:
+    """Registry images a Dockerfile builds FROM, skipping its own stages and scratch"""
+    images = []
+    stages = set()
+    for line in dockerfile.splitlines():
+        parts = line.strip().split()
+        if len(parts) < 2 or parts[0].upper() != 'FROM':
+            continue
+        args = [part for part in parts[1:] if not part.startswith('--')]
+        if not args:
+            continue
+        image = args[0]
+        if image.lower() not in stages and image != 'scratch' and '$' not in image and image not in images:
+            images.append(image)
+        if len(args) >= 3 and args[1].lower() == 'as':
+            stages.add(args[2].lower())
+    return images
+
+class Placement:
+    """A host, port and capacity reservation made for a deployment ahead of its build"""
+    
+    def __init__(self, host: DockerHost, image_name: str, port: int, resource_tier: str):
+        self.host = host
+        self.image_name = image_name
+        self.port = port
+        self.resource_tier = resource_tier
+        # (content, generated) once the Dockerfile has been resolved
+        self.dockerfile: Optional[Tuple[str, bool]] = None
+        # Base image pull started while the build waits for its slot
+        self.prefetch: Optional[asyncio.Task] = None
+
 class DockerService:
     def __init__(self):
-        self.client = docker.from_env()
-        self.used_ports = set()
+        # No Docker calls here: clients connect on first use and port tracking is
+        # synced by the startup warm-up
+        self.hosts = host_pool
+        # Clone checkouts and uploaded archives that pipelines in this process still need
+        self.work_paths: set = set()
         self.ensure_directories()
-        self.cleanup_orphaned_ports()
     
-    def cleanup_orphaned_ports(self):
-        """Clean up any orphaned port reservations on startup"""
-        try:
-            # Get all actually used ports by running containers
-            used_ports = set()
-            containers = self.client.containers.list(all=True)
-            for container in containers:
-                if container.ports:
-                    for port_info in container.ports.values():
-                        if port_info:
-                            for port_mapping in port_info:
-                                if 'HostPort' in port_mapping:
-                                    used_ports.add(int(port_mapping['HostPort']))
-            
-            # Reset our internal tracking to match reality
-            self.used_ports = used_ports.copy()
-            logger.info(f"Cleaned up port tracking. Currently used ports: {self.used_ports}")
-        except Exception as e:
-            logger.warning(f"Could not cleanup orphaned ports: {e}")
-            self.used_ports = set()  # Reset to empty if we can't determine
+    @property
+    def client(self) -> docker.DockerClient:
+        """Client for the default Docker host"""
+        return self.hosts.default.client
+    
+    def get_client(self, host: Optional[str] = None) -> docker.DockerClient:
+        """Client for the named Docker host (the default host when unset)"""
+        return self.hosts.get(host).client
+    
+    def _host_ports_in_use(self, host: DockerHost) -> set:
+        """Host ports bound by any container on a Docker host, running or stopped"""
+        used_ports = set()
+        containers = host.client.containers.list(all=True)
+        for container in containers:
+            # Stopped containers publish nothing but keep their bindings for the next start
+            bindings = (container.attrs.get('HostConfig') or {}).get('PortBindings') or {}
+            for port_info in bindings.values():
+                for port_mapping in port_info or []:
+                    if port_mapping.get('HostPort'):
+                        used_ports.add(int(port_mapping['HostPort']))
+        return used_ports
+    
+    def cleanup_orphaned_ports(self, sleeping: Optional[List[Dict[str, Any]]] = None):
+        """Sync port tracking with the ports bound on each host at startup
+        
+        Ports of scaled-to-zero deployments stay reserved even if their containers are gone,
+        since waking starts them on the recorded port.
+        """
+        reserved: Dict[str, set] = {}
+        for deployment in sleeping or []:
+            for replica in deployment_replicas(deployment):
+                if replica.get('port'):
+                    name = self.hosts.get(replica.get('docker_host')).name
+                    reserved.setdefault(name, set()).add(int(replica['port']))
+        
+        for host in self.hosts:
+            try:
+                # Merged, not replaced: deployments may already have been placed while warming up
+                host.used_ports |= self._host_ports_in_use(host) | reserved.get(host.name, set())
+                logger.info(f"Cleaned up port tracking on {host.name}. Currently used ports: {host.used_ports}")
+            except Exception as e:
+                logger.warning(f"Could not cleanup orphaned ports on {host.name}: {e}")
     
     def ensure_directories(self):
         """Ensure upload and clone directories exist"""
         os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
         os.makedirs(settings.CLONE_DIR, exist_ok=True)
     
-    def get_available_port(self) -> int:
-        """Get an available port for deployment"""
+    def get_available_port(self, host: Optional[DockerHost] = None) -> int:
+        """Get an available port for deployment on a Docker host"""
+        host = host or self.hosts.default
+        
         # Get all currently used ports by Docker containers
         used_ports = set()
         try:
-            containers = self.client.containers.list(all=True)
-            for container in containers:
-                if container.ports:
-                    for port_info in container.ports.values():
-                        if port_info:
-                            for port_mapping in port_info:
-                                if 'HostPort' in port_mapping:
-                                    used_ports.add(int(port_mapping['HostPort']))
+            used_ports = self._host_ports_in_use(host)
         except Exception as e:
             logger.warning(f"Could not get Docker port info: {e}")
         
-        logger.info(f"Docker used ports: {used_ports}")
-        logger.info(f"Internally tracked ports: {self.used_ports}")
+        logger.info(f"Docker used ports on {host.name}: {used_ports}")
+        logger.info(f"Internally tracked ports on {host.name}: {host.used_ports}")
         
         # Find an available port
-        for port in range(settings.DEPLOYMENT_PORT_RANGE_START, settings.DEPLOYMENT_PORT_RANGE_END):
-            if port not in used_ports and port not in self.used_ports:
-                # Double-check if port is actually free
-                import socket
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    result = s.connect_ex(('localhost', port))
-                    if result != 0:  # Port is free
-                        logger.info(f"Selected port {port} for deployment")
-                        self.used_ports.add(port)
-                        return port
-                    else:
-                        logger.warning(f"Port {port} appears free in Docker but is actually in use")
+        with host.port_lock:
+            for port in range(settings.DEPLOYMENT_PORT_RANGE_START, settings.DEPLOYMENT_PORT_RANGE_END):
+                if port not in used_ports and port not in host.used_ports:
+                    # Double-check if port is actually free
+                    import socket
+                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                        result = s.connect_ex((host.address, port))
+                        if result != 0:  # Port is free
+                            logger.info(f"Selected port {port} on {host.name} for deployment")
+                            host.used_ports.add(port)
+                            return port
+                        else:
+                            logger.warning(f"Port {port} appears free in Docker but is actually in use")
         
         # If we get here, no ports are available
-        logger.error(f"No available ports in range {settings.DEPLOYMENT_PORT_RANGE_START}-{settings.DEPLOYMENT_PORT_RANGE_END}")
+        logger.error(f"No available ports in range {settings.DEPLOYMENT_PORT_RANGE_START}-{settings.DEPLOYMENT_PORT_RANGE_END} on {host.name}")
         logger.error(f"Used ports: {used_ports}")
-        logger.error(f"Tracked ports: {self.used_ports}")
+        logger.error(f"Tracked ports: {host.used_ports}")
         raise Exception("No available ports in the specified range")
     
-    def release_port(self, port: int):
+    def release_port(self, port: int, host: Optional[str] = None):
         """Release a port back to the available pool"""
-        self.used_ports.discard(port)
+        self.hosts.get(host).used_ports.discard(port)
     
-    async def clone_repository(self, repo_url: str, branch: str = "main") -> Tuple[str, List[str]]:
+    async def clone_repository(self, repo_url: str, branch: str = "main",
+                               cancel_token: Optional[CancelToken] = None) -> Tuple[str, List[str]]:
         """Clone a Git repository and return the local path and logs"""
         logs = []
         try:
@@ -106,7 +212,7 @@ class DockerService:
             
             # Try to clone with the specified branch first
             try:
-                repo = Repo.clone_from(repo_url, clone_path, branch=branch, depth=1)
+                repo = await run_cancellable(self._git_clone, repo_url, clone_path, branch, cancel_token)
                 logs.append(f"Successfully cloned with branch: {branch}")
             except Exception as e:
                 # If the specified branch doesn't exist, try common alternatives
@@ -128,7 +234,7 @@ class DockerService:
                     for alt_branch in alternative_branches:
                         try:
                             logs.append(f"Trying branch: {alt_branch}")
-                            repo = Repo.clone_from(repo_url, clone_path, branch=alt_branch, depth=1)
+                            repo = await run_cancellable(self._git_clone, repo_url, clone_path, alt_branch, cancel_token)
                             logs.append(f"Successfully cloned with branch: {alt_branch}")
                             cloned = True
                             break
@@ -140,7 +246,7 @@ class DockerService:
                         # Last resort: clone without specifying branch (gets default)
                         try:
                             logs.append("Trying to clone default branch...")
-                            repo = Repo.clone_from(repo_url, clone_path, depth=1)
+                            repo = await run_cancellable(self._git_clone, repo_url, clone_path, None, cancel_token)
                             logs.append("Successfully cloned default branch")
                         except Exception as final_e:
                             error_msg = f"Failed to clone repository with any branch: {str(final_e)}"
@@ -159,8 +265,14 @@ class DockerService:
             except:
                 logs.append("Could not determine active branch name")
             
+            self.work_paths.add(clone_path)
             return clone_path, logs
             
+        except asyncio.CancelledError:
+            # The git process has already been killed; drop the partial checkout
+            if 'clone_path' in locals() and os.path.exists(clone_path):
+                shutil.rmtree(clone_path, ignore_errors=True)
+            raise
         except Exception as e:
             error_msg = f"Failed to clone repository: {str(e)}"
             logs.append(error_msg)
@@ -175,35 +287,52 @@ class DockerService:
             
             raise Exception(error_msg)
     
-    async def extract_zip(self, zip_path: str) -> Tuple[str, List[str]]:
-        """Extract a ZIP file and return the local path and logs"""
-        logs = []
+    def _git_clone(self, repo_url: str, clone_path: str, branch: Optional[str] = None,
+                   cancel_token: Optional[CancelToken] = None) -> Repo:
+        """Shallow-clone in a git subprocess that cancellation can kill mid-fetch"""
+        Git.check_unsafe_protocols(repo_url)
+        command = ["git", "clone", "--depth", "1"]
+        if branch:
+            command += ["--branch", branch]
+        command += ["--", repo_url, clone_path]
+        
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            start_new_session=True
+        )
+        # git hands the transfer to helper processes (git-remote-https), so kill the whole group
+        kill = lambda: os.killpg(process.pid, signal.SIGKILL)
+        unregister = cancel_token.on_cancel(kill) if cancel_token else None
         try:
-            # Generate unique directory name
-            extract_id = str(uuid.uuid4())
-            extract_path = os.path.join(settings.CLONE_DIR, extract_id)
-            
-            logs.append(f"Extracting ZIP file: {zip_path}")
-            logs.append(f"Target directory: {extract_path}")
-            
-            # Extract the ZIP file
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_path)
-            
-            # If there's only one directory in the extracted content, use it as the root
-            extracted_contents = os.listdir(extract_path)
-            if len(extracted_contents) == 1 and os.path.isdir(os.path.join(extract_path, extracted_contents[0])):
-                actual_path = os.path.join(extract_path, extracted_contents[0])
-            else:
-                actual_path = extract_path
-            
-            logs.append(f"Successfully extracted ZIP file")
-            logs.append(f"Extracted size: {self._get_directory_size(actual_path)} MB")
-            
-            return actual_path, logs
+            _, stderr = process.communicate()
+        finally:
+            if unregister:
+                unregister()
+        
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        if process.returncode != 0:
+            raise Exception(stderr.strip() or f"git clone exited with status {process.returncode}")
+        return Repo(clone_path)
+    
+    async def open_archive(self, archive_path: str) -> Tuple[Union[ArchiveSource, TarballSource], List[str]]:
+        """Open an uploaded ZIP or compressed tarball as a project source and return it with logs.
+        
+        Only the archive's index is read here; files are streamed into the build later.
+        """
+        logs = [f"Reading archive: {archive_path}"]
+        try:
+            source = await asyncio.to_thread(open_archive_source, archive_path)
+            logs.append(f"Archive contains {source.file_count} files "
+                        f"({round(source.uncompressed_size / (1024 * 1024), 2)} MB uncompressed)")
+            return source, logs
             
         except Exception as e:
-            error_msg = f"Failed to extract ZIP file: {str(e)}"
+            error_msg = f"Failed to read archive: {str(e)}"
             logs.append(error_msg)
             logger.error(error_msg)
             raise Exception(error_msg)
@@ -220,15 +349,15 @@ class DockerService:
                     pass
         return round(total_size / (1024 * 1024), 2)
     
-    def _detect_project_type(self, project_path: str) -> str:
-        """Detect the type of project and return appropriate Dockerfile content"""
-        # Check for common project files
-        files = os.listdir(project_path)
+    def _project_kind(self, project: Union[str, ProjectSource]) -> str:
+        """Detect the kind of project: nextjs, react, nodejs, python or static"""
+        # Check for common project files; only manifests are read, so archives need no extraction
+        source = as_source(project)
+        files = source.top_level()
         
         # Node.js projects
         if 'package.json' in files:
-            with open(os.path.join(project_path, 'package.json'), 'r') as f:
-                package_data = json.load(f)
+            package_data = json.loads(source.read('package.json'))
                 
             # Check if it's a Next.js project
             dependencies = package_data.get('dependencies', {})
@@ -236,22 +365,48 @@ class DockerService:
             all_deps = {**dependencies, **dev_dependencies}
             
             if 'next' in all_deps:
-                return self._generate_nextjs_dockerfile()
+                return 'nextjs'
             elif 'react-scripts' in all_deps:
-                return self._generate_react_dockerfile()
+                return 'react'
             else:
-                return self._generate_nodejs_dockerfile()
+                return 'nodejs'
         
         # Python projects
         if 'requirements.txt' in files or 'setup.py' in files or 'pyproject.toml' in files:
-            return self._generate_python_dockerfile()
+            return 'python'
         
         # Static HTML projects
         if any(f.endswith('.html') for f in files):
-            return self._generate_static_dockerfile()
+            return 'static'
         
         # Default to Node.js if we can't determine the type
-        return self._generate_nodejs_dockerfile()
+        return 'nodejs'
+    
+    def _detect_project_type(self, project: Union[str, ProjectSource]) -> str:
+        """Detect the type of project and return appropriate Dockerfile content"""
+        generators = {
+            'nextjs': self._generate_nextjs_dockerfile,
+            'react': self._generate_react_dockerfile,
+            'nodejs': self._generate_nodejs_dockerfile,
+            'python': self._generate_python_dockerfile,
+            'static': self._generate_static_dockerfile,
+        }
+        return generators[self._project_kind(project)]()
+    
+    def dockerfile_for(self, project: Union[str, ProjectSource]) -> Tuple[str, bool]:
+        """The project's own Dockerfile, or a generated one; the flag tells which"""
+        dockerfile = as_source(project).read('Dockerfile')
+        if dockerfile is not None:
+            return dockerfile.decode('utf-8', 'replace'), False
+        return self._detect_project_type(project), True
+    
+    def default_resource_tier(self, project: Union[str, ProjectSource]) -> str:
+        """Resource tier for a project that did not request one"""
+        try:
+            return PROJECT_TYPE_TIERS.get(self._project_kind(project), DEFAULT_RESOURCE_TIER)
+        except Exception as e:
+            logger.warning(f"Could not detect project type for resource tier: {e}")
+            return DEFAULT_RESOURCE_TIER
     
     def _generate_nextjs_dockerfile(self) -> str:
         return """
@@ -310,38 +465,135 @@ EXPOSE 80
 CMD ["nginx", "-g", "daemon off;"]
 """
     
+    async def place(self, user_id: str, deployment_name: str,
+                    resource_tier: str = DEFAULT_RESOURCE_TIER,
+                    host_name: Optional[str] = None) -> Placement:
+        """Pick the host with the most headroom, or the named one, and reserve capacity and a port on it.
+        
+        Runs before the build needs them, so it can overlap with fetching the sources.
+        """
+        image_name = f"instantsite_{user_id}_{deployment_name}_{uuid.uuid4().hex[:8]}".lower()
+        limits = RESOURCE_TIERS[resource_tier]
+        memory = parse_memory(limits['mem_limit'])
+        cpus = limits['cpu_quota'] / CONTAINER_CPU_PERIOD
+        if host_name:
+            host = self.hosts.get(host_name)
+        else:
+            host = await asyncio.to_thread(self.hosts.select_host, memory, cpus)
+        host.reserve(image_name, memory, cpus)
+        try:
+            with stage_timer("port_allocation"):
+                port = await asyncio.to_thread(self.get_available_port, host)
+        except Exception:
+            host.release(image_name)
+            raise
+        return Placement(host, image_name, port, resource_tier)
+    
+    def resize_placement(self, placement: Placement, resource_tier: str):
+        """Reserve for the final tier once the project type is known"""
+        if resource_tier == placement.resource_tier:
+            return
+        limits = RESOURCE_TIERS[resource_tier]
+        placement.host.reserve(
+            placement.image_name, parse_memory(limits['mem_limit']), limits['cpu_quota'] / CONTAINER_CPU_PERIOD
+        )
+        placement.resource_tier = resource_tier
+    
+    def release_placement(self, placement: Placement):
+        """Give back a placement that will not get a container; safe to call twice"""
+        self.release_port(placement.port, placement.host.name)
+        placement.host.release(placement.image_name)
+    
+    def start_prefetch(self, placement: Placement, project: Union[str, ProjectSource]):
+        """Resolve the Dockerfile and start pulling its base images in the background"""
+        placement.dockerfile = self.dockerfile_for(project)
+        images = dockerfile_base_images(placement.dockerfile[0])
+        placement.prefetch = asyncio.ensure_future(asyncio.to_thread(self._pull_images, placement.host, images))
+    
+    def _pull_images(self, host: DockerHost, images: List[str]) -> List[str]:
+        """Pull images the host does not have yet; failures are left for the build to report"""
+        logs = []
+        for image in images:
+            try:
+                host.client.images.get(image)
+                continue
+            except docker.errors.ImageNotFound:
+                pass
+            except Exception as e:
+                logger.debug(f"Could not inspect image {image} on {host.name}: {e}")
+            try:
+                repository, tag = docker.utils.parse_repository_tag(image)
+                with stage_timer("base_image_pull"):
+                    host.client.images.pull(repository, tag=tag or "latest")
+                logs.append(f"Pulled base image: {image}")
+            except Exception as e:
+                logger.warning(f"Prefetching base image {image} on {host.name} failed: {e}")
+        return logs
+    
     async def build_and_deploy(self, 
-                              project_path: str, 
+                              project: Union[str, ProjectSource], 
                               deployment_name: str,
-                              user_id: str) -> Tuple[str, int, List[str]]:
-        """Build Docker image and deploy container"""
+                              user_id: str,
+                              deployment_id: Optional[str] = None,
+                              resource_tier: str = DEFAULT_RESOURCE_TIER,
+                              cancel_token: Optional[CancelToken] = None,
+                              placement: Optional[Placement] = None) -> Tuple[str, int, str, List[str]]:
+        """Build Docker image and deploy container.
+        
+        `project` is a checkout directory or a project source such as an uploaded archive.
+        `placement` is a host and port reserved ahead of time with place(); without one
+        the deployment is placed here.
+        Returns the container ID, host port, Docker host name and build logs.
+        """
         logs = []
         container_id = None
-        port = None
+        container_name = None
+        source = as_source(project)
         
         try:
-            # Generate unique image name
-            image_name = f"instantsite_{user_id}_{deployment_name}_{uuid.uuid4().hex[:8]}".lower()
+            # Place the build and container on the host with the most headroom
+            if placement is None:
+                placement = await self.place(user_id, deployment_name, resource_tier)
+            else:
+                self.resize_placement(placement, resource_tier)
+            host = placement.host
+            image_name = placement.image_name
+            port = placement.port
+            labels = self._deployment_labels(user_id, deployment_id)
+            
+            limits = RESOURCE_TIERS[resource_tier]
+            logs.append(f"Scheduled on Docker host: {host.name}")
+            logs.append(f"Resource tier: {resource_tier} ({limits['mem_limit']} memory, {limits['cpu_quota'] / CONTAINER_CPU_PERIOD:g} CPU)")
+            logs.append(f"Assigned port: {port}")
             logs.append(f"Building Docker image: {image_name}")
             
-            # Check if Dockerfile exists, if not create one
-            dockerfile_path = os.path.join(project_path, 'Dockerfile')
-            if not os.path.exists(dockerfile_path):
-                logs.append("No Dockerfile found, generating one based on project type...")
-                dockerfile_content = self._detect_project_type(project_path)
-                with open(dockerfile_path, 'w') as f:
-                    f.write(dockerfile_content)
-                logs.append("Generated Dockerfile")
+            # Check if Dockerfile exists, if not generate one for the build context
+            with stage_timer("dockerfile"):
+                dockerfile_content, generated = placement.dockerfile or self.dockerfile_for(source)
+                if generated:
+                    logs.append("No Dockerfile found, generating one based on project type...")
+                    logs.append("Generated Dockerfile")
+            
+            # Base images are normally pulled by now, while the build waited for its slot
+            if placement.prefetch:
+                logs.extend(await placement.prefetch)
+            
+            # Stream the context out of the checkout or archive as the daemon consumes it
+            extra_files = {'Dockerfile': dockerfile_content.encode()} if generated else None
+            context = iterate_in_thread(source.tar_stream(extra_files, cancel_token))
             
             # Build the Docker image
             logs.append("Starting Docker build...")
             try:
-                image, build_logs = self.client.images.build(
-                    path=project_path,
-                    tag=image_name,
-                    rm=True,
-                    forcerm=True
-                )
+                with stage_timer("build"):
+                    build_logs = await self._build_image(
+                        host,
+                        context,
+                        tag=image_name,
+                        labels=labels,
+                        rm=True,
+                        forcerm=True
+                    )
                 
                 # Process build logs
                 for log in build_logs:
@@ -349,27 +601,20 @@ CMD ["nginx", "-g", "daemon off;"]
                         log_line = log['stream'].strip()
                         if log_line:
                             logs.append(f"BUILD: {log_line}")
+                            self._record_build_step(log_line)
                 
+                metrics.builds_total.inc(outcome="success")
                 logs.append(f"Successfully built image: {image_name}")
                 
             except docker.errors.BuildError as e:
+                metrics.builds_total.inc(outcome="failure")
                 error_msg = f"Docker build failed: {str(e)}"
                 logs.append(error_msg)
                 raise Exception(error_msg)
             
-            # Get available port
-            port = self.get_available_port()
-            logs.append(f"Assigned port: {port}")
-            
             # Run the container
             logs.append("Starting container...")
             
-            # Determine which internal port to map based on project type
-            dockerfile_content = ""
-            if os.path.exists(dockerfile_path):
-                with open(dockerfile_path, 'r') as f:
-                    dockerfile_content = f.read()
-            
             # Determine internal port from Dockerfile
             internal_port = 80  # Default for nginx
             if 'EXPOSE 3000' in dockerfile_content:
@@ -379,72 +624,288 @@ CMD ["nginx", "-g", "daemon off;"]
             
             logs.append(f"Mapping internal port {internal_port} to external port {port}")
             
-            container = self.client.containers.run(
-                image_name,
-                ports={f'{internal_port}/tcp': port},
-                detach=True,
-                name=f"instantsite_{deployment_name}_{uuid.uuid4().hex[:8]}",
-                remove=False,
-                mem_limit="512m",
-                cpu_period=100000,
-                cpu_quota=50000  # 50% CPU limit
-            )
+            container_name = f"instantsite_{deployment_name}_{uuid.uuid4().hex[:8]}"
+            with stage_timer("container_start"):
+                container_id = await self._run_container(
+                    host,
+                    container_name,
+                    self._container_config(image_name, f'{internal_port}/tcp', port, labels, resource_tier)
+                )
             
-            container_id = container.id
             logs.append(f"Container started: {container_id}")
-            logs.append(f"Container name: {container.name}")
+            logs.append(f"Container name: {container_name}")
             
-            # Wait a moment for the container to start
-            await asyncio.sleep(2)
-            
-            # Check if container is running
-            container.reload()
-            if container.status != 'running':
-                container_logs = container.logs().decode('utf-8')
-                logs.append(f"Container failed to start. Logs: {container_logs}")
-                raise Exception("Container failed to start")
+            with stage_timer("readiness"):
+                # Wait a moment for the container to start
+                await asyncio.sleep(2)
+                
+                # Check if container is running
+                info = await host.api.inspect_container(container_id)
+                if info['State']['Status'] != 'running':
+                    container_logs = b"".join([chunk async for chunk in host.api.container_logs(container_id)])
+                    logs.append(f"Container failed to start. Logs: {container_logs.decode('utf-8', errors='replace')}")
+                    raise Exception("Container failed to start")
             
             logs.append("Deployment successful!")
-            return container_id, port, logs
-            
+            return container_id, port, host.name, logs
+            
+        except asyncio.CancelledError:
+            # Nothing of a cancelled deployment survives: container, port or image
+            if placement:
+                # Shielded: the discard must finish even though this task is being cancelled
+                await asyncio.shield(self._discard_partial_deployment(
+                    placement.host, container_id or container_name, placement.image_name
+                ))
+                self.release_placement(placement)
+            raise
         except Exception as e:
             # Cleanup on failure
             if container_id:
                 try:
-                    container = self.client.containers.get(container_id)
-                    container.stop()
-                    container.remove()
-                except:
+                    await placement.host.api.stop_container(container_id)
+                    await placement.host.api.remove_container(container_id)
+                except Exception:
                     pass
             
-            if port:
-                self.release_port(port)
+            if placement:
+                self.release_placement(placement)
             
             error_msg = f"Deployment failed: {str(e)}"
             logs.append(error_msg)
             logger.error(error_msg)
             raise Exception(error_msg)
+        finally:
+            if placement:
+                placement.host.release(placement.image_name)
+    
+    async def _build_image(self, host: DockerHost, context: AsyncIterator[bytes], **kwargs) -> List[Dict[str, Any]]:
+        """Build an image and return its log stream.
+        
+        Cancelling the caller closes the build connection, which makes the daemon abort the build.
+        """
+        build_logs = []
+        built = False
+        async for chunk in host.api.build(context, **kwargs):
+            build_logs.append(chunk)
+            if 'error' in chunk:
+                raise docker.errors.BuildError(chunk['error'], build_logs)
+            if 'aux' in chunk or chunk.get('stream', '').startswith('Successfully built '):
+                built = True
+        
+        if not built:
+            raise docker.errors.BuildError(build_logs[-1] if build_logs else 'Unknown', build_logs)
+        return build_logs
+    
+    def _container_config(self, image: str, internal_port: str, port: int,
+                          labels: Dict[str, str], resource_tier: str) -> Dict[str, Any]:
+        """Engine API config for a deployment container publishing one port under a tier's limits"""
+        limits = RESOURCE_TIERS[resource_tier]
+        return {
+            'Image': image,
+            'Labels': labels,
+            'ExposedPorts': {internal_port: {}},
+            'HostConfig': {
+                'PortBindings': {internal_port: [{'HostPort': str(port)}]},
+                'Memory': parse_memory(limits['mem_limit']),
+                'CpuPeriod': CONTAINER_CPU_PERIOD,
+                'CpuQuota': limits['cpu_quota'],
+            },
+        }
+    
+    async def _run_container(self, host: DockerHost, name: str, config: Dict[str, Any]) -> str:
+        """Create and start a container, removing it again if it cannot start"""
+        container_id = await host.api.create_container(config, name=name)
+        try:
+            await host.api.start_container(container_id)
+        except BaseException:
+            await asyncio.shield(self._remove_quietly(host, container_id))
+            raise
+        return container_id
+    
+    async def _remove_quietly(self, host: DockerHost, container_id: str):
+        try:
+            await host.api.remove_container(container_id, force=True)
+        except Exception as e:
+            logger.warning(f"Could not remove container {container_id}: {e}")
+    
+    async def _discard_partial_deployment(self, host: DockerHost, container_ref: Optional[str], image_name: Optional[str]):
+        """Remove whatever a cancelled build had created so far"""
+        if container_ref:
+            try:
+                await host.api.remove_container(container_ref, force=True)
+            except DockerNotFound:
+                pass
+            except Exception as e:
+                logger.warning(f"Could not remove container {container_ref} of cancelled deployment: {e}")
+        if image_name:
+            try:
+                await host.api.remove_image(image_name, force=True)
+            except DockerNotFound:
+                pass
+            except Exception as e:
+                logger.warning(f"Could not remove image {image_name} of cancelled deployment: {e}")
+    
+    async def run_replica(self,
+                          container_id: str,
+                          resource_tier: str = DEFAULT_RESOURCE_TIER,
+                          host: Optional[str] = None,
+                          image_ref: Optional[str] = None,
+                          port: Optional[int] = None) -> Tuple[str, int, str]:
+        """Start another container from the image and settings of an existing one.
+        
+        With `image_ref`, the deployment's image pushed to the registry, the replica goes to the
+        host with the most headroom and that host pulls the image by digest if it lacks it.
+        Otherwise the image only exists on the source container's host, so the replica runs there.
+        A given `port` pins the replica to that port on the source host.
+        Returns the new container ID, host port and Docker host name.
+        """
+        source_host = self.hosts.get(host)
+        source = await source_host.api.inspect_container(container_id)
+        source_name = source['Name'].lstrip('/')
+        image_name = source['Config']['Image']
+        internal_port = next(iter(source['HostConfig'].get('PortBindings') or {}), '80/tcp')
+        
+        docker_host = source_host
+        if image_ref and image_registry.enabled and len(self.hosts) > 1 and not port:
+            limits = RESOURCE_TIERS[resource_tier]
+            try:
+                docker_host = await asyncio.to_thread(
+                    self.hosts.select_host, parse_memory(limits['mem_limit']), limits['cpu_quota'] / CONTAINER_CPU_PERIOD
+                )
+            except Exception as e:
+                logger.warning(f"Placing replica of {source_name} on its source host: {e}")
+            if docker_host is not source_host:
+                image_name = await image_registry.ensure_image(docker_host, image_ref)
+        
+        if port:
+            docker_host.used_ports.add(port)
+        else:
+            port = await asyncio.to_thread(self.get_available_port, docker_host)
+        name = f"{source_name.rsplit('_', 1)[0]}_{uuid.uuid4().hex[:8]}"
+        try:
+            replica_id = await self._run_container(
+                docker_host,
+                name,
+                self._container_config(image_name, internal_port, port, source['Config'].get('Labels') or {}, resource_tier)
+            )
+        except Exception:
+            self.release_port(port, docker_host.name)
+            raise
+        
+        logger.info(f"Started replica {name} of {source_name} on {docker_host.name} port {port}")
+        return replica_id, port, docker_host.name
     
-    async def stop_container(self, container_id: str) -> bool:
+    def _deployment_labels(self, user_id: str, deployment_id: Optional[str]) -> Dict[str, str]:
+        """Labels tying images and containers back to their deployment"""
+        labels = {LABEL_USER_ID: user_id}
+        if deployment_id:
+            labels[LABEL_DEPLOYMENT_ID] = deployment_id
+        return labels
+    
+    def _record_build_step(self, log_line: str):
+        """Count Dockerfile steps and build cache hits from a build output line"""
+        if log_line.startswith("Step "):
+            metrics.build_steps_total.inc()
+        elif "Using cache" in log_line:
+            metrics.build_cache_hits_total.inc()
+    
+    def port_range_utilization(self) -> float:
+        """Fraction of the deployment port range currently reserved, across all hosts"""
+        range_size = settings.DEPLOYMENT_PORT_RANGE_END - settings.DEPLOYMENT_PORT_RANGE_START
+        if range_size <= 0:
+            return 0.0
+        return sum(len(host.used_ports) for host in self.hosts) / (range_size * len(self.hosts))
+    
+    async def list_containers(self, all: bool = False, filters: Optional[Dict[str, Any]] = None,
+                              unreachable: Optional[Set[str]] = None) -> List[Tuple[DockerHost, Dict[str, Any]]]:
+        """List containers on every reachable host, paired with the host they run on.
+        
+        Containers are the Engine API's summaries (Id, Names, Image, Labels, Ports, State, ...).
+        Names of hosts that could not be listed are added to `unreachable` when given.
+        """
+        async def list_host(host: DockerHost):
+            try:
+                return [(host, container) for container in await host.api.list_containers(all=all, filters=filters)]
+            except Exception as e:
+                logger.warning(f"Could not list containers on {host.name}: {e}")
+                if unreachable is not None:
+                    unreachable.add(host.name)
+                return []
+        
+        listed = await asyncio.gather(*(list_host(host) for host in self.hosts))
+        return [entry for entries in listed for entry in entries]
+    
+    async def stop_container(self, container_id: str, host: Optional[str] = None) -> bool:
         """Stop a running container"""
         try:
-            container = self.client.containers.get(container_id)
-            container.stop()
+            await self.hosts.get(host).api.stop_container(container_id)
             logger.info(f"Stopped container: {container_id}")
             return True
         except Exception as e:
             logger.error(f"Failed to stop container {container_id}: {str(e)}")
             return False
     
-    async def remove_container(self, container_id: str, port: int = None) -> bool:
+    async def update_container_resources(self, container_id: str, resource_tier: str,
+                                         host: Optional[str] = None) -> bool:
+        """Apply a tier's limits to a container in place, without restarting it"""
+        limits = RESOURCE_TIERS[resource_tier]
+        memory = parse_memory(limits['mem_limit'])
+        try:
+            await self.hosts.get(host).api.update_container(container_id, {
+                'Memory': memory,
+                # Keep Docker's default swap allowance; it must never drop below the memory limit
+                'MemorySwap': memory * 2,
+                'CpuPeriod': CONTAINER_CPU_PERIOD,
+                'CpuQuota': limits['cpu_quota']
+            })
+            logger.info(f"Updated container {container_id} to resource tier {resource_tier}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to update resources of container {container_id}: {str(e)}")
+            return False
+    
+    async def update_replicas_resources(self, replicas: List[Dict[str, Any]], resource_tier: str) -> List[bool]:
+        """Apply a tier's limits to every replica of a deployment; whether each one was updated"""
+        return list(await asyncio.gather(*(
+            self.update_container_resources(replica['container_id'], resource_tier, replica.get('docker_host'))
+            for replica in replicas
+        )))
+    
+    async def start_container(self, container_id: str, host: Optional[str] = None) -> bool:
+        """Start a stopped container"""
+        try:
+            await self.hosts.get(host).api.start_container(container_id)
+            logger.info(f"Started container: {container_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to start container {container_id}: {str(e)}")
+            return False
+    
+    async def wait_until_ready(self, port: int, timeout: float = 30.0, interval: float = 0.25,
+                               host: Optional[str] = None) -> bool:
+        """Wait until something accepts TCP connections on the given host port"""
+        address = self.hosts.get(host).address
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(address, port), timeout=interval * 4)
+                writer.close()
+                await writer.wait_closed()
+                return True
+            except (OSError, asyncio.TimeoutError):
+                await asyncio.sleep(interval)
+        return False
+    
+    async def remove_container(self, container_id: str, port: int = None, host: Optional[str] = None) -> bool:
         """Remove a container and clean up resources"""
         try:
-            container = self.client.containers.get(container_id)
-            container.stop()
-            container.remove()
+            docker_host = self.hosts.get(host)
+            await docker_host.api.stop_container(container_id)
+            await docker_host.api.remove_container(container_id)
             
             if port:
-                self.release_port(port)
+                self.release_port(port, host)
             
             logger.info(f"Removed container: {container_id}")
             return True
@@ -452,18 +913,98 @@ CMD ["nginx", "-g", "daemon off;"]
             logger.error(f"Failed to remove container {container_id}: {str(e)}")
             return False
     
-    async def get_container_logs(self, container_id: str) -> List[str]:
-        """Get logs from a container"""
+    async def stop_replicas(self, replicas: List[Dict[str, Any]]) -> bool:
+        """Stop every replica of a deployment; True if all stopped"""
+        results = await asyncio.gather(*(
+            self.stop_container(replica['container_id'], replica.get('docker_host')) for replica in replicas
+        ))
+        return all(results)
+    
+    async def start_replicas(self, replicas: List[Dict[str, Any]]) -> bool:
+        """Start every replica of a deployment; True if all started"""
+        results = await asyncio.gather(*(
+            self.start_container(replica['container_id'], replica.get('docker_host')) for replica in replicas
+        ))
+        return all(results)
+    
+    async def wait_replicas_ready(self, replicas: List[Dict[str, Any]], timeout: float = 30.0) -> bool:
+        """Wait until every replica accepts connections; True if all did within the timeout"""
+        results = await asyncio.gather(*(
+            self.wait_until_ready(replica['port'], timeout, host=replica.get('docker_host')) for replica in replicas
+        ))
+        return all(results)
+    
+    async def remove_replicas(self, replicas: List[Dict[str, Any]]) -> bool:
+        """Remove every replica of a deployment and release their ports; True if all were removed"""
+        results = await asyncio.gather(*(
+            self.remove_container(replica['container_id'], replica.get('port'), replica.get('docker_host'))
+            for replica in replicas
+        ))
+        return all(results)
+    
+    async def get_container_logs(self,
+                                 container_id: str,
+                                 tail: Optional[int] = None,
+                                 since: Optional[datetime] = None,
+                                 until: Optional[datetime] = None,
+                                 max_bytes: Optional[int] = None,
+                                 host: Optional[str] = None) -> Tuple[List[str], bool]:
+        """Get logs from a container, bounded by tail/time window and a byte cap.
+        
+        Returns the log lines and whether the output was truncated by the byte cap.
+        """
+        max_bytes = max_bytes or settings.LOGS_MAX_BYTES
+        
+        async def read_capped() -> Tuple[bytes, bool]:
+            log_stream = self.hosts.get(host).api.container_logs(container_id, tail=tail, since=since, until=until)
+            # Keep only the newest max_bytes so memory stays bounded however long the history is
+            chunks = deque()
+            total = 0
+            truncated = False
+            async for chunk in log_stream:
+                chunks.append(chunk)
+                total += len(chunk)
+                while total > max_bytes:
+                    dropped = chunks.popleft()
+                    total -= len(dropped)
+                    truncated = True
+            data = b"".join(chunks)
+            if truncated and b"\n" in data:
+                # Drop the partial first line left by trimming
+                data = data.split(b"\n", 1)[1]
+            return data, truncated
+        
         try:
-            container = self.client.containers.get(container_id)
-            logs = container.logs().decode('utf-8').split('\n')
-            return [log for log in logs if log.strip()]
+            data, truncated = await read_capped()
+            logs = data.decode('utf-8', errors='replace').split('\n')
+            return [log for log in logs if log.strip()], truncated
         except Exception as e:
             logger.error(f"Failed to get container logs {container_id}: {str(e)}")
-            return [f"Error getting logs: {str(e)}"]
+            return [f"Error getting logs: {str(e)}"], False
+    
+    async def follow_container_logs(self,
+                                    container_id: str,
+                                    tail: Optional[int] = None,
+                                    since: Optional[datetime] = None,
+                                    host: Optional[str] = None) -> AsyncIterator[str]:
+        """Yield container log lines as they are produced, straight from the Docker log stream"""
+        log_stream = self.hosts.get(host).api.container_logs(container_id, follow=True, tail=tail, since=since)
+        buffer = b""
+        try:
+            async for chunk in log_stream:
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    yield line.decode('utf-8', errors='replace')
+            if buffer:
+                yield buffer.decode('utf-8', errors='replace')
+        finally:
+            # Closing the stream releases its connection back to the pool
+            await log_stream.aclose()
     
     def cleanup_project_files(self, project_path: str):
         """Clean up project files after deployment"""
+        self.work_paths.discard(project_path)
         try:
             if os.path.exists(project_path):
                 shutil.rmtree(project_path)
@@ -472,4 +1013,6 @@ CMD ["nginx", "-g", "daemon off;"]
             logger.error(f"Failed to cleanup project files {project_path}: {str(e)}")
 
 # Global Docker service instance
-docker_service = DockerService() 
\ No newline at end of file
+docker_service = DockerService()
+
+metrics.port_range_utilization.set_function(docker_service.port_range_utilization) 
\ No newline at end of file
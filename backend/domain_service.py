@@ -1,16 +1,40 @@
 import os
 import uuid
+import time
+import asyncio
 import logging
-from typing import Optional
+import subprocess
+import tempfile
+import hmac
+import hashlib
+import re
+from typing import Optional, Dict, Any, List, Tuple
 from config import settings
+from host_pool import host_pool
+from docker_service import deployment_replicas
+import metrics
 
 logger = logging.getLogger(__name__)
 
+ROUTING_TABLE_FILE = "zipp_routes.conf"
+
 class DomainService:
     def __init__(self):
-        self.nginx_conf_dir = "/etc/nginx/conf.d"
+        self.nginx_conf_dir = settings.NGINX_CONF_DIR
         self.base_domain = settings.BASE_DOMAIN
         self.ssl_cert_path = "/etc/letsencrypt/live"
+        self.routing_mode = settings.NGINX_ROUTING_MODE
+        self.reload_debounce = settings.NGINX_RELOAD_DEBOUNCE
+        
+        # deployment_id -> (subdomain, [(address, port), ...] of its replicas); the source of truth
+        # for the map routing table
+        self.routes: Dict[str, Tuple[str, List[Tuple[str, int]]]] = {}
+        
+        # Debounced reload state
+        self._reload_task: Optional[asyncio.Task] = None
+        self._reload_waiters: List[asyncio.Future] = []
+        self._reload_lock: Optional[asyncio.Lock] = None
+        self.last_reload: Optional[Dict[str, Any]] = None
     
     def generate_subdomain(self, deployment_id: str) -> str:
         """Generate a unique subdomain for deployment"""
@@ -18,6 +42,10 @@ class DomainService:
         subdomain = deployment_id[:8].lower()
         return f"{subdomain}.{self.base_domain}"
     
+    def ssl_enabled(self) -> bool:
+        """Whether certificates exist for the base domain"""
+        return os.path.exists(f"{self.ssl_cert_path}/{self.base_domain}")
+    
     def generate_public_url(self, deployment_id: str, use_ssl: bool = True) -> str:
         """Generate public URL for deployment"""
         if self.base_domain == "localhost":
@@ -28,23 +56,26 @@ class DomainService:
         protocol = "https" if use_ssl else "http"
         return f"{protocol}://{subdomain}"
     
-    def create_nginx_config(self, deployment_id: str, port: int) -> bool:
-        """Create nginx configuration for deployment"""
+    def create_nginx_config(self, deployment_id: str, replicas: List[Dict[str, Any]]) -> bool:
+        """Create (or update) nginx configuration load-balancing a deployment across its replicas"""
         try:
             if self.base_domain == "localhost":
                 # Skip nginx config creation in development
                 return True
             
             subdomain = self.generate_subdomain(deployment_id)
-            config_content = self._generate_nginx_config(subdomain, port)
+            servers = self._upstream_servers(replicas)
+            self.routes[deployment_id] = (subdomain, servers)
             
-            config_file = os.path.join(self.nginx_conf_dir, f"{deployment_id}.conf")
-            
-            with open(config_file, 'w') as f:
-                f.write(config_content)
+            if self.routing_mode == "map":
+                self._write_routing_table()
+            else:
+                config_content = self._generate_nginx_config(deployment_id, subdomain, servers)
+                config_file = os.path.join(self.nginx_conf_dir, f"{deployment_id}.conf")
+                self._atomic_write(config_file, config_content)
             
             # Reload nginx
-            os.system("nginx -s reload")
+            self.schedule_reload()
             
             logger.info(f"Created nginx config for {subdomain}")
             return True
@@ -59,11 +90,20 @@ class DomainService:
             if self.base_domain == "localhost":
                 return True
             
+            removed = self.routes.pop(deployment_id, None)
+            
+            if self.routing_mode == "map":
+                if removed:
+                    self._write_routing_table()
+                    self.schedule_reload()
+                    logger.info(f"Removed route for deployment {deployment_id}")
+                return True
+            
             config_file = os.path.join(self.nginx_conf_dir, f"{deployment_id}.conf")
             
             if os.path.exists(config_file):
                 os.remove(config_file)
-                os.system("nginx -s reload")
+                self.schedule_reload()
                 logger.info(f"Removed nginx config for deployment {deployment_id}")
             
             return True
@@ -72,11 +112,254 @@ class DomainService:
             logger.error(f"Failed to remove nginx config: {str(e)}")
             return False
     
-    def _generate_nginx_config(self, subdomain: str, port: int) -> str:
-        """Generate nginx configuration content"""
-        ssl_config = ""
-        if os.path.exists(f"{self.ssl_cert_path}/{self.base_domain}"):
-            ssl_config = f"""
+    def sync_routes(self, deployments: List[Dict[str, Any]]) -> bool:
+        """Rebuild the route set (and the map routing table) from the routed deployments"""
+        if self.base_domain == "localhost":
+            return True
+        try:
+            self.routes = {
+                deployment['id']: (
+                    self.generate_subdomain(deployment['id']),
+                    self._upstream_servers(deployment_replicas(deployment))
+                )
+                for deployment in deployments
+                if deployment.get('port')
+            }
+            if self.routing_mode != "map":
+                return True
+            self._write_routing_table()
+            self.schedule_reload()
+            logger.info(f"Synced nginx routing table with {len(self.routes)} deployments")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to sync nginx routing table: {str(e)}")
+            return False
+    
+    def deployment_for_host(self, host: str) -> Optional[str]:
+        """Resolve a request Host header to the deployment routed under it"""
+        hostname = host.split(':')[0].lower()
+        for deployment_id, (subdomain, _) in self.routes.items():
+            if subdomain == hostname:
+                return deployment_id
+        return None
+    
+    def wake_token(self) -> str:
+        """Shared token nginx sends with wake requests so only the proxy can trigger them"""
+        return hmac.new(settings.SECRET_KEY.encode(), b"zipp-wake", hashlib.sha256).hexdigest()
+    
+    def schedule_reload(self) -> Optional[asyncio.Future]:
+        """Request an nginx reload; requests within the debounce window share one reload.
+        
+        Returns a future resolving to the reload outcome, or None if the reload ran
+        synchronously because there is no running event loop.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._record_reload(*self._reload_nginx_sync())
+            return None
+        
+        waiter = loop.create_future()
+        self._reload_waiters.append(waiter)
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = loop.create_task(self._debounced_reload())
+        return waiter
+    
+    async def _debounced_reload(self):
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        
+        await asyncio.sleep(self.reload_debounce)
+        
+        # Everything requested up to now is covered by this reload; later requests start a new window
+        waiters, self._reload_waiters = self._reload_waiters, []
+        self._reload_task = None
+        
+        async with self._reload_lock:
+            success, message = await self._reload_nginx()
+        outcome = self._record_reload(success, message, len(waiters))
+        
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(outcome)
+    
+    async def _reload_nginx(self) -> Tuple[bool, str]:
+        """Validate the configuration, then signal nginx to reload it"""
+        for command in (["nginx", "-t"], ["nginx", "-s", "reload"]):
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT
+                )
+                output, _ = await process.communicate()
+            except Exception as e:
+                return False, f"{' '.join(command)} failed: {str(e)}"
+            if process.returncode != 0:
+                return False, f"{' '.join(command)} exited with {process.returncode}: {output.decode(errors='replace').strip()}"
+        return True, "nginx reloaded"
+    
+    def _reload_nginx_sync(self) -> Tuple[bool, str]:
+        for command in (["nginx", "-t"], ["nginx", "-s", "reload"]):
+            try:
+                result = subprocess.run(command, capture_output=True, text=True)
+            except Exception as e:
+                return False, f"{' '.join(command)} failed: {str(e)}"
+            if result.returncode != 0:
+                return False, f"{' '.join(command)} exited with {result.returncode}: {(result.stderr or result.stdout).strip()}"
+        return True, "nginx reloaded"
+    
+    def _record_reload(self, success: bool, message: str, coalesced: int = 1) -> Dict[str, Any]:
+        self.last_reload = {
+            'success': success,
+            'message': message,
+            'coalesced_requests': coalesced,
+            'routes': len(self.routes),
+            'completed_at': time.time()
+        }
+        metrics.nginx_reloads_total.inc(outcome="success" if success else "failure")
+        if success:
+            logger.info(f"nginx reload succeeded ({coalesced} coalesced changes)")
+        else:
+            logger.error(f"nginx reload failed: {message}")
+        return self.last_reload
+    
+    def _atomic_write(self, path: str, content: str):
+        """Write a file via rename so nginx never reads a partially written config"""
+        directory = os.path.dirname(path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".zipp-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
+    def _upstream_servers(self, replicas: List[Dict[str, Any]]) -> List[Tuple[str, int]]:
+        """Address and port nginx reaches each replica on"""
+        servers = []
+        for replica in replicas:
+            address = host_pool.get(replica.get('docker_host')).address
+            # "localhost" may also resolve to ::1, which published container ports don't always bind
+            servers.append(("127.0.0.1" if address == "localhost" else address, replica['port']))
+        return servers
+    
+    def _upstream_name(self, deployment_id: str) -> str:
+        return "zipp_" + re.sub(r'[^a-z0-9_]', '_', deployment_id.lower())
+    
+    def _generate_upstream(self, deployment_id: str, servers: List[Tuple[str, int]]) -> str:
+        """Upstream block for a deployment's replicas, with pooled keepalive connections.
+        
+        max_fails/fail_timeout are nginx's passive health checks: a replica that keeps
+        failing is taken out of rotation for fail_timeout before being retried.
+        """
+        server_lines = "\n".join(
+            f"    server {address}:{port} max_fails={settings.UPSTREAM_MAX_FAILS} "
+            f"fail_timeout={settings.UPSTREAM_FAIL_TIMEOUT}s;"
+            for address, port in servers
+        )
+        return f"""
+upstream {self._upstream_name(deployment_id)} {{
+{server_lines}
+    keepalive {settings.UPSTREAM_KEEPALIVE};
+}}
+"""
+    
+    def _write_routing_table(self):
+        self._atomic_write(
+            os.path.join(self.nginx_conf_dir, ROUTING_TABLE_FILE),
+            self._generate_routing_table()
+        )
+    
+    def _generate_routing_table(self) -> str:
+        """Generate a single map-based routing config covering every deployment"""
+        entries = "\n".join(
+            f"    {subdomain} {self._upstream_name(deployment_id)};"
+            for deployment_id, (subdomain, servers) in sorted(self.routes.items(), key=lambda item: item[1][0])
+            if servers
+        )
+        upstreams = "".join(
+            self._generate_upstream(deployment_id, servers)
+            for deployment_id, (_, servers) in sorted(self.routes.items())
+            if servers
+        )
+        
+        # The map resolves to an upstream name, so proxy_pass with a variable needs no resolver
+        return f"""
+# Generated by Zipp - do not edit by hand
+{upstreams}
+map $host $zipp_upstream {{
+    hostnames;
+    default "";
+{entries}
+}}
+
+server {{
+{self._ssl_config()}
+    server_name *.{self.base_domain};
+    
+    # Security headers
+    add_header X-Frame-Options DENY;
+    add_header X-Content-Type-Options nosniff;
+    add_header X-XSS-Protection "1; mode=block";
+    add_header Strict-Transport-Security "max-age=31536000; includeSubDomains" always;
+    
+    # Rate limiting
+    limit_req zone=api burst=20 nodelay;
+    
+    # Activity log used for idle detection (scale-to-zero)
+    access_log /var/log/nginx/access.log main;
+    access_log {settings.NGINX_ACTIVITY_LOG} zipp_activity;
+    
+    if ($zipp_upstream = "") {{
+        return 404;
+    }}
+    
+    location / {{
+        proxy_pass http://$zipp_upstream;
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        proxy_read_timeout 300s;
+        proxy_connect_timeout 75s;
+        
+        # WebSocket support
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection $zipp_connection_upgrade;
+        
+        # Stopped (scaled-to-zero) containers refuse connections; hand those to the API to wake
+        error_page 502 504 = @zipp_wake;
+    }}
+    
+    location @zipp_wake {{
+        rewrite ^ /internal/wake break;
+        proxy_pass http://instantsite_api;
+        proxy_set_header Host $host;
+        proxy_set_header X-Zipp-Original-URI $request_uri;
+        proxy_set_header X-Zipp-Wake-Token {self.wake_token()};
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        proxy_read_timeout 300s;
+    }}
+    
+    # Health check
+    location /health {{
+        access_log off;
+        return 200 "healthy\\n";
+        add_header Content-Type text/plain;
+    }}
+}}
+"""
+    
+    def _ssl_config(self) -> str:
+        """Listen/SSL directives for generated server blocks"""
+        if self.ssl_enabled():
+            return f"""
     listen 443 ssl http2;
     ssl_certificate {self.ssl_cert_path}/{self.base_domain}/fullchain.pem;
     ssl_certificate_key {self.ssl_cert_path}/{self.base_domain}/privkey.pem;
@@ -88,10 +371,13 @@ class DomainService:
     if ($scheme != "https") {{
         return 301 https://$host$request_uri;
     }}"""
-        else:
-            ssl_config = "listen 80;"
+        return "listen 80;"
+    
+    def _generate_nginx_config(self, deployment_id: str, subdomain: str, servers: List[Tuple[str, int]]) -> str:
+        """Generate nginx configuration content"""
+        ssl_config = self._ssl_config()
         
-        return f"""
+        return f"""{self._generate_upstream(deployment_id, servers)}
 server {{
 {ssl_config}
     server_name {subdomain};
@@ -105,8 +391,12 @@ server {{
     # Rate limiting
     limit_req zone=api burst=20 nodelay;
     
+    # Activity log used for idle detection (scale-to-zero)
+    access_log /var/log/nginx/access.log main;
+    access_log {settings.NGINX_ACTIVITY_LOG} zipp_activity;
+    
     location / {{
-        proxy_pass http://localhost:{port};
+        proxy_pass http://{self._upstream_name(deployment_id)};
         proxy_set_header Host $host;
         proxy_set_header X-Real-IP $remote_addr;
         proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
@@ -117,7 +407,22 @@ server {{
         # WebSocket support
         proxy_http_version 1.1;
         proxy_set_header Upgrade $http_upgrade;
-        proxy_set_header Connection "upgrade";
+        proxy_set_header Connection $zipp_connection_upgrade;
+        
+        # Stopped (scaled-to-zero) containers refuse connections; hand those to the API to wake
+        error_page 502 504 = @zipp_wake;
+    }}
+    
+    location @zipp_wake {{
+        rewrite ^ /internal/wake break;
+        proxy_pass http://instantsite_api;
+        proxy_set_header Host $host;
+        proxy_set_header X-Zipp-Original-URI $request_uri;
+        proxy_set_header X-Zipp-Wake-Token {self.wake_token()};
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        proxy_read_timeout 300s;
     }}
     
     # Health check
@@ -1,19 +1,58 @@
 import firebase_admin
 from firebase_admin import credentials, auth, firestore
+from google.api_core.exceptions import AlreadyExists
 from config import settings
+from deployment_events import deployment_events
+from models import DeploymentStatus
+import asyncio
 import logging
-from typing import Optional, Dict, Any
+import threading
+from collections import Counter, defaultdict
+from typing import Optional, Dict, Any, List, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Statuses counted in a user's active_deployments: everything not stopped, failed or cancelled
+ACTIVE_STATUSES = {
+    DeploymentStatus.PENDING.value,
+    DeploymentStatus.CLONING.value,
+    DeploymentStatus.BUILDING.value,
+    DeploymentStatus.DEPLOYING.value,
+    DeploymentStatus.RUNNING.value,
+}
+
+# Deployment writes per batch or transaction; Firestore allows 500, the rest is left for user counters
+WRITE_CHUNK_SIZE = 250
+
+def _active(status: Optional[str]) -> int:
+    return 1 if status in ACTIVE_STATUSES else 0
+
 class FirebaseService:
     def __init__(self):
         self.app = None
-        self.db = None
-        self.initialize_firebase()
+        self._db = None
+        self._lock = threading.Lock()
+    
+    @property
+    def db(self):
+        """Firestore client, initialized on first use so importing this module never blocks"""
+        if self._db is None:
+            self.initialize_firebase()
+        return self._db
+    
+    @property
+    def initialized(self) -> bool:
+        return self._db is not None
     
     def initialize_firebase(self):
-        """Initialize Firebase Admin SDK"""
+        """Initialize Firebase Admin SDK (once; later calls return straight away)"""
+        if self._db is not None:
+            return
+        with self._lock:
+            if self._db is None:
+                self._initialize()
+    
+    def _initialize(self):
         try:
             if not firebase_admin._apps:
                 # Initialize with service account credentials
@@ -27,7 +66,7 @@ class FirebaseService:
                 logger.info("Using existing Firebase app instance")
             
             # Initialize Firestore
-            self.db = firestore.client()
+            self._db = firestore.client()
             logger.info("Firestore client initialized successfully")
             
         except Exception as e:
@@ -36,6 +75,7 @@ class FirebaseService:
     
     async def verify_token(self, id_token: str) -> Optional[Dict[str, Any]]:
         """Verify Firebase ID token and return user data"""
+        self.initialize_firebase()
         try:
             decoded_token = auth.verify_id_token(id_token)
             return {
@@ -64,17 +104,24 @@ class FirebaseService:
         """Create or update user in Firestore"""
         try:
             user_ref = self.db.collection('users').document(user_data['uid'])
-            user_ref.set({
+            profile = {
                 'uid': user_data['uid'],
                 'email': user_data['email'],
                 'email_verified': user_data.get('email_verified', False),
                 'name': user_data.get('name', ''),
                 'picture': user_data.get('picture', ''),
-                'created_at': firestore.SERVER_TIMESTAMP,
-                'updated_at': firestore.SERVER_TIMESTAMP,
-                'deployments_count': 0,
-                'active_deployments': 0
-            }, merge=True)
+                'updated_at': firestore.SERVER_TIMESTAMP
+            }
+            try:
+                # Counters start at zero once; deployment writes keep them current after that
+                user_ref.create({
+                    **profile,
+                    'created_at': firestore.SERVER_TIMESTAMP,
+                    'deployments_count': 0,
+                    'active_deployments': 0
+                })
+            except AlreadyExists:
+                user_ref.set(profile, merge=True)
             return True
         except Exception as e:
             logger.error(f"Failed to create/update user: {str(e)}")
@@ -101,15 +148,122 @@ class FirebaseService:
             logger.error(f"Failed to get user deployments: {str(e)}")
             return []
     
+    async def get_deployments_by_status(self, statuses: list) -> list:
+        """Get all deployments (across users) whose status is in the given list"""
+        try:
+            deployments = self.db.collection('deployments')\
+                               .where('status', 'in', statuses)\
+                               .stream()
+            
+            result = []
+            for deployment in deployments:
+                deployment_data = deployment.to_dict()
+                deployment_data['id'] = deployment.id
+                result.append(deployment_data)
+            return result
+        except Exception as e:
+            logger.error(f"Failed to get deployments by status: {str(e)}")
+            return []
+    
+    async def get_all_deployments(self) -> Optional[list]:
+        """Get every deployment record in one query, or None if the query fails"""
+        try:
+            result = []
+            for deployment in self.db.collection('deployments').stream():
+                deployment_data = deployment.to_dict()
+                deployment_data['id'] = deployment.id
+                result.append(deployment_data)
+            return result
+        except Exception as e:
+            logger.error(f"Failed to get all deployments: {str(e)}")
+            return None
+    
+    async def batch_update_deployments(self, updates: Dict[str, Dict[str, Any]]) -> bool:
+        """Apply many deployment updates using batched writes"""
+        try:
+            items = list(updates.items())
+            for start in range(0, len(items), WRITE_CHUNK_SIZE):
+                self._update_counted(items[start:start + WRITE_CHUNK_SIZE])
+            for deployment_id, update_data in items:
+                deployment_events.publish(deployment_id, 'updated', update_data)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to batch update deployments: {str(e)}")
+            return False
+    
+    async def update_existing_deployments(self, updates: Dict[str, Dict[str, Any]]) -> Optional[set]:
+        """Apply status-free updates to whichever of the deployments still exist, off the event loop.
+
+        Returns the IDs that were written, or None if a write failed.
+        """
+        try:
+            items = list(updates.items())
+            written = set()
+            for start in range(0, len(items), WRITE_CHUNK_SIZE):
+                written |= await asyncio.to_thread(self._update_existing, items[start:start + WRITE_CHUNK_SIZE])
+            for deployment_id, update_data in items:
+                if deployment_id in written:
+                    deployment_events.publish(deployment_id, 'updated', update_data)
+            return written
+        except Exception as e:
+            logger.error(f"Failed to update deployments: {str(e)}")
+            return None
+    
+    async def get_deployments(self, deployment_ids: list) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Fetch many deployment records in one batched read, keyed by ID; missing ones are left out"""
+        try:
+            references = [self.db.collection('deployments').document(deployment_id) for deployment_id in deployment_ids]
+            result = {}
+            for snapshot in self.db.get_all(references):
+                if snapshot.exists:
+                    result[snapshot.id] = snapshot.to_dict()
+            return result
+        except Exception as e:
+            logger.error(f"Failed to get deployments: {str(e)}")
+            return None
+    
+    async def batch_delete_deployments(self, deployment_ids: list) -> bool:
+        """Delete many deployment records using batched writes"""
+        try:
+            for start in range(0, len(deployment_ids), WRITE_CHUNK_SIZE):
+                self._delete_counted(deployment_ids[start:start + WRITE_CHUNK_SIZE])
+            for deployment_id in deployment_ids:
+                deployment_events.publish(deployment_id, 'deleted')
+            return True
+        except Exception as e:
+            logger.error(f"Failed to batch delete deployments: {str(e)}")
+            return False
+    
+    async def get_all_deployment_ids(self) -> Optional[set]:
+        """Get the IDs of every deployment record, or None if the query fails"""
+        try:
+            documents = self.db.collection('deployments').select([]).stream()
+            return {document.id for document in documents}
+        except Exception as e:
+            logger.error(f"Failed to list deployment IDs: {str(e)}")
+            return None
+    
     async def create_deployment(self, deployment_data: Dict[str, Any]) -> Optional[str]:
         """Create a new deployment record"""
         try:
-            doc_ref = self.db.collection('deployments').add({
+            deployment_ref = self.db.collection('deployments').document()
+            # The record and its owner's counters are written atomically
+            batch = self.db.batch()
+            batch.set(deployment_ref, {
                 **deployment_data,
                 'created_at': firestore.SERVER_TIMESTAMP,
                 'updated_at': firestore.SERVER_TIMESTAMP
             })
-            return doc_ref[1].id
+            self._increment_counters(batch, {
+                deployment_data['user_id']: Counter(
+                    deployments_count=1,
+                    active_deployments=_active(deployment_data.get('status'))
+                )
+            })
+            batch.commit()
+            deployment_id = deployment_ref.id
+            deployment_events.publish(deployment_id, 'created', deployment_data, user_id=deployment_data.get('user_id'))
+            return deployment_id
         except Exception as e:
             logger.error(f"Failed to create deployment: {str(e)}")
             return None
@@ -117,14 +271,181 @@ class FirebaseService:
     async def update_deployment(self, deployment_id: str, update_data: Dict[str, Any]) -> bool:
         """Update deployment record"""
         try:
-            self.db.collection('deployments').document(deployment_id).update({
-                **update_data,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            })
+            if 'status' in update_data:
+                # May move the owner's active count, so read and write in one transaction
+                self._update_counted([(deployment_id, update_data)])
+            else:
+                self.db.collection('deployments').document(deployment_id).update({
+                    **update_data,
+                    'updated_at': firestore.SERVER_TIMESTAMP
+                })
+            deployment_events.publish(deployment_id, 'updated', update_data)
             return True
         except Exception as e:
             logger.error(f"Failed to update deployment: {str(e)}")
             return False
+    
+    async def update_deployment_if(self, deployment_id: str, expected: Dict[str, Any],
+                                   update_data: Dict[str, Any]) -> bool:
+        """Update a deployment record only if it exists and its fields still hold the expected values.
+        
+        Checked and written in one transaction; False when the record changed or the write failed.
+        """
+        try:
+            reference = self.db.collection('deployments').document(deployment_id)
+            
+            @firestore.transactional
+            def update(transaction):
+                snapshot = reference.get(transaction=transaction)
+                if not snapshot.exists:
+                    return False
+                current = snapshot.to_dict()
+                if any(current.get(field) != value for field, value in expected.items()):
+                    return False
+                transaction.update(reference, {
+                    **update_data,
+                    'updated_at': firestore.SERVER_TIMESTAMP
+                })
+                return True
+            
+            if not update(self.db.transaction()):
+                return False
+            deployment_events.publish(deployment_id, 'updated', update_data)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to update deployment: {str(e)}")
+            return False
+    
+    async def delete_deployment(self, deployment_id: str) -> bool:
+        """Delete deployment record"""
+        try:
+            self._delete_counted([deployment_id])
+            deployment_events.publish(deployment_id, 'deleted')
+            return True
+        except Exception as e:
+            logger.error(f"Failed to delete deployment: {str(e)}")
+            return False
+    
+    async def get_user_counters(self) -> Optional[Dict[str, Dict[str, int]]]:
+        """Every user's recorded deployment counters, keyed by UID, or None if the query fails"""
+        try:
+            result = {}
+            for user in self.db.collection('users').select(['deployments_count', 'active_deployments']).stream():
+                user_data = user.to_dict() or {}
+                result[user.id] = {
+                    'deployments_count': user_data.get('deployments_count', 0),
+                    'active_deployments': user_data.get('active_deployments', 0)
+                }
+            return result
+        except Exception as e:
+            logger.error(f"Failed to get user counters: {str(e)}")
+            return None
+    
+    async def count_deployments_by_user(self) -> Optional[Dict[str, Dict[str, int]]]:
+        """Deployment counters recomputed from the deployment records, keyed by UID, or None if the query fails"""
+        try:
+            counts = defaultdict(Counter)
+            for deployment in self.db.collection('deployments').select(['user_id', 'status']).stream():
+                deployment_data = deployment.to_dict()
+                counts[deployment_data.get('user_id')]['deployments_count'] += 1
+                counts[deployment_data.get('user_id')]['active_deployments'] += _active(deployment_data.get('status'))
+            return {
+                user_id: {
+                    'deployments_count': counters['deployments_count'],
+                    'active_deployments': counters['active_deployments']
+                }
+                for user_id, counters in counts.items()
+            }
+        except Exception as e:
+            logger.error(f"Failed to count deployments by user: {str(e)}")
+            return None
+    
+    async def recount_user_deployments(self, uid: str) -> Optional[Dict[str, int]]:
+        """Set a user's counters from their deployment records in one transaction; the new counters, or None on failure"""
+        try:
+            user_ref = self.db.collection('users').document(uid)
+            query = self.db.collection('deployments').where('user_id', '==', uid).select(['status'])
+            
+            @firestore.transactional
+            def recount(transaction):
+                # Reading the query in the transaction makes a concurrent create or delete retry it
+                statuses = [(deployment.to_dict() or {}).get('status') for deployment in transaction.get(query)]
+                counters = {
+                    'deployments_count': len(statuses),
+                    'active_deployments': sum(_active(status) for status in statuses)
+                }
+                transaction.update(user_ref, counters)
+                return counters
+            
+            return recount(self.db.transaction())
+        except Exception as e:
+            logger.error(f"Failed to recount deployments for user {uid}: {str(e)}")
+            return None
+    
+    def _increment_counters(self, writer, deltas: Dict[str, Counter]):
+        """Add per-user counter changes to a batch or transaction as atomic increments"""
+        for user_id, counters in deltas.items():
+            increments = {field: firestore.Increment(delta) for field, delta in counters.items() if delta}
+            if user_id and increments:
+                writer.set(self.db.collection('users').document(user_id), increments, merge=True)
+    
+    def _update_counted(self, items: List[Tuple[str, Dict[str, Any]]]):
+        """Write deployment updates in one transaction, moving owners' active counts with status changes"""
+        references = {deployment_id: self.db.collection('deployments').document(deployment_id) for deployment_id, _ in items}
+        
+        @firestore.transactional
+        def update(transaction):
+            changing = [references[deployment_id] for deployment_id, update_data in items if 'status' in update_data]
+            before = {snapshot.id: snapshot.to_dict() for snapshot in transaction.get_all(changing) if snapshot.exists} if changing else {}
+            deltas = defaultdict(Counter)
+            for deployment_id, update_data in items:
+                if deployment_id in before:
+                    previous = before[deployment_id]
+                    deltas[previous.get('user_id')]['active_deployments'] += (
+                        _active(update_data['status']) - _active(previous.get('status'))
+                    )
+                transaction.update(references[deployment_id], {
+                    **update_data,
+                    'updated_at': firestore.SERVER_TIMESTAMP
+                })
+            self._increment_counters(transaction, deltas)
+        
+        update(self.db.transaction())
+    
+    def _update_existing(self, items: List[Tuple[str, Dict[str, Any]]]) -> set:
+        """Write updates in one transaction, skipping records that have been deleted"""
+        references = {deployment_id: self.db.collection('deployments').document(deployment_id) for deployment_id, _ in items}
+        
+        @firestore.transactional
+        def update(transaction):
+            existing = {snapshot.id for snapshot in transaction.get_all(list(references.values())) if snapshot.exists}
+            for deployment_id, update_data in items:
+                if deployment_id in existing:
+                    transaction.update(references[deployment_id], {
+                        **update_data,
+                        'updated_at': firestore.SERVER_TIMESTAMP
+                    })
+            return existing
+        
+        return update(self.db.transaction())
+    
+    def _delete_counted(self, deployment_ids: List[str]):
+        """Delete deployment records in one transaction, taking them off their owners' counters"""
+        references = [self.db.collection('deployments').document(deployment_id) for deployment_id in deployment_ids]
+        
+        @firestore.transactional
+        def delete(transaction):
+            deltas = defaultdict(Counter)
+            for snapshot in transaction.get_all(references):
+                if snapshot.exists:
+                    deployment_data = snapshot.to_dict()
+                    deltas[deployment_data.get('user_id')]['deployments_count'] -= 1
+                    deltas[deployment_data.get('user_id')]['active_deployments'] -= _active(deployment_data.get('status'))
+            for reference in references:
+                transaction.delete(reference)
+            self._increment_counters(transaction, deltas)
+        
+        delete(self.db.transaction())
 
 # Global Firebase service instance
 firebase_service = FirebaseService() 
\ No newline at end of file
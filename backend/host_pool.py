@@ -0,0 +1,184 @@
+import docker
+import logging
+import threading
+import time
+from typing import Optional, Dict, List, Tuple
+from urllib.parse import urlparse
+from config import settings
+from docker_api import AsyncDockerClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST_NAME = "local"
+# How long a host's capacity and committed container limits are reused between placements
+CAPACITY_CACHE_SECONDS = 10.0
+
+class DockerHost:
+    """One Docker daemon that builds images and runs deployment containers"""
+
+    def __init__(self, name: str, base_url: str, address: Optional[str] = None, public_address: Optional[str] = None):
+        self.name = name
+        self.base_url = base_url
+        parsed = urlparse(base_url)
+        # Where published container ports are reachable from the API and nginx
+        self.address = address or (parsed.hostname if parsed.scheme in ("tcp", "http", "https", "ssh") else "localhost")
+        # Hostname used in port-based public URLs
+        self.public_address = public_address or (
+            settings.BASE_DOMAIN if self.address == "localhost" else self.address
+        )
+        self.used_ports = set()
+        # Port allocation runs in worker threads; held while a port is picked and recorded
+        self.port_lock = threading.Lock()
+        self._client: Optional[docker.DockerClient] = None
+        self._api: Optional[AsyncDockerClient] = None
+        self._reservations: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        # (expires at, memory, cpus) from the daemon, refreshed after CAPACITY_CACHE_SECONDS
+        self._capacity: Optional[Tuple[float, int, float]] = None
+        self._committed: Optional[Tuple[float, int, float]] = None
+
+    @property
+    def client(self) -> docker.DockerClient:
+        if self._client is None:
+            self._client = docker.DockerClient(base_url=self.base_url)
+        return self._client
+
+    @property
+    def api(self) -> AsyncDockerClient:
+        """asyncio client with a pool of keep-alive connections to the daemon"""
+        if self._api is None:
+            self._api = AsyncDockerClient(self.base_url, settings.DOCKER_API_POOL_SIZE, settings.DOCKER_API_TIMEOUT)
+        return self._api
+
+    def capacity(self) -> Tuple[int, float]:
+        """Total memory (bytes) and CPUs reported by the daemon"""
+        cached = self._capacity
+        if cached and cached[0] > time.monotonic():
+            return cached[1], cached[2]
+        info = self.client.info()
+        memory, cpus = info.get('MemTotal', 0), float(info.get('NCPU', 0))
+        self._capacity = (time.monotonic() + CAPACITY_CACHE_SECONDS, memory, cpus)
+        return memory, cpus
+
+    def allocated(self) -> Tuple[int, float]:
+        """Memory and CPU committed to running deployment containers plus pending placements.
+
+        Container limits need a full inspect per container, so they are reused for a few
+        seconds; reservations are always current, so placements in that window still count.
+        """
+        cached = self._committed
+        if cached and cached[0] > time.monotonic():
+            memory, cpus = cached[1], cached[2]
+        else:
+            memory = 0
+            cpus = 0.0
+            for container in self.client.containers.list(filters={"name": "instantsite_", "status": "running"}):
+                host_config = container.attrs.get('HostConfig', {})
+                memory += host_config.get('Memory') or 0
+                period = host_config.get('CpuPeriod') or 100000
+                quota = host_config.get('CpuQuota') or 0
+                cpus += quota / period if quota > 0 else 1.0
+            self._committed = (time.monotonic() + CAPACITY_CACHE_SECONDS, memory, cpus)
+        with self._lock:
+            for reserved_memory, reserved_cpus in self._reservations.values():
+                memory += reserved_memory
+                cpus += reserved_cpus
+        return memory, cpus
+
+    def reserve(self, key: str, memory: int, cpus: float):
+        """Hold capacity for a placement until its container is running"""
+        with self._lock:
+            self._reservations[key] = (memory, cpus)
+
+    def release(self, key: str):
+        with self._lock:
+            reserved = self._reservations.pop(key, None)
+            # Its container is running now, so keep counting it until the cached listing is refreshed;
+            # a failed placement only overstates usage for that long
+            if reserved and self._committed:
+                expires, memory, cpus = self._committed
+                self._committed = (expires, memory + reserved[0], cpus + reserved[1])
+
+class HostPool:
+    """The set of Docker daemons deployments can be scheduled onto"""
+
+    def __init__(self, hosts: List[DockerHost]):
+        if not hosts:
+            raise ValueError("At least one Docker host is required")
+        self.hosts: Dict[str, DockerHost] = {host.name: host for host in hosts}
+        self.default = hosts[0]
+
+    @classmethod
+    def from_settings(cls) -> "HostPool":
+        """Build the pool from DOCKER_HOSTS, falling back to DOCKER_SOCKET as a single host.
+
+        DOCKER_HOSTS is a comma-separated list of `name=url` entries, each optionally
+        followed by `|address` to override where published ports are reached.
+        """
+        hosts = []
+        for entry in filter(None, (item.strip() for item in settings.DOCKER_HOSTS.split(','))):
+            name, _, target = entry.partition('=')
+            if not target:
+                name, target = f"host{len(hosts) + 1}", entry
+            base_url, _, address = target.partition('|')
+            hosts.append(DockerHost(name.strip(), _normalize_url(base_url.strip()), address.strip() or None))
+        if not hosts:
+            hosts.append(DockerHost(DEFAULT_HOST_NAME, _normalize_url(settings.DOCKER_SOCKET)))
+        return cls(hosts)
+
+    def get(self, name: Optional[str] = None) -> DockerHost:
+        """Look up a host by name; records created before multi-host support use the default"""
+        if name and name in self.hosts:
+            return self.hosts[name]
+        if name:
+            logger.warning(f"Unknown Docker host '{name}', using default host")
+        return self.default
+
+    def __iter__(self):
+        return iter(self.hosts.values())
+
+    def __len__(self):
+        return len(self.hosts)
+
+    async def close(self):
+        """Close the async API connection pools"""
+        for host in self.hosts.values():
+            if host._api is not None:
+                await host._api.close()
+                host._api = None
+
+    def select_host(self, memory: int, cpus: float) -> DockerHost:
+        """Pick the host with the most headroom for the request, measured on its scarcer resource"""
+        if len(self.hosts) == 1:
+            return self.default
+
+        best = None
+        best_score = None
+        for host in self.hosts.values():
+            try:
+                total_memory, total_cpus = host.capacity()
+                used_memory, used_cpus = host.allocated()
+            except Exception as e:
+                logger.warning(f"Skipping unreachable Docker host {host.name}: {e}")
+                continue
+            free_memory = total_memory - used_memory
+            free_cpus = total_cpus - used_cpus
+            if free_memory < memory or free_cpus < cpus:
+                continue
+            # Rank by the scarcer resource as a fraction of the request
+            score = min(free_memory / max(memory, 1), free_cpus / max(cpus, 0.01))
+            if best is None or score > best_score:
+                best, best_score = host, score
+
+        if best is None:
+            raise Exception("No Docker host has enough free memory and CPU for this deployment")
+        return best
+
+def _normalize_url(base_url: str) -> str:
+    # "unix://var/run/docker.sock" is a common typo for an absolute socket path
+    if base_url.startswith("unix://") and not base_url.startswith("unix:///"):
+        return "unix:///" + base_url[len("unix://"):]
+    return base_url
+
+# Global host pool instance
+host_pool = HostPool.from_settings()
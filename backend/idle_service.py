@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Tuple, List
+from config import settings
+from models import DeploymentStatus
+from docker_service import docker_service, deployment_replicas
+from domain_service import domain_service
+from firebase_config import firebase_service
+from stats_service import stats_sampler
+
+logger = logging.getLogger(__name__)
+
+# Received bytes below this between checks are treated as background noise, not visitors
+NETWORK_ACTIVITY_MIN_BYTES = 512
+
+class IdleMonitor:
+    """Stops deployments nobody has visited for a while and wakes them on the next request"""
+
+    def __init__(self, idle_seconds: int, check_interval: float, wake_timeout: float):
+        self.idle_seconds = idle_seconds
+        self.check_interval = check_interval
+        self.wake_timeout = wake_timeout
+        self.last_activity: Dict[str, float] = {}
+        self._last_rx: Dict[str, int] = {}
+        self._log_offset: Optional[int] = None
+        # Deployment ID -> [lock, holders and waiters]; entries go once nobody uses them
+        self._wake_locks: Dict[str, list] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        # Without a proxy in front there is nothing to hold requests while a container wakes
+        return self.idle_seconds > 0 and domain_service.base_domain != "localhost"
+
+    def start(self):
+        """Start the background idle sweep"""
+        if not self.enabled:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Scale-to-zero enabled (idle after {self.idle_seconds}s)")
+
+    async def stop(self):
+        """Stop the background idle sweep"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def record_activity(self, deployment_id: str, timestamp: Optional[float] = None):
+        timestamp = timestamp or time.time()
+        if timestamp > self.last_activity.get(deployment_id, 0):
+            self.last_activity[deployment_id] = timestamp
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"Idle sweep failed: {e}")
+
+    async def sweep(self):
+        """Collect activity signals and stop deployments idle longer than the threshold"""
+        await asyncio.to_thread(self._read_access_log)
+
+        running = await firebase_service.get_deployments_by_status([DeploymentStatus.RUNNING.value])
+        now = time.time()
+        for deployment in running:
+            deployment_id = deployment['id']
+            container_id = deployment.get('container_id')
+            if not container_id:
+                continue
+
+            replicas = deployment_replicas(deployment)
+            for replica in replicas:
+                self._check_network_activity(deployment_id, replica['container_id'])
+
+            # First sighting starts the idle clock rather than stopping immediately
+            last_seen = self.last_activity.setdefault(deployment_id, now)
+            if now - last_seen >= self.idle_seconds:
+                await self.scale_to_zero(deployment_id, replicas)
+
+    def _read_access_log(self):
+        """Consume new lines of the nginx activity log (`$msec $host`)"""
+        path = settings.NGINX_ACTIVITY_LOG
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+
+        if self._log_offset is None or size < self._log_offset:
+            # First read, or the log was rotated: only count activity from here on
+            self._log_offset = size if self._log_offset is None else 0
+
+        with open(path, 'rb') as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        # Leave any partially written final line for the next pass
+        complete = data.rfind(b'\n') + 1
+        self._log_offset += complete
+
+        for line in data[:complete].splitlines():
+            try:
+                msec, host = line.decode('utf-8', errors='replace').split(' ', 1)
+                deployment_id = domain_service.deployment_for_host(host.strip())
+                if deployment_id:
+                    self.record_activity(deployment_id, float(msec))
+            except ValueError:
+                continue
+
+    def _check_network_activity(self, deployment_id: str, container_id: str):
+        samples = stats_sampler.get_samples(container_id, 1)
+        if not samples:
+            return
+        rx_bytes = samples[-1].get('network_rx_bytes', 0)
+        previous = self._last_rx.get(container_id)
+        self._last_rx[container_id] = rx_bytes
+        if previous is not None and rx_bytes - previous >= NETWORK_ACTIVITY_MIN_BYTES:
+            self.record_activity(deployment_id, samples[-1]['timestamp'])
+
+    @asynccontextmanager
+    async def _wake_lock(self, deployment_id: str):
+        """Serialize waking and scaling to zero for one deployment"""
+        entry = self._wake_locks.setdefault(deployment_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._wake_locks[deployment_id]
+
+    async def scale_to_zero(self, deployment_id: str, replicas: List[Dict[str, Any]]) -> bool:
+        """Stop an idle deployment's containers, keeping their ports and route for waking"""
+        async with self._wake_lock(deployment_id):
+            if not await docker_service.stop_replicas(replicas):
+                return False
+            await firebase_service.update_deployment(deployment_id, {
+                'status': DeploymentStatus.STOPPED.value,
+                'scaled_to_zero': True
+            })
+            for replica in replicas:
+                self._last_rx.pop(replica['container_id'], None)
+            logger.info(f"Scaled idle deployment {deployment_id} to zero")
+            return True
+
+    async def wake(self, deployment_id: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Start a scaled-to-zero deployment and wait until it accepts connections.
+
+        Concurrent callers for the same deployment share a single start.
+        """
+        async with self._wake_lock(deployment_id):
+            deployment_doc = firebase_service.db.collection('deployments').document(deployment_id).get()
+            if not deployment_doc.exists:
+                return False, None
+            deployment_data = deployment_doc.to_dict()
+
+            if deployment_data.get('status') == DeploymentStatus.RUNNING.value:
+                return True, deployment_data
+            if deployment_data.get('status') != DeploymentStatus.STOPPED.value or \
+                    not deployment_data.get('scaled_to_zero'):
+                # Manually stopped or failed deployments stay down
+                return False, deployment_data
+
+            replicas = deployment_replicas(deployment_data)
+            if not await docker_service.start_replicas(replicas):
+                return False, deployment_data
+            if not await docker_service.wait_replicas_ready(replicas, self.wake_timeout):
+                logger.error(f"Deployment {deployment_id} did not become ready within {self.wake_timeout}s")
+                return False, deployment_data
+
+            await firebase_service.update_deployment(deployment_id, {
+                'status': DeploymentStatus.RUNNING.value,
+                'scaled_to_zero': False
+            })
+            deployment_data['status'] = DeploymentStatus.RUNNING.value
+            self.record_activity(deployment_id)
+            logger.info(f"Woke deployment {deployment_id}")
+            return True, deployment_data
+
+# Global idle monitor instance
+idle_monitor = IdleMonitor(
+    idle_seconds=settings.SCALE_TO_ZERO_IDLE_SECONDS,
+    check_interval=settings.SCALE_TO_ZERO_CHECK_INTERVAL,
+    wake_timeout=settings.WAKE_TIMEOUT
+)
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Set
+from config import settings
+from docker_service import docker_service, LABEL_DEPLOYMENT_ID
+from firebase_config import firebase_service
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class ImageGarbageCollector:
+    """Evicts deployment images that are neither live nor retained for rollback"""
+
+    def __init__(self, interval: float, keep_per_deployment: int, disk_budget_bytes: int):
+        self.interval = interval
+        self.keep_per_deployment = keep_per_deployment
+        self.disk_budget_bytes = disk_budget_bytes
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the periodic collection loop"""
+        if self.interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Image garbage collector started (every {self.interval}s)")
+
+    async def stop(self):
+        """Stop the periodic collection loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.collect()
+            except Exception as e:
+                logger.warning(f"Image garbage collection failed: {e}")
+
+    async def collect(self) -> Dict[str, Any]:
+        """Run one collection pass and return a summary"""
+        deployment_ids = await firebase_service.get_all_deployment_ids()
+        summary = {
+            'removed_images': [],
+            'bytes_reclaimed': 0,
+            'dangling_bytes_reclaimed': 0,
+            'image_bytes_after': 0,
+            'disk_budget_bytes': self.disk_budget_bytes,
+            'hosts': {}
+        }
+        # Each host has its own image store and its own budget
+        for host in docker_service.hosts:
+            try:
+                host_summary = await asyncio.to_thread(self._collect, host.client, deployment_ids)
+            except Exception as e:
+                logger.warning(f"Image garbage collection failed on {host.name}: {e}")
+                continue
+            summary['hosts'][host.name] = host_summary
+            summary['removed_images'].extend(host_summary['removed_images'])
+            for key in ('bytes_reclaimed', 'dangling_bytes_reclaimed', 'image_bytes_after'):
+                summary[key] += host_summary[key]
+        summary['completed_at'] = time.time()
+        self.last_run = summary
+        metrics.image_gc_reclaimed_bytes_total.inc(summary['bytes_reclaimed'])
+        metrics.image_gc_removed_images_total.inc(len(summary['removed_images']))
+        logger.info(
+            f"Image GC removed {len(summary['removed_images'])} images, "
+            f"reclaimed {summary['bytes_reclaimed'] / (1024 * 1024):.1f} MB "
+            f"({summary['image_bytes_after'] / (1024 * 1024):.1f} MB of deployment images remain)"
+        )
+        return summary
+
+    def _collect(self, client, deployment_ids: Optional[Set[str]]) -> Dict[str, Any]:
+        images = self._deployment_images(client)
+
+        # Images referenced by any container, running or stopped, are live
+        in_use = {container.attrs.get('Image') for container in client.containers.list(all=True)}
+
+        by_deployment: Dict[str, List[Any]] = {}
+        orphaned = []
+        for image in images:
+            deployment_id = (image.labels or {}).get(LABEL_DEPLOYMENT_ID)
+            if deployment_id and (deployment_ids is None or deployment_id in deployment_ids):
+                by_deployment.setdefault(deployment_id, []).append(image)
+            elif deployment_id or deployment_ids is not None:
+                # Deleted deployment, or unlabeled legacy image we cannot attribute
+                orphaned.append(image)
+
+        retained = set()
+        for deployment_images in by_deployment.values():
+            deployment_images.sort(key=self._last_used, reverse=True)
+            retained.update(image.id for image in deployment_images[:self.keep_per_deployment])
+
+        total_bytes = sum(image.attrs.get('Size', 0) for image in images)
+        removed: List[str] = []
+        bytes_reclaimed = 0
+
+        def remove(image) -> bool:
+            nonlocal total_bytes, bytes_reclaimed
+            try:
+                client.images.remove(image.id, force=True)
+            except Exception as e:
+                logger.warning(f"Could not remove image {image.id}: {e}")
+                return False
+            size = image.attrs.get('Size', 0)
+            total_bytes -= size
+            bytes_reclaimed += size
+            removed.append(image.tags[0] if image.tags else image.id)
+            return True
+
+        # Images of deleted deployments are garbage regardless of the budget
+        for image in orphaned:
+            if image.id not in in_use:
+                remove(image)
+
+        # Older images of live deployments go least-recently-used first, only while over budget
+        candidates = [
+            image for images_list in by_deployment.values() for image in images_list
+            if image.id not in in_use and image.id not in retained
+        ]
+        candidates.sort(key=self._last_used)
+        for image in candidates:
+            if total_bytes <= self.disk_budget_bytes:
+                break
+            remove(image)
+
+        # Intermediate layers left behind by failed or replaced builds
+        dangling_reclaimed = 0
+        try:
+            result = client.images.prune(filters={'dangling': True})
+            dangling_reclaimed += result.get('SpaceReclaimed') or 0
+        except Exception as e:
+            logger.warning(f"Could not prune dangling images: {e}")
+        # The build cache is left alone: later builds reuse its layers
+
+        return {
+            'removed_images': removed,
+            'bytes_reclaimed': bytes_reclaimed + dangling_reclaimed,
+            'dangling_bytes_reclaimed': dangling_reclaimed,
+            'image_bytes_after': total_bytes
+        }
+
+    def _deployment_images(self, client) -> List[Any]:
+        """All images built for deployments, labelled or (for older builds) by tag prefix"""
+        images = {image.id: image for image in client.images.list(filters={'label': LABEL_DEPLOYMENT_ID})}
+        for image in client.images.list(filters={'reference': 'instantsite_*'}):
+            images.setdefault(image.id, image)
+        return list(images.values())
+
+    def _last_used(self, image) -> float:
+        """Best available recency signal: the later of creation and last tag time"""
+        timestamps = [image.attrs.get('Created'), (image.attrs.get('Metadata') or {}).get('LastTagTime')]
+        latest = 0.0
+        for value in timestamps:
+            if not value or value.startswith('0001-'):
+                continue
+            try:
+                # Docker timestamps carry nanoseconds; trim to microseconds for fromisoformat
+                trimmed = value.rstrip('Z').split('.')
+                fraction = (trimmed[1][:6] if len(trimmed) > 1 else '').ljust(6, '0')
+                parsed = datetime.fromisoformat(f"{trimmed[0]}.{fraction}+00:00")
+                latest = max(latest, parsed.timestamp())
+            except ValueError:
+                continue
+        return latest
+
+# Global image garbage collector instance
+image_gc = ImageGarbageCollector(
+    interval=settings.IMAGE_GC_INTERVAL,
+    keep_per_deployment=settings.IMAGE_GC_KEEP_PER_DEPLOYMENT,
+    disk_budget_bytes=settings.IMAGE_GC_DISK_BUDGET_MB * 1024 * 1024
+)
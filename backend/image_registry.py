@@ -0,0 +1,238 @@
+import asyncio
+import base64
+import json
+import logging
+import time
+from typing import Optional, Dict, Any, List, Set, Tuple
+import httpx
+from config import settings
+from host_pool import host_pool, DockerHost
+from docker_api import DockerNotFound, ANONYMOUS_REGISTRY_AUTH
+from firebase_config import firebase_service
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Manifest formats daemons push; asked for explicitly so the registry returns the digest that was pushed
+MANIFEST_MEDIA_TYPES = ", ".join([
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+])
+
+class ImageRegistry:
+    """Publishes deployment images to a registry so any Docker host can run them.
+
+    Once a deployment is live its image is pushed, tagged with the image ID, and the record
+    keeps the pushed manifest digest as `image_ref`. A host that does not have the image pulls
+    it by that digest instead of rebuilding from source. Cleanup deletes the manifests of
+    deleted deployments and all but the newest few of each live one; the registry's own
+    garbage collection then frees the blobs.
+    """
+
+    def __init__(self, address: str, api_url: str, repository: str, username: str, password: str,
+                 keep_per_deployment: int, interval: float, timeout: float):
+        # Registry as the Docker daemons reach it (host:port), and its HTTP API as the API reaches it
+        self.address = address
+        self.api_url = api_url or (f"http://{address}" if address else "")
+        self.repository = repository
+        # Basic auth (registry htpasswd); both empty for a registry only reachable locally
+        self.username = username
+        self.password = password
+        self.keep_per_deployment = keep_per_deployment
+        self.interval = interval
+        self.timeout = timeout
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pushes: Set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.address)
+
+    @property
+    def image_repository(self) -> str:
+        return f"{self.address}/{self.repository}"
+
+    @property
+    def docker_auth(self) -> str:
+        """X-Registry-Auth value handing the daemons the registry credentials"""
+        if not self.username:
+            return ANONYMOUS_REGISTRY_AUTH
+        config = {'username': self.username, 'password': self.password, 'serveraddress': self.address}
+        return base64.urlsafe_b64encode(json.dumps(config).encode()).decode()
+
+    def publish_later(self, deployment_id: str, container_id: str, docker_host: Optional[str]):
+        """Push a live deployment's image in the background and record its digest when done"""
+        if not self.enabled:
+            return
+        task = asyncio.create_task(self._publish_and_record(deployment_id, container_id, docker_host))
+        self._pushes.add(task)
+        task.add_done_callback(self._pushes.discard)
+
+    async def _publish_and_record(self, deployment_id: str, container_id: str, docker_host: Optional[str]):
+        try:
+            image_ref = await self.publish(host_pool.get(docker_host), container_id)
+        except Exception as e:
+            metrics.registry_pushes_total.inc(outcome="failure")
+            logger.warning(f"Pushing the image of deployment {deployment_id} failed: {e}")
+            return
+        metrics.registry_pushes_total.inc(outcome="success")
+        # Pushes finish in any order: only the one for the container still serving is recorded,
+        # so a slow push of a replaced version never overwrites the current one
+        if await firebase_service.update_deployment_if(
+            deployment_id, {'container_id': container_id}, {'image_ref': image_ref}
+        ):
+            logger.info(f"Pushed image of deployment {deployment_id} as {image_ref}")
+        else:
+            logger.info(f"Pushed image of deployment {deployment_id} is no longer current, not recording it")
+
+    async def publish(self, host: DockerHost, container_id: str) -> str:
+        """Push the image a container runs and return its by-digest reference"""
+        image_id = (await host.api.inspect_container(container_id))['Image']
+        # Content-derived tag: pushing the same image again is a no-op
+        tag = image_id.split(':', 1)[-1]
+        await host.api.tag_image(image_id, self.image_repository, tag)
+
+        digest = None
+        start = time.perf_counter()
+        async for chunk in host.api.push_image(self.image_repository, tag, self.docker_auth):
+            if 'error' in chunk:
+                raise Exception(chunk['error'])
+            digest = (chunk.get('aux') or {}).get('Digest') or digest
+        metrics.registry_transfer_seconds.observe(time.perf_counter() - start, direction="push")
+        if not digest:
+            raise Exception("Registry did not report a digest for the pushed image")
+        return f"{self.image_repository}@{digest}"
+
+    async def ensure_image(self, host: DockerHost, image_ref: str) -> str:
+        """Make a pushed image available on a host, pulling it by digest unless it is there already"""
+        try:
+            await host.api.inspect_image(image_ref)
+            return image_ref
+        except DockerNotFound:
+            pass
+
+        repository, _, digest = image_ref.partition('@')
+        start = time.perf_counter()
+        async for chunk in host.api.pull_image(repository, digest, self.docker_auth):
+            if 'error' in chunk:
+                raise Exception(chunk['error'])
+        metrics.registry_transfer_seconds.observe(time.perf_counter() - start, direction="pull")
+        metrics.registry_pulls_total.inc()
+        logger.info(f"Pulled {image_ref} onto {host.name}")
+        return image_ref
+
+    def start(self):
+        """Start the periodic registry cleanup loop"""
+        if not self.enabled or self.interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Registry cleanup started (every {self.interval}s)")
+
+    async def stop(self):
+        """Stop the cleanup loop and abandon pushes in progress"""
+        for task in list(self._pushes):
+            task.cancel()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.collect()
+            except Exception as e:
+                logger.warning(f"Registry cleanup failed: {e}")
+
+    async def collect(self) -> Dict[str, Any]:
+        """Delete manifests no deployment needs: those of deleted deployments and all but the newest K of live ones"""
+        from docker_service import LABEL_DEPLOYMENT_ID
+
+        deployments = await firebase_service.get_all_deployments()
+        if deployments is None:
+            raise RuntimeError("could not read deployments")
+        live = {deployment['id'] for deployment in deployments}
+        # Digests records point at are never deleted, whatever their age
+        referenced = {
+            deployment['image_ref'].partition('@')[2]
+            for deployment in deployments if deployment.get('image_ref')
+        }
+
+        auth = (self.username, self.password) if self.username else None
+        async with httpx.AsyncClient(base_url=self.api_url, auth=auth, timeout=self.timeout) as client:
+            manifests = await self._list_manifests(client, LABEL_DEPLOYMENT_ID)
+
+            by_deployment: Dict[str, List[Tuple[str, str]]] = {}
+            doomed = []
+            for digest, (deployment_id, created) in manifests.items():
+                if deployment_id in live:
+                    by_deployment.setdefault(deployment_id, []).append((created, digest))
+                elif digest not in referenced:
+                    doomed.append(digest)
+            for images in by_deployment.values():
+                images.sort(reverse=True)
+                doomed.extend(digest for _, digest in images[self.keep_per_deployment:] if digest not in referenced)
+
+            removed = []
+            for digest in doomed:
+                response = await client.delete(f"/v2/{self.repository}/manifests/{digest}")
+                if response.status_code == 405:
+                    logger.warning("Registry refuses deletes; run it with REGISTRY_STORAGE_DELETE_ENABLED=true")
+                    break
+                if response.status_code in (202, 404):
+                    removed.append(digest)
+                else:
+                    logger.warning(f"Could not delete manifest {digest}: HTTP {response.status_code}")
+
+        summary = {
+            'manifests_seen': len(manifests),
+            'removed_manifests': removed,
+            'completed_at': time.time()
+        }
+        self.last_run = summary
+        metrics.registry_removed_manifests_total.inc(len(removed))
+        if removed:
+            logger.info(f"Registry cleanup deleted {len(removed)} of {len(manifests)} image manifests")
+        return summary
+
+    async def _list_manifests(self, client: httpx.AsyncClient, label: str) -> Dict[str, Tuple[Optional[str], str]]:
+        """Each pushed manifest's digest, with the deployment its image was built for and its creation time"""
+        response = await client.get(f"/v2/{self.repository}/tags/list")
+        if response.status_code == 404:
+            return {}
+        response.raise_for_status()
+
+        manifests = {}
+        for tag in response.json().get('tags') or []:
+            response = await client.get(
+                f"/v2/{self.repository}/manifests/{tag}", headers={'Accept': MANIFEST_MEDIA_TYPES}
+            )
+            if response.status_code == 404:
+                continue
+            response.raise_for_status()
+            digest = response.headers['Docker-Content-Digest']
+            # The image config carries the build labels and creation time
+            config = await client.get(f"/v2/{self.repository}/blobs/{response.json()['config']['digest']}")
+            config.raise_for_status()
+            image_config = config.json()
+            labels = (image_config.get('config') or {}).get('Labels') or {}
+            manifests[digest] = (labels.get(label), image_config.get('created', ''))
+        return manifests
+
+# Global image registry instance
+image_registry = ImageRegistry(
+    address=settings.REGISTRY_ADDRESS,
+    api_url=settings.REGISTRY_API_URL,
+    repository=settings.REGISTRY_REPOSITORY,
+    username=settings.REGISTRY_USERNAME,
+    password=settings.REGISTRY_PASSWORD,
+    keep_per_deployment=settings.REGISTRY_KEEP_PER_DEPLOYMENT,
+    interval=settings.REGISTRY_GC_INTERVAL,
+    timeout=settings.DOCKER_API_TIMEOUT
+)
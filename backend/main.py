@@ -1,14 +1,16 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 import logging
 import os
+import time
 from contextlib import asynccontextmanager
 
 from config import settings
-from routes import auth, deployments
+from routes import auth, deployments, uploads, internal
 from models import ErrorResponse
+import metrics
 
 # Configure logging
 logging.basicConfig(
@@ -27,18 +29,26 @@ async def lifespan(app: FastAPI):
     os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
     os.makedirs(settings.CLONE_DIR, exist_ok=True)
     
-    try:
-        # Test Firebase connection
-        from firebase_config import firebase_service
-        logger.info("Firebase connection established")
-        
-        # Test Docker connection
-        from docker_service import docker_service
-        logger.info("Docker connection established")
-        
-    except Exception as e:
-        logger.error(f"Failed to initialize services: {str(e)}")
-        raise e
+    # Expire abandoned chunked uploads
+    from upload_service import upload_store
+    upload_store.start()
+    
+    # Collect stored archives no deployment references any more
+    from archive_store import archive_store
+    archive_store.start()
+    
+    # Fan deployment status events out to subscribed clients, across instances with Redis
+    from deployment_events import deployment_events
+    deployment_events.start()
+    
+    # Share rate limit buckets across instances when Redis is configured
+    from rate_limit import rate_limiter
+    rate_limiter.start()
+    
+    # Connect Firebase and Docker and start the services that need them in the background;
+    # /ready reports when that is done
+    from warmup import service_warmup
+    service_warmup.start()
     
     logger.info("Zipp API started successfully")
     
@@ -46,6 +56,26 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down Zipp API...")
+    await service_warmup.stop()
+    from stats_service import stats_sampler
+    from idle_service import idle_monitor
+    from reconciler import reconciler
+    from image_gc import image_gc
+    from counter_verifier import counter_verifier
+    from image_registry import image_registry
+    await reconciler.stop()
+    await image_gc.stop()
+    await counter_verifier.stop()
+    await image_registry.stop()
+    await upload_store.stop()
+    await archive_store.stop()
+    await deployment_events.stop()
+    await rate_limiter.stop()
+    await idle_monitor.stop()
+    await stats_sampler.stop()
+    await internal.close_wake_client()
+    from host_pool import host_pool
+    await host_pool.close()
 
 # Create FastAPI app
 app = FastAPI(
@@ -83,6 +113,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency middleware
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Record per-route request latency for the /metrics endpoint"""
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Label by route template rather than raw path to keep cardinality bounded
+        route = request.scope.get("route")
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status_code)
+        )
+
 # Global exception handler
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -92,7 +142,9 @@ async def http_exception_handler(request: Request, exc: HTTPException):
         content=ErrorResponse(
             message=exc.detail,
             error_code=str(exc.status_code)
-        ).dict()
+        ).dict(),
+        # Keep Retry-After, WWW-Authenticate and the like
+        headers=exc.headers
     )
 
 @app.exception_handler(Exception)
@@ -111,7 +163,7 @@ async def general_exception_handler(request: Request, exc: Exception):
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Liveness: answers as soon as the process serves requests, without touching dependencies"""
     return {
         "status": "healthy",
         "app_name": settings.APP_NAME,
@@ -119,6 +171,23 @@ async def health_check():
         "debug": settings.DEBUG
     }
 
+# Readiness endpoint
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 503 until warm-up is done and Firebase and a Docker host are reachable"""
+    from warmup import service_warmup
+    readiness = await service_warmup.readiness()
+    return JSONResponse(
+        status_code=200 if readiness['ready'] else 503,
+        content=readiness
+    )
+
+# Prometheus metrics endpoint
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Export pipeline, container and API metrics in Prometheus text format"""
+    return Response(content=metrics.registry.render(), media_type=metrics.MetricsRegistry.CONTENT_TYPE)
+
 # API Info endpoint
 @app.get("/")
 async def root():
@@ -128,12 +197,16 @@ async def root():
         "version": settings.APP_VERSION,
         "docs": "/docs",
         "redoc": "/redoc",
-        "health": "/health"
+        "health": "/health",
+        "ready": "/ready",
+        "metrics": "/metrics"
     }
 
 # Include routers
 app.include_router(auth.router, prefix="/api")
+app.include_router(uploads.router, prefix="/api")
 app.include_router(deployments.router, prefix="/api")
+app.include_router(internal.router)
 
 # Static files (for serving deployed content via reverse proxy)
 if os.path.exists("static"):
@@ -0,0 +1,349 @@
+import time
+import threading
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Buckets (seconds) for pipeline stages, which range from sub-second port
+# allocation up to multi-minute builds
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Buckets (seconds) for API request latency
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._callback: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, callback: Callable[[], float]):
+        """Compute the (unlabelled) value lazily at scrape time"""
+        self._callback = callback
+
+    def _samples(self) -> List[str]:
+        if self._callback is not None:
+            try:
+                return [f"{self.name} {_format_value(self._callback())}"]
+            except Exception as e:
+                logger.warning(f"Failed to collect gauge {self.name}: {e}")
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the enclosed block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Minimal in-process metrics registry rendered in Prometheus text format"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = STAGE_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Render every registered metric in Prometheus exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Global metrics registry
+registry = MetricsRegistry()
+
+# Deployment pipeline metrics
+deployment_stage_seconds = registry.histogram(
+    "zipp_deployment_stage_duration_seconds",
+    "Time spent in each deployment pipeline stage",
+    ["stage"],
+)
+deployments_total = registry.counter(
+    "zipp_deployments_total",
+    "Deployments processed, by source type and outcome",
+    ["deployment_type", "outcome"],
+)
+builds_total = registry.counter(
+    "zipp_builds_total",
+    "Docker image builds, by outcome",
+    ["outcome"],
+)
+build_cache_hits_total = registry.counter(
+    "zipp_build_cache_hits_total",
+    "Dockerfile steps served from the Docker build cache",
+)
+build_steps_total = registry.counter(
+    "zipp_build_steps_total",
+    "Dockerfile steps executed across all builds",
+)
+deployment_failures_total = registry.counter(
+    "zipp_deployment_failures_total",
+    "Deployment failures, by the stage that failed",
+    ["stage"],
+)
+deployment_queue_depth = registry.gauge(
+    "zipp_deployment_queue_depth",
+    "Deployments accepted but not yet finished",
+)
+running_containers = registry.gauge(
+    "zipp_running_containers",
+    "Running deployment containers, as of the last stats sample",
+)
+port_range_utilization = registry.gauge(
+    "zipp_port_range_utilization_ratio",
+    "Fraction of the deployment port range currently allocated",
+)
+
+# Build scheduling metrics
+build_queue_length = registry.gauge(
+    "zipp_build_queue_length",
+    "Builds waiting for a build slot",
+)
+builds_running = registry.gauge(
+    "zipp_builds_running",
+    "Builds currently holding a build slot",
+)
+build_queue_wait_seconds = registry.histogram(
+    "zipp_build_queue_wait_seconds",
+    "Time builds waited for a build slot",
+)
+
+# Image garbage collection metrics
+image_gc_reclaimed_bytes_total = registry.counter(
+    "zipp_image_gc_reclaimed_bytes_total",
+    "Bytes reclaimed by the image garbage collector",
+)
+image_gc_removed_images_total = registry.counter(
+    "zipp_image_gc_removed_images_total",
+    "Deployment images removed by the image garbage collector",
+)
+
+# Archive store metrics
+archive_store_uploads_total = registry.counter(
+    "zipp_archive_store_uploads_total",
+    "Uploaded archives, by whether an identical one was already stored",
+    ["outcome"],
+)
+archive_store_reclaimed_bytes_total = registry.counter(
+    "zipp_archive_store_reclaimed_bytes_total",
+    "Bytes reclaimed by removing unused stored archives",
+)
+
+# User counter metrics
+user_counter_repairs_total = registry.counter(
+    "zipp_user_counter_repairs_total",
+    "Users whose deployment counters were found out of date and recounted",
+)
+
+# Image registry metrics
+registry_pushes_total = registry.counter(
+    "zipp_registry_pushes_total",
+    "Deployment images pushed to the registry, by outcome",
+    ["outcome"],
+)
+registry_pulls_total = registry.counter(
+    "zipp_registry_pulls_total",
+    "Deployment images pulled from the registry onto another Docker host",
+)
+registry_transfer_seconds = registry.histogram(
+    "zipp_registry_transfer_duration_seconds",
+    "Time spent pushing images to or pulling them from the registry",
+    ["direction"],
+)
+registry_removed_manifests_total = registry.counter(
+    "zipp_registry_removed_manifests_total",
+    "Image manifests deleted from the registry by cleanup",
+)
+
+# Rate limiting metrics
+rate_limit_rejections_total = registry.counter(
+    "zipp_rate_limit_rejections_total",
+    "Requests rejected with 429, by rate limit budget",
+    ["budget"],
+)
+
+# Deployment event metrics
+deployment_event_subscribers = registry.gauge(
+    "zipp_deployment_event_subscribers",
+    "Clients subscribed to deployment status events on this instance",
+)
+
+# Reconciliation metrics
+reconcile_actions_total = registry.counter(
+    "zipp_reconcile_actions_total",
+    "Corrective actions taken by the startup/periodic reconciler",
+    ["action"],
+)
+
+# Routing metrics
+nginx_reloads_total = registry.counter(
+    "zipp_nginx_reloads_total",
+    "nginx configuration reloads, by outcome",
+    ["outcome"],
+)
+
+# API metrics
+http_request_seconds = registry.histogram(
+    "zipp_http_request_duration_seconds",
+    "API request latency, by route template",
+    ["method", "route", "status"],
+    buckets=REQUEST_BUCKETS,
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Record the duration of a pipeline stage and count it as the failing stage on error"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        deployment_failures_total.inc(stage=stage)
+        raise
+    finally:
+        deployment_stage_seconds.observe(time.perf_counter() - start, stage=stage)
@@ -15,6 +15,19 @@ class DeploymentStatus(str, Enum):
     RUNNING = "running"
     FAILED = "failed"
     STOPPED = "stopped"
+    CANCELLED = "cancelled"
+
+class BulkAction(str, Enum):
+    STOP = "stop"
+    START = "start"
+    DELETE = "delete"
+    REDEPLOY = "redeploy"
+
+class ResourceTier(str, Enum):
+    MICRO = "micro"
+    SMALL = "small"
+    MEDIUM = "medium"
+    LARGE = "large"
 
 # User Models
 class UserResponse(BaseModel):
@@ -41,10 +54,32 @@ class GitDeploymentRequest(BaseModel):
     branch: Optional[str] = "main"
     name: Optional[str] = None
     description: Optional[str] = None
+    resource_tier: Optional[ResourceTier] = None  # Defaults by detected project type
 
 class ZipDeploymentRequest(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
+    resource_tier: Optional[ResourceTier] = None  # Defaults by detected project type
+
+class UploadCreateRequest(BaseModel):
+    filename: str
+    size: int  # Total bytes
+    chunk_size: Optional[int] = None  # Defaults to the server's chunk size
+    sha256: Optional[str] = None  # Whole-file digest; lets an archive this user stored before skip the upload
+    name: Optional[str] = None
+    description: Optional[str] = None
+    resource_tier: Optional[ResourceTier] = None
+
+class ResourceUpdateRequest(BaseModel):
+    tier: Optional[ResourceTier] = None  # Omit to apply the recommended tier
+
+class ScaleRequest(BaseModel):
+    replicas: int
+
+class BulkDeploymentRequest(BaseModel):
+    deployment_ids: List[str]
+    action: BulkAction
+    branch: Optional[str] = None  # Redeploy only; defaults to each deployment's branch
 
 class DeploymentResponse(BaseModel):
     id: str
@@ -58,6 +93,11 @@ class DeploymentResponse(BaseModel):
     container_id: Optional[str] = None
     port: Optional[int] = None
     public_url: Optional[str] = None
+    resource_tier: Optional[ResourceTier] = None
+    replicas: int = 1
+    queue_position: Optional[int] = None  # Set while waiting for a build slot
+    queue_eta_seconds: Optional[float] = None
+    scaled_to_zero: bool = False
     build_logs: List[str] = []
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
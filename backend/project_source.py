@@ -0,0 +1,394 @@
+import gzip
+import os
+import posixpath
+import stat
+import tarfile
+import time
+import zipfile
+from typing import Optional, Dict, List, Iterator, Tuple, Union, BinaryIO
+from docker.utils.build import PatternMatcher
+from cancellation import CancelToken
+
+try:
+    import zstandard
+except ImportError:
+    # Optional: without it .tar.zst uploads are rejected
+    zstandard = None
+
+# Bytes copied from an archive member per chunk of the streamed build context
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Top-level files project detection and the build read; tarballs keep these in memory
+# from their indexing pass so they need not be decompressed again to be read
+MANIFEST_FILES = {'Dockerfile', '.dockerignore', 'package.json'}
+# Largest manifest kept in memory
+MAX_MANIFEST_SIZE = 1024 * 1024
+
+# Upload suffixes by archive format
+ARCHIVE_FORMATS = {
+    '.zip': 'zip',
+    '.tar.gz': 'gzip',
+    '.tgz': 'gzip',
+    '.tar.zst': 'zstd',
+    '.tzst': 'zstd',
+}
+ARCHIVE_MAGIC = {
+    'zip': b'PK\x03\x04',
+    'gzip': b'\x1f\x8b',
+    'zstd': b'\x28\xb5\x2f\xfd',
+}
+
+class DirectorySource:
+    """Project files checked out on disk"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def top_level(self) -> List[str]:
+        return os.listdir(self.path)
+
+    def read(self, name: str) -> Optional[bytes]:
+        file_path = os.path.join(self.path, name)
+        if not os.path.isfile(file_path):
+            return None
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+    def tar_stream(self, extra_files: Optional[Dict[str, bytes]] = None,
+                   cancel_token: Optional[CancelToken] = None) -> Iterator[bytes]:
+        """Yield the build context as an uncompressed tar, honouring .dockerignore.
+
+        `extra_files` are added to the context, replacing files of the same name.
+        """
+        extra_files = extra_files or {}
+        matcher = _dockerignore_matcher(self) or PatternMatcher([])
+
+        for name in sorted(matcher.walk(self.path)):
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            name = name.replace(os.sep, '/')
+            if name in extra_files:
+                continue
+            file_path = os.path.join(self.path, name)
+            try:
+                info = os.lstat(file_path)
+            except FileNotFoundError:
+                continue
+
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.mtime = int(info.st_mtime)
+            tarinfo.mode = stat.S_IMODE(info.st_mode)
+            if stat.S_ISDIR(info.st_mode):
+                tarinfo.type = tarfile.DIRTYPE
+                yield tarinfo.tobuf(tarfile.PAX_FORMAT)
+            elif stat.S_ISLNK(info.st_mode):
+                tarinfo.type = tarfile.SYMTYPE
+                tarinfo.linkname = os.readlink(file_path)
+                yield tarinfo.tobuf(tarfile.PAX_FORMAT)
+            elif stat.S_ISREG(info.st_mode):
+                tarinfo.size = info.st_size
+                yield tarinfo.tobuf(tarfile.PAX_FORMAT)
+                with open(file_path, 'rb') as f:
+                    sent = 0
+                    for chunk in _copy(f):
+                        chunk = chunk[:info.st_size - sent]
+                        sent += len(chunk)
+                        yield chunk
+                # A file that shrank while being read still fills its declared size
+                yield b'\0' * (info.st_size - sent)
+                yield _padding(info.st_size)
+
+        yield from _closing_entries(extra_files)
+
+class ArchiveSource:
+    """A ZIP upload used in place: manifests are read straight from the archive and the build
+    context is streamed out of it member by member, so it is never extracted to disk"""
+
+    def __init__(self, zip_path: str):
+        self.path = zip_path
+        with zipfile.ZipFile(zip_path, 'r') as archive:
+            members = [(info, _safe_name(info.filename)) for info in archive.infolist()]
+        members = [(info, name) for info, name in members if name]
+
+        self.root = _project_root([(name, info.is_dir()) for info, name in members])
+
+        self.members: List[Tuple[zipfile.ZipInfo, str]] = []
+        for info, name in members:
+            if name.startswith(self.root):
+                relative = name[len(self.root):]
+                if relative:
+                    self.members.append((info, relative))
+
+    @property
+    def file_count(self) -> int:
+        return sum(1 for info, _ in self.members if not info.is_dir())
+
+    @property
+    def uncompressed_size(self) -> int:
+        return sum(info.file_size for info, _ in self.members)
+
+    def top_level(self) -> List[str]:
+        return sorted({name.split('/')[0] for _, name in self.members})
+
+    def read(self, name: str) -> Optional[bytes]:
+        for info, relative in self.members:
+            if relative == name and not info.is_dir():
+                with zipfile.ZipFile(self.path, 'r') as archive:
+                    return archive.read(info)
+        return None
+
+    def tar_stream(self, extra_files: Optional[Dict[str, bytes]] = None,
+                   cancel_token: Optional[CancelToken] = None) -> Iterator[bytes]:
+        """Yield the build context as an uncompressed tar, honouring .dockerignore.
+
+        `extra_files` are added to the context, replacing archive members of the same name.
+        """
+        extra_files = extra_files or {}
+        matcher = _dockerignore_matcher(self)
+
+        with zipfile.ZipFile(self.path, 'r') as archive:
+            for info, name in self.members:
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                if name in extra_files or (matcher and matcher.matches(name)):
+                    continue
+
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.mtime = time.mktime(info.date_time + (0, 0, -1))
+                mode = (info.external_attr >> 16) & 0o777
+                if info.is_dir():
+                    tarinfo.type = tarfile.DIRTYPE
+                    tarinfo.mode = mode or 0o755
+                    yield tarinfo.tobuf(tarfile.PAX_FORMAT)
+                    continue
+
+                tarinfo.mode = mode or 0o644
+                tarinfo.size = info.file_size
+                yield tarinfo.tobuf(tarfile.PAX_FORMAT)
+                with archive.open(info) as member:
+                    yield from _copy(member)
+                yield _padding(info.file_size)
+
+        yield from _closing_entries(extra_files)
+
+class TarballSource:
+    """A compressed tarball upload (.tar.gz or .tar.zst) used in place.
+
+    Tarballs have no directory to seek in, so opening one decompresses it once as a stream
+    to index its members and keep the top-level manifests. The build context is another
+    streaming pass that re-frames members into an uncompressed tar as the daemon reads it;
+    nothing is ever extracted to disk.
+    """
+
+    def __init__(self, path: str, compression: str):
+        self.path = path
+        self.compression = compression
+        entries = []
+        links = []
+        candidates: Dict[str, bytes] = {}
+        with _decompressed(path, compression) as stream, tarfile.open(fileobj=stream, mode='r|') as archive:
+            for member in archive:
+                name = _safe_name(member.name)
+                if not name or not _supported_member(member):
+                    continue
+                entries.append((name, member.isdir(), member.size if member.isfile() else 0))
+                if member.islnk():
+                    links.append((name, _safe_name(member.linkname)))
+                # The project root is not known until every name is seen, so keep
+                # manifests at either of the two depths it can be at
+                if (member.isfile() and name.count('/') <= 1 and member.size <= MAX_MANIFEST_SIZE
+                        and posixpath.basename(name) in MANIFEST_FILES):
+                    candidates[name] = archive.extractfile(member).read()
+
+        self.root = _project_root([(name, is_dir) for name, is_dir, _ in entries])
+        self.names: List[Tuple[str, bool, int]] = []
+        for name, is_dir, size in entries:
+            if name.startswith(self.root) and name[len(self.root):]:
+                self.names.append((name[len(self.root):], is_dir, size))
+        # Hard link members carry no data of their own; reads follow them to their target
+        self.hardlinks = {
+            name[len(self.root):]: target[len(self.root):]
+            for name, target in links
+            if target and name.startswith(self.root) and target.startswith(self.root)
+        }
+        self.manifests = {
+            name[len(self.root):]: content
+            for name, content in candidates.items()
+            if name.startswith(self.root) and '/' not in name[len(self.root):]
+        }
+
+    @property
+    def file_count(self) -> int:
+        return sum(1 for _, is_dir, _ in self.names if not is_dir)
+
+    @property
+    def uncompressed_size(self) -> int:
+        return sum(size for _, _, size in self.names)
+
+    def top_level(self) -> List[str]:
+        return sorted({name.split('/')[0] for name, _, _ in self.names})
+
+    def read(self, name: str) -> Optional[bytes]:
+        name = self.hardlinks.get(name, name)
+        if name in self.manifests:
+            return self.manifests[name]
+        if not any(relative == name and not is_dir for relative, is_dir, _ in self.names):
+            return None
+        # Anything else takes another pass over the stream
+        with _decompressed(self.path, self.compression) as stream, tarfile.open(fileobj=stream, mode='r|') as archive:
+            for member in archive:
+                if member.isfile() and self._relative(member.name) == name:
+                    return archive.extractfile(member).read()
+        return None
+
+    def tar_stream(self, extra_files: Optional[Dict[str, bytes]] = None,
+                   cancel_token: Optional[CancelToken] = None) -> Iterator[bytes]:
+        """Yield the build context as an uncompressed tar, honouring .dockerignore.
+
+        `extra_files` are added to the context, replacing archive members of the same name.
+        """
+        extra_files = extra_files or {}
+        matcher = _dockerignore_matcher(self)
+        sent = set()
+        # Files other members hard link to are sent even when ignored, or the links would dangle
+        link_targets = {
+            target for link, target in self.hardlinks.items()
+            if not (link in extra_files or (matcher and matcher.matches(link)))
+        }
+
+        with _decompressed(self.path, self.compression) as stream, tarfile.open(fileobj=stream, mode='r|') as archive:
+            for member in archive:
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                name = self._relative(member.name)
+                if not name or not _supported_member(member):
+                    continue
+                if name in extra_files or (matcher and matcher.matches(name) and name not in link_targets):
+                    continue
+
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.mtime = member.mtime
+                tarinfo.mode = member.mode
+                tarinfo.type = member.type
+                if member.issym():
+                    tarinfo.linkname = member.linkname
+                elif member.islnk():
+                    # Hard links name another member, which moves with the root and
+                    # must itself be in the context
+                    target = self._relative(member.linkname)
+                    if target not in sent:
+                        continue
+                    tarinfo.linkname = target
+                elif member.isfile():
+                    tarinfo.size = member.size
+                yield tarinfo.tobuf(tarfile.PAX_FORMAT)
+                sent.add(name)
+                if member.isfile():
+                    yield from _copy(archive.extractfile(member))
+                    yield _padding(member.size)
+
+        yield from _closing_entries(extra_files)
+
+    def _relative(self, member_name: str) -> Optional[str]:
+        name = _safe_name(member_name)
+        if not name or not name.startswith(self.root):
+            return None
+        return name[len(self.root):] or None
+
+ProjectSource = Union[DirectorySource, ArchiveSource, TarballSource]
+
+def as_source(project: Union[str, ProjectSource]) -> ProjectSource:
+    """Treat a plain path as a directory source"""
+    return DirectorySource(project) if isinstance(project, str) else project
+
+def open_archive_source(path: str) -> Union[ArchiveSource, TarballSource]:
+    """Project source for an uploaded archive, by its file name"""
+    archive_format = ARCHIVE_FORMATS.get(archive_suffix(path))
+    if archive_format is None:
+        raise ValueError(f"Unsupported archive type: {os.path.basename(path)}")
+    if archive_format == 'zip':
+        return ArchiveSource(path)
+    return TarballSource(path, archive_format)
+
+def archive_suffix(filename: str) -> str:
+    """Suffix of a supported archive file name, or '' if it is not one"""
+    lowered = filename.lower()
+    for suffix, archive_format in ARCHIVE_FORMATS.items():
+        if lowered.endswith(suffix) and (archive_format != 'zstd' or zstandard is not None):
+            return suffix
+    return ''
+
+def supported_archive_types() -> str:
+    """Human-readable list of the archive types uploads may use"""
+    suffixes = ['.zip', '.tar.gz'] + (['.tar.zst'] if zstandard is not None else [])
+    return ', '.join(suffixes)
+
+def is_valid_archive(path: str, filename: str) -> bool:
+    """Whether a file starts like the archive its name says it is"""
+    archive_format = ARCHIVE_FORMATS.get(archive_suffix(filename))
+    if archive_format is None:
+        return False
+    if archive_format == 'zip':
+        return zipfile.is_zipfile(path)
+    magic = ARCHIVE_MAGIC[archive_format]
+    with open(path, 'rb') as f:
+        return f.read(len(magic)) == magic
+
+def _decompressed(path: str, compression: str) -> BinaryIO:
+    """Decompressing reader over a tarball, read front to back"""
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if zstandard is None:
+        raise ValueError("zstandard is not installed, .tar.zst archives are not supported")
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+
+def _supported_member(member: tarfile.TarInfo) -> bool:
+    """Files, directories and links; devices and FIFOs have no place in a build context"""
+    return member.isfile() or member.isdir() or member.issym() or member.islnk()
+
+def _project_root(names: List[Tuple[str, bool]]) -> str:
+    """A single top-level directory is the project root, as extracting used to assume"""
+    top = {name.split('/')[0] for name, _ in names}
+    if len(top) == 1:
+        (only,) = top
+        if any(name.startswith(only + '/') or is_dir for name, is_dir in names):
+            return only + '/'
+    return ''
+
+def _dockerignore_matcher(source: ProjectSource) -> Optional[PatternMatcher]:
+    dockerignore = source.read('.dockerignore')
+    if not dockerignore:
+        return None
+    patterns = [line.strip() for line in dockerignore.decode('utf-8', 'replace').splitlines()]
+    patterns = [pattern for pattern in patterns if pattern and not pattern.startswith('#')]
+    # The Dockerfile and .dockerignore always reach the daemon, as with docker build
+    return PatternMatcher(patterns + ['!Dockerfile', '!.dockerignore'])
+
+def _copy(member: BinaryIO) -> Iterator[bytes]:
+    while True:
+        chunk = member.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+def _closing_entries(extra_files: Dict[str, bytes]) -> Iterator[bytes]:
+    """Injected files, then the end-of-archive marker"""
+    for name, content in extra_files.items():
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.mtime = time.time()
+        tarinfo.mode = 0o644
+        tarinfo.size = len(content)
+        yield tarinfo.tobuf(tarfile.PAX_FORMAT)
+        yield content
+        yield _padding(len(content))
+
+    yield b'\0' * (2 * tarfile.BLOCKSIZE)
+
+def _safe_name(filename: str) -> Optional[str]:
+    """Archive member name as a relative POSIX path, or None if it would escape the context"""
+    name = posixpath.normpath(filename.replace('\\', '/')).lstrip('/')
+    if name in ('', '.') or name == '..' or name.startswith('../'):
+        return None
+    return name
+
+def _padding(size: int) -> bytes:
+    return b'\0' * (-size % tarfile.BLOCKSIZE)
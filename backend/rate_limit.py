@@ -0,0 +1,172 @@
+import ipaddress
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Union
+from fastapi import HTTPException, Depends, Request, status
+from auth import get_current_user
+from models import UserResponse
+from config import settings
+import metrics
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    # Optional: without it every instance keeps its own buckets
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Takes a token from a bucket kept as a Redis hash, refilled from the time of the last take.
+# Returns the seconds until a token is available, 0 when one was taken.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+class TokenBucketLimiter:
+    """Token-bucket admission control per client and budget.
+
+    Each budget ("deploy", "read", ...) refills at a steady rate up to a burst size, and a
+    request takes one token from its client's bucket or is rejected with the wait until the
+    next token. Buckets live in this process, or in Redis so every instance shares them.
+    """
+
+    def __init__(self, budgets: Dict[str, Tuple[float, int]], redis_url: str, prefix: str, max_buckets: int):
+        # Budget name -> (tokens per second, burst); a zero rate leaves the budget unlimited
+        self.budgets = budgets
+        self.redis_url = redis_url
+        self.prefix = prefix
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._redis = None
+        self._script = None
+
+    async def check(self, budget: str, client: str):
+        """Admit one request, raising 429 with Retry-After when the client's bucket is empty"""
+        rate, burst = self.budgets[budget]
+        if rate <= 0:
+            return
+        wait = await self.acquire(f"{budget}:{client}", rate, burst)
+        if wait > 0:
+            metrics.rate_limit_rejections_total.inc(budget=budget)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, slow down",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))}
+            )
+
+    async def acquire(self, key: str, rate: float, burst: int) -> float:
+        """Take a token; 0 when admitted, otherwise the seconds until one is available"""
+        if self._script is not None:
+            try:
+                return float(await self._script(keys=[self.prefix + key], args=[rate, burst]))
+            except Exception as e:
+                # Keep limiting, per instance, while Redis is unreachable
+                logger.warning(f"Rate limit check against Redis failed, using local buckets: {e}")
+        return self._acquire_local(key, rate, burst)
+
+    def _acquire_local(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        # Forgetting the least recently used bucket only ever refills it early
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def start(self):
+        """Connect the shared Redis buckets, when configured"""
+        if not self.redis_url or self._redis is not None:
+            return
+        if redis is None:
+            logger.warning("RATE_LIMIT_REDIS_URL is set but the redis package is not installed; "
+                           "rate limits apply per instance")
+            return
+        self._redis = redis.from_url(self.redis_url)
+        self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+        logger.info("Rate limit buckets are shared through Redis")
+
+    async def stop(self):
+        """Close the Redis connection"""
+        if self._redis is not None:
+            client, self._redis, self._script = self._redis, None, None
+            await client.aclose()
+
+def _parse_networks(value: str) -> List[Union[ipaddress.IPv4Network, ipaddress.IPv6Network]]:
+    """Networks from a comma-separated list of IPs and CIDRs, skipping invalid entries"""
+    networks = []
+    for entry in filter(None, (item.strip() for item in value.split(','))):
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            logger.warning(f"Ignoring invalid trusted proxy address: {entry}")
+    return networks
+
+def client_address(request: Request) -> str:
+    """The caller's IP; behind a trusted proxy, the X-Real-IP it set to the address it was connected from"""
+    peer = request.client.host if request.client else None
+    if peer is None:
+        return "unknown"
+    forwarded = request.headers.get("x-real-ip")
+    if forwarded and _is_trusted_proxy(peer):
+        return forwarded
+    # Anyone reaching the API directly could put any value in the header
+    return peer
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def rate_limit(budget: str):
+    """Dependency charging a request to the signed-in user's bucket for a budget"""
+    async def dependency(current_user: UserResponse = Depends(get_current_user)):
+        await rate_limiter.check(budget, f"user:{current_user.uid}")
+    return dependency
+
+def ip_rate_limit(budget: str):
+    """Dependency charging a request to the caller's IP bucket for a budget, before any authentication"""
+    async def dependency(request: Request):
+        await rate_limiter.check(budget, f"ip:{client_address(request)}")
+    return dependency
+
+# Proxies whose X-Real-IP header is believed
+TRUSTED_PROXIES = _parse_networks(settings.RATE_LIMIT_TRUSTED_PROXIES)
+
+# Global rate limiter instance
+rate_limiter = TokenBucketLimiter(
+    budgets={
+        'deploy': (settings.RATE_LIMIT_DEPLOY_PER_MINUTE / 60, settings.RATE_LIMIT_DEPLOY_BURST),
+        'read': (settings.RATE_LIMIT_READ_PER_MINUTE / 60, settings.RATE_LIMIT_READ_BURST),
+        'stream': (settings.RATE_LIMIT_STREAM_PER_MINUTE / 60, settings.RATE_LIMIT_STREAM_BURST),
+        'auth': (settings.RATE_LIMIT_AUTH_PER_MINUTE / 60, settings.RATE_LIMIT_AUTH_BURST),
+    },
+    redis_url=settings.RATE_LIMIT_REDIS_URL,
+    prefix="zipp:ratelimit:",
+    max_buckets=settings.RATE_LIMIT_MAX_BUCKETS
+)
@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Set, Tuple
+from config import settings
+from models import DeploymentStatus
+from docker_service import docker_service, deployment_replicas
+from domain_service import domain_service
+from firebase_config import firebase_service
+from upload_service import upload_store
+from archive_store import archive_store
+from cancellation import deployment_tasks
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Statuses of a pipeline that is still in progress
+IN_FLIGHT_STATUSES = {
+    DeploymentStatus.PENDING.value,
+    DeploymentStatus.CLONING.value,
+    DeploymentStatus.BUILDING.value,
+    DeploymentStatus.DEPLOYING.value,
+}
+
+class Reconciler:
+    """Brings Firestore deployment records, Docker containers and work directories back in sync"""
+
+    def __init__(self, interval: float, grace_seconds: float, max_concurrency: int):
+        self.interval = interval
+        self.grace_seconds = grace_seconds
+        self.max_concurrency = max_concurrency
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Reconcile once now, then periodically"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic reconciliation loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning(f"Reconciliation failed: {e}")
+            if self.interval <= 0:
+                return
+            await asyncio.sleep(self.interval)
+
+    async def reconcile(self) -> Dict[str, Any]:
+        """Run one reconciliation pass and return a summary of what was fixed.
+
+        An in-flight deployment counts as orphaned once its record has gone untouched for the
+        grace period, even right after startup: other API instances sharing the records may
+        still be running its pipeline.
+        """
+        started = time.time()
+
+        # One bulk listing on each side, diffed in memory
+        unreachable_hosts: Set[str] = set()
+        containers = await docker_service.list_containers(
+            all=True, filters={"name": "instantsite_"}, unreachable=unreachable_hosts
+        )
+        deployments = await firebase_service.get_all_deployments()
+        if deployments is None:
+            logger.warning("Skipping reconciliation: could not list deployments")
+            return {}
+
+        containers_by_id = {container['Id']: container for _, container in containers}
+        referenced_containers = {
+            replica['container_id'] for deployment in deployments for replica in deployment_replicas(deployment)
+        }
+
+        status_updates: Dict[str, Dict[str, Any]] = {}
+        pruned: Dict[str, List[Dict[str, Any]]] = {}
+        for deployment in deployments:
+            status = deployment.get('status')
+
+            if status == DeploymentStatus.RUNNING.value:
+                replicas = deployment_replicas(deployment)
+                # A host we cannot see is not evidence that its containers are gone
+                visible = [
+                    replica for replica in replicas
+                    if docker_service.hosts.get(replica.get('docker_host')).name not in unreachable_hosts
+                ]
+                missing = [replica for replica in visible if replica['container_id'] not in containers_by_id]
+                found = [containers_by_id[replica['container_id']] for replica in visible if replica not in missing]
+
+                if missing and len(missing) == len(replicas):
+                    status_updates[deployment['id']] = {
+                        'status': DeploymentStatus.FAILED.value,
+                        'build_logs': deployment.get('build_logs', []) + ['Container no longer exists']
+                    }
+                elif found and all(container.get('State') != 'running' for container in found):
+                    status_updates[deployment['id']] = {
+                        'status': DeploymentStatus.STOPPED.value,
+                        'scaled_to_zero': False
+                    }
+                elif missing:
+                    # Serve from the replicas that are left, promoting one if the primary is gone
+                    survivors = [replica for replica in replicas if replica not in missing]
+                    status_updates[deployment['id']] = {
+                        'replicas': len(survivors),
+                        'replica_set': survivors,
+                        'container_id': survivors[0]['container_id'],
+                        'port': survivors[0].get('port'),
+                        'docker_host': survivors[0].get('docker_host')
+                    }
+                    pruned[deployment['id']] = missing
+            elif (status in IN_FLIGHT_STATUSES and not deployment_tasks.is_running(deployment['id'])
+                  and self._is_stale(deployment.get('updated_at'))):
+                status_updates[deployment['id']] = {
+                    'status': DeploymentStatus.FAILED.value,
+                    'build_logs': deployment.get('build_logs', []) + ['Deployment interrupted']
+                }
+
+        if status_updates and await firebase_service.batch_update_deployments(status_updates):
+            for deployment_id, missing in pruned.items():
+                for replica in missing:
+                    if replica.get('port'):
+                        docker_service.release_port(replica['port'], replica.get('docker_host'))
+                domain_service.create_nginx_config(deployment_id, status_updates[deployment_id]['replica_set'])
+            if pruned:
+                domain_service.schedule_reload()
+
+        # Containers no deployment record references, including replicas left behind by an
+        # interrupted redeploy or scale of a deployment that still exists
+        orphaned = []
+        for host, container in containers:
+            if container['Id'] not in referenced_containers and self._is_stale(container.get('Created')):
+                orphaned.append((host, container))
+        removed_containers = await self._remove_containers(orphaned)
+
+        # Leftover clone/extract/upload directories from failed or interrupted pipelines;
+        # chunked upload sessions and stored archives are expired by their own stores, and
+        # sources of pipelines still running (or waiting for a build slot) are kept
+        freed_bytes, removed_paths = await asyncio.to_thread(
+            self._clean_work_dirs, [settings.CLONE_DIR, settings.UPLOAD_DIR],
+            {upload_store.root, archive_store.root} | set(docker_service.work_paths)
+        )
+
+        summary = {
+            'deployments_marked_failed': sum(
+                1 for update in status_updates.values() if update.get('status') == DeploymentStatus.FAILED.value
+            ),
+            'deployments_marked_stopped': sum(
+                1 for update in status_updates.values() if update.get('status') == DeploymentStatus.STOPPED.value
+            ),
+            'missing_replicas_dropped': sum(len(missing) for missing in pruned.values()),
+            'orphaned_containers_removed': removed_containers,
+            'work_paths_removed': removed_paths,
+            'bytes_freed': freed_bytes,
+            'containers_seen': len(containers),
+            'deployments_seen': len(deployments),
+            'duration_seconds': round(time.time() - started, 3),
+        }
+        self.last_run = summary
+        for action in ('deployments_marked_failed', 'deployments_marked_stopped', 'missing_replicas_dropped',
+                       'orphaned_containers_removed', 'work_paths_removed'):
+            metrics.reconcile_actions_total.inc(summary[action], action=action)
+        logger.info(f"Reconciliation complete: {summary}")
+        return summary
+
+    def _is_stale(self, timestamp: Any) -> bool:
+        """Whether a Firestore datetime, Docker ISO timestamp or Unix time is older than the grace period"""
+        if timestamp is None:
+            return True
+        try:
+            if isinstance(timestamp, (int, float)):
+                timestamp = datetime.fromtimestamp(timestamp, timezone.utc)
+            elif isinstance(timestamp, str):
+                # Docker reports nanoseconds; fromisoformat handles at most microseconds
+                base, _, fraction = timestamp.rstrip('Z').partition('.')
+                timestamp = datetime.fromisoformat(f"{base}.{fraction[:6].ljust(6, '0')}+00:00")
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            return (datetime.now(timezone.utc) - timestamp).total_seconds() > self.grace_seconds
+        except (ValueError, AttributeError, TypeError):
+            return False
+
+    async def _remove_containers(self, containers: List[Tuple[Any, Any]]) -> int:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def remove(host, container) -> bool:
+            async with semaphore:
+                name = (container.get('Names') or [container['Id']])[0].lstrip('/')
+                try:
+                    await host.api.remove_container(container['Id'], force=True)
+                except Exception as e:
+                    logger.warning(f"Could not remove orphaned container {name}: {e}")
+                    return False
+                for port in self._host_ports(container):
+                    docker_service.release_port(port, host.name)
+                logger.info(f"Removed orphaned container {name}")
+                return True
+
+        results = await asyncio.gather(*(remove(host, container) for host, container in containers))
+        return sum(1 for removed in results if removed)
+
+    def _host_ports(self, container) -> List[int]:
+        return [port['PublicPort'] for port in container.get('Ports') or [] if port.get('PublicPort')]
+
+    def _tree_size(self, path: str) -> int:
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    total += os.lstat(os.path.join(dirpath, filename)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def _clean_work_dirs(self, directories: List[str], keep: Set[str]):
+        keep = {os.path.abspath(path) for path in keep}
+        cutoff = time.time() - self.grace_seconds
+        freed = 0
+        removed = 0
+        for directory in directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if os.path.abspath(entry.path) in keep:
+                    continue
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        size = self._tree_size(entry.path)
+                        shutil.rmtree(entry.path)
+                    else:
+                        size = entry.stat(follow_symlinks=False).st_size
+                        os.remove(entry.path)
+                    freed += size
+                    removed += 1
+                except OSError as e:
+                    logger.warning(f"Could not remove stale path {entry.path}: {e}")
+        return freed, removed
+
+# Global reconciler instance
+reconciler = Reconciler(
+    interval=settings.RECONCILE_INTERVAL,
+    grace_seconds=settings.RECONCILE_GRACE_SECONDS,
+    max_concurrency=settings.RECONCILE_MAX_CONCURRENCY
+)
@@ -0,0 +1,84 @@
+import logging
+from typing import Optional, Dict, Any
+from config import settings
+from docker_service import RESOURCE_TIERS, CONTAINER_CPU_PERIOD, DEFAULT_RESOURCE_TIER, parse_memory
+from stats_service import stats_sampler
+
+logger = logging.getLogger(__name__)
+
+# A container throttled in more than this share of CPU periods is starved, not just busy
+THROTTLED_RATIO_THRESHOLD = 0.1
+
+class ResourceRecommender:
+    """Suggests the smallest resource tier that covers a container's observed usage"""
+
+    def __init__(self, min_samples: int, headroom: float):
+        self.min_samples = min_samples
+        self.headroom = headroom
+
+    def tier_limits(self, tier: str) -> Dict[str, Any]:
+        """Memory (bytes) and CPUs granted by a tier"""
+        limits = RESOURCE_TIERS[tier]
+        return {
+            'memory_bytes': parse_memory(limits['mem_limit']),
+            'cpus': limits['cpu_quota'] / CONTAINER_CPU_PERIOD
+        }
+
+    def recommend(self, container_id: str, current_tier: Optional[str]) -> Dict[str, Any]:
+        """Compare the sampled history against the current tier and pick the best fit"""
+        current_tier = current_tier or DEFAULT_RESOURCE_TIER
+        summary = stats_sampler.summarize(container_id)
+        recommendation = {
+            'current_tier': current_tier,
+            'recommended_tier': None,
+            'samples': summary['samples'],
+            'reason': None
+        }
+
+        if summary['samples'] < self.min_samples:
+            recommendation['reason'] = (
+                f"Not enough usage data yet ({summary['samples']} of {self.min_samples} samples)"
+            )
+            return recommendation
+
+        # Size memory for the near-worst case and CPU for sustained load, each with headroom
+        memory_needed = summary['memory_usage_bytes']['p99'] * self.headroom
+        cpus_needed = summary['cpu_percent']['p90'] / 100 * self.headroom
+        throttled = summary['cpu_throttled_ratio']['p90'] > THROTTLED_RATIO_THRESHOLD
+        current_cpus = self.tier_limits(current_tier)['cpus']
+        if throttled:
+            # Observed CPU is capped by the quota, so it understates demand
+            cpus_needed = max(cpus_needed, current_cpus * 1.5)
+
+        tiers = sorted(RESOURCE_TIERS, key=lambda tier: self.tier_limits(tier)['memory_bytes'])
+        recommended = tiers[-1]
+        for tier in tiers:
+            limits = self.tier_limits(tier)
+            if limits['memory_bytes'] >= memory_needed and limits['cpus'] >= cpus_needed:
+                recommended = tier
+                break
+
+        recommendation.update({
+            'recommended_tier': recommended,
+            'observed': {
+                'memory_p99_bytes': summary['memory_usage_bytes']['p99'],
+                'cpu_p90_percent': summary['cpu_percent']['p90'],
+                'cpu_throttled_p90': summary['cpu_throttled_ratio']['p90'],
+            },
+            'needed': {
+                'memory_bytes': int(memory_needed),
+                'cpus': round(cpus_needed, 3),
+            },
+            'reason': (
+                "Current tier fits observed usage" if recommended == current_tier
+                else "CPU is being throttled" if throttled
+                else f"Observed usage fits the {recommended} tier"
+            )
+        })
+        return recommendation
+
+# Global recommender instance
+resource_recommender = ResourceRecommender(
+    min_samples=settings.RIGHTSIZING_MIN_SAMPLES,
+    headroom=settings.RIGHTSIZING_HEADROOM
+)
@@ -1,13 +1,14 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from models import TokenRequest, AuthResponse, UserResponse, APIResponse
 from auth import auth_service, get_current_user
+from rate_limit import rate_limit, ip_rate_limit
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
-@router.post("/login", response_model=AuthResponse)
+@router.post("/login", response_model=AuthResponse, dependencies=[Depends(ip_rate_limit("auth"))])
 async def login(token_request: TokenRequest):
     """
     Login or signup user with Firebase ID token.
@@ -37,14 +38,14 @@ async def login(token_request: TokenRequest):
             detail="Authentication failed"
         )
 
-@router.get("/me", response_model=UserResponse)
+@router.get("/me", response_model=UserResponse, dependencies=[Depends(rate_limit("read"))])
 async def get_current_user_info(current_user: UserResponse = Depends(get_current_user)):
     """
     Get current authenticated user information.
     """
     return current_user
 
-@router.post("/verify", response_model=APIResponse)
+@router.post("/verify", response_model=APIResponse, dependencies=[Depends(ip_rate_limit("auth"))])
 async def verify_token(token_request: TokenRequest):
     """
     Verify if a Firebase token is valid without creating/updating user.
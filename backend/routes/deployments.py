@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Form, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Form, BackgroundTasks, Query, Header, Response
+from fastapi.responses import StreamingResponse
 from models import (
     GitDeploymentRequest, 
     ZipDeploymentRequest,
@@ -7,30 +8,201 @@ from models import (
     APIResponse,
     DeploymentStatus,
     DeploymentType,
+    ResourceTier,
+    ResourceUpdateRequest,
+    ScaleRequest,
+    BulkDeploymentRequest,
+    BulkAction,
     UserResponse
 )
 from auth import get_current_user
 from firebase_config import firebase_service
-from docker_service import docker_service
+from docker_service import docker_service, deployment_replicas, DEFAULT_RESOURCE_TIER, Placement
+from stats_service import stats_sampler
+from build_scheduler import build_scheduler
+from rightsizing import resource_recommender
+from domain_service import domain_service
+from host_pool import host_pool
+from cancellation import CancelToken, deployment_tasks
+from rate_limit import rate_limit
+from image_registry import image_registry
+from archive_store import archive_store
+from deployment_events import deployment_events, snapshot_event
+from project_source import archive_suffix, supported_archive_types
 from config import settings
+from metrics import stage_timer
+import metrics
 import logging
 import os
 import uuid
 import asyncio
-from typing import Optional
+import hashlib
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/deployments", tags=["deployments"])
 
+# Deployments with a redeploy running in this process
+_active_redeploys = set()
+
+# Deployment ID -> [lock, holders and waiters] for scale requests in this process
+_scale_locks: Dict[str, list] = {}
+
+# Statuses of a deployment whose initial pipeline has not finished
+IN_FLIGHT_STATUSES = {
+    DeploymentStatus.PENDING.value,
+    DeploymentStatus.CLONING.value,
+    DeploymentStatus.BUILDING.value,
+    DeploymentStatus.DEPLOYING.value,
+}
+
+def _publish_deployment(deployment_id: str, replicas: List[Dict[str, Any]]) -> str:
+    """Route a deployment through nginx and return its public URL"""
+    if domain_service.base_domain != "localhost" and domain_service.create_nginx_config(deployment_id, replicas):
+        return domain_service.generate_public_url(deployment_id, use_ssl=domain_service.ssl_enabled())
+    # Without nginx only the primary replica is reachable
+    primary = replicas[0]
+    return f"http://{host_pool.get(primary.get('docker_host')).public_address}:{primary['port']}"
+
+@asynccontextmanager
+async def _scale_lock(deployment_id: str):
+    """Serialize scale requests for one deployment; the lock is dropped once nobody holds or awaits it"""
+    entry = _scale_locks.setdefault(deployment_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _scale_locks[deployment_id]
+
+async def _clone_while_placing(
+    repo_url: str,
+    branch: str,
+    user_id: str,
+    deployment_name: str,
+    resource_tier: str,
+    cancel_token: Optional[CancelToken] = None,
+    host_name: Optional[str] = None
+) -> Tuple[str, List[str], Placement]:
+    """Clone a repository while a host and port are reserved for its build alongside.
+    
+    Placement uses the requested tier, or the default one until the project type is known.
+    """
+    placing = asyncio.ensure_future(docker_service.place(user_id, deployment_name, resource_tier, host_name))
+    try:
+        with stage_timer("clone"):
+            project_path, clone_logs = await docker_service.clone_repository(repo_url, branch, cancel_token)
+    except BaseException:
+        placing.cancel()
+        try:
+            docker_service.release_placement(await placing)
+        except BaseException:
+            pass
+        raise
+    
+    try:
+        placement = await placing
+    except BaseException:
+        docker_service.cleanup_project_files(project_path)
+        raise
+    return project_path, clone_logs, placement
+
+async def _discard_cancelled_deployment(
+    deployment_id: str,
+    deployment_type: str,
+    project_path: Optional[str],
+    placement: Optional[Placement],
+    replica_set: Optional[List[Dict[str, Any]]]
+):
+    """Undo whatever a cancelled initial deployment got to and mark it cancelled"""
+    logger.info(f"Deployment {deployment_id} cancelled")
+    metrics.deployments_total.inc(deployment_type=deployment_type, outcome="cancelled")
+    
+    # build_and_deploy removes its own partial container, image and port; this covers the
+    # stages around it
+    if placement:
+        docker_service.release_placement(placement)
+    if replica_set:
+        await docker_service.remove_replicas(replica_set)
+        domain_service.remove_nginx_config(deployment_id)
+    if project_path:
+        docker_service.cleanup_project_files(project_path)
+    
+    await firebase_service.update_deployment(deployment_id, {
+        'status': DeploymentStatus.CANCELLED.value,
+        'build_logs': ['Deployment cancelled']
+    })
+
+def _deployments_etag(deployments: List[Dict[str, Any]]) -> Optional[str]:
+    """Strong ETag for a set of deployment records, from their IDs and last write times.
+    
+    None when a record has no write time to go by. The API version is included so a changed
+    response format is never served as unmodified.
+    """
+    digest = hashlib.sha256(settings.APP_VERSION.encode())
+    for deployment_data in sorted(deployments, key=lambda deployment_data: deployment_data['id']):
+        updated_at = deployment_data.get('updated_at')
+        if not isinstance(updated_at, datetime):
+            return None
+        digest.update(f"\0{deployment_data['id']}\0{updated_at.isoformat()}".encode())
+    return f'"{digest.hexdigest()[:32]}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Whether an If-None-Match header names this ETag (weak comparison, as conditional GETs use)"""
+    if not if_none_match or not etag:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+def _conditional_headers(etag: Optional[str]) -> Dict[str, str]:
+    # Clients may keep the response but must revalidate it on every use
+    headers = {'Cache-Control': 'private, no-cache'}
+    if etag:
+        headers['ETag'] = etag
+    return headers
+
+def _get_owned_deployment(deployment_id: str, current_user: UserResponse) -> Dict[str, Any]:
+    """Fetch a deployment record, raising 404/403 unless it belongs to the current user"""
+    deployment_doc = firebase_service.db.collection('deployments').document(deployment_id).get()
+    
+    if not deployment_doc.exists:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deployment not found"
+        )
+    
+    deployment_data = deployment_doc.to_dict()
+    
+    if deployment_data['user_id'] != current_user.uid:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
+        )
+    
+    return deployment_data
+
 async def process_git_deployment(
     deployment_id: str,
     user_id: str,
     repo_url: str,
     branch: str,
-    deployment_name: str
+    deployment_name: str,
+    resource_tier: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None
 ):
     """Background task to process Git deployment"""
+    project_path = None
+    placement = None
+    replica_set = None
     try:
         # Update status to cloning
         await firebase_service.update_deployment(deployment_id, {
@@ -38,105 +210,408 @@ async def process_git_deployment(
             'build_logs': ['Starting Git clone process...']
         })
         
-        # Clone repository
-        project_path, clone_logs = await docker_service.clone_repository(repo_url, branch)
+        # Clone repository, reserving a host and port meanwhile
+        project_path, clone_logs, placement = await _clone_while_placing(
+            repo_url, branch, user_id, deployment_name, resource_tier or DEFAULT_RESOURCE_TIER, cancel_token
+        )
         
-        # Update status to building
-        await firebase_service.update_deployment(deployment_id, {
-            'status': DeploymentStatus.BUILDING.value,
-            'build_logs': clone_logs + ['Starting Docker build...']
-        })
+        # Requested tier, or the default for the detected project type
+        resource_tier = resource_tier or docker_service.default_resource_tier(project_path)
         
-        # Build and deploy
-        container_id, port, build_logs = await docker_service.build_and_deploy(
-            project_path, deployment_name, user_id
-        )
+        # Pull base images while the build waits for its slot
+        docker_service.start_prefetch(placement, project_path)
+        
+        # Wait for a build slot; the record carries queue position and ETA meanwhile
+        async with build_scheduler.slot(deployment_id, user_id):
+            # Update status to building
+            await firebase_service.update_deployment(deployment_id, {
+                'status': DeploymentStatus.BUILDING.value,
+                'build_logs': clone_logs + ['Starting Docker build...']
+            })
+            
+            # Build and deploy
+            container_id, port, docker_host, build_logs = await docker_service.build_and_deploy(
+                project_path, deployment_name, user_id, deployment_id, resource_tier, cancel_token, placement
+            )
+            # The port now belongs to the running container
+            placement = None
         
         # Generate public URL
-        public_url = f"http://{settings.BASE_DOMAIN}:{port}"
+        replica_set = [{'container_id': container_id, 'port': port, 'docker_host': docker_host}]
+        public_url = _publish_deployment(deployment_id, replica_set)
         
         # Update deployment with success
         await firebase_service.update_deployment(deployment_id, {
             'status': DeploymentStatus.RUNNING.value,
             'container_id': container_id,
             'port': port,
+            'docker_host': docker_host,
+            'resource_tier': resource_tier,
+            'replicas': 1,
+            'replica_set': replica_set,
             'public_url': public_url,
             'build_logs': clone_logs + build_logs
         })
         
+        # Make the image available to other hosts without a rebuild
+        image_registry.publish_later(deployment_id, container_id, docker_host)
+        
         # Cleanup project files
         docker_service.cleanup_project_files(project_path)
         
+        metrics.deployments_total.inc(deployment_type="git", outcome="success")
         logger.info(f"Git deployment {deployment_id} completed successfully")
         
+    except asyncio.CancelledError:
+        await _discard_cancelled_deployment(deployment_id, "git", project_path, placement, replica_set)
+        raise
     except Exception as e:
         error_msg = f"Deployment failed: {str(e)}"
         logger.error(f"Git deployment {deployment_id} failed: {error_msg}")
+        metrics.deployments_total.inc(deployment_type="git", outcome="failure")
+        if placement:
+            docker_service.release_placement(placement)
         
         # Update deployment with failure
         await firebase_service.update_deployment(deployment_id, {
             'status': DeploymentStatus.FAILED.value,
             'build_logs': [error_msg]
         })
+    finally:
+        metrics.deployment_queue_depth.dec()
 
 async def process_zip_deployment(
     deployment_id: str,
     user_id: str,
     zip_path: str,
-    deployment_name: str
+    deployment_name: str,
+    resource_tier: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None
 ):
     """Background task to process ZIP deployment"""
+    placement = None
+    replica_set = None
+    # Kept from the reconciler's cleanup however long the build waits in the queue
+    docker_service.work_paths.add(zip_path)
     try:
         # Update status to extracting
         await firebase_service.update_deployment(deployment_id, {
             'status': DeploymentStatus.CLONING.value,
-            'build_logs': ['Starting ZIP extraction...']
+            'build_logs': ['Reading uploaded archive...']
         })
         
-        # Extract ZIP file
-        project_path, extract_logs = await docker_service.extract_zip(zip_path)
+        # Read the archive in place; its files stream straight into the build context
+        with stage_timer("extract"):
+            source, extract_logs = await docker_service.open_archive(zip_path)
         
-        # Update status to building
-        await firebase_service.update_deployment(deployment_id, {
-            'status': DeploymentStatus.BUILDING.value,
-            'build_logs': extract_logs + ['Starting Docker build...']
-        })
+        # Requested tier, or the default for the detected project type
+        resource_tier = resource_tier or docker_service.default_resource_tier(source)
         
-        # Build and deploy
-        container_id, port, build_logs = await docker_service.build_and_deploy(
-            project_path, deployment_name, user_id
-        )
+        # Reserve a host and port and pull base images while the build waits for its slot
+        placement = await docker_service.place(user_id, deployment_name, resource_tier)
+        docker_service.start_prefetch(placement, source)
+        
+        # Wait for a build slot; the record carries queue position and ETA meanwhile
+        async with build_scheduler.slot(deployment_id, user_id):
+            # Update status to building
+            await firebase_service.update_deployment(deployment_id, {
+                'status': DeploymentStatus.BUILDING.value,
+                'build_logs': extract_logs + ['Starting Docker build...']
+            })
+            
+            # Build and deploy
+            container_id, port, docker_host, build_logs = await docker_service.build_and_deploy(
+                source, deployment_name, user_id, deployment_id, resource_tier, cancel_token, placement
+            )
+            # The port now belongs to the running container
+            placement = None
         
         # Generate public URL
-        public_url = f"http://{settings.BASE_DOMAIN}:{port}"
+        replica_set = [{'container_id': container_id, 'port': port, 'docker_host': docker_host}]
+        public_url = _publish_deployment(deployment_id, replica_set)
         
         # Update deployment with success
         await firebase_service.update_deployment(deployment_id, {
             'status': DeploymentStatus.RUNNING.value,
             'container_id': container_id,
             'port': port,
+            'docker_host': docker_host,
+            'resource_tier': resource_tier,
+            'replicas': 1,
+            'replica_set': replica_set,
             'public_url': public_url,
             'build_logs': extract_logs + build_logs
         })
+        image_registry.publish_later(deployment_id, container_id, docker_host)
         
         # Cleanup files
-        docker_service.cleanup_project_files(project_path)
         if os.path.exists(zip_path):
             os.remove(zip_path)
         
+        metrics.deployments_total.inc(deployment_type="zip", outcome="success")
         logger.info(f"ZIP deployment {deployment_id} completed successfully")
         
+    except asyncio.CancelledError:
+        await _discard_cancelled_deployment(deployment_id, "zip", None, placement, replica_set)
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+        raise
     except Exception as e:
         error_msg = f"Deployment failed: {str(e)}"
         logger.error(f"ZIP deployment {deployment_id} failed: {error_msg}")
+        metrics.deployments_total.inc(deployment_type="zip", outcome="failure")
+        if placement:
+            docker_service.release_placement(placement)
         
         # Update deployment with failure
         await firebase_service.update_deployment(deployment_id, {
             'status': DeploymentStatus.FAILED.value,
             'build_logs': [error_msg]
         })
+    finally:
+        docker_service.work_paths.discard(zip_path)
+        metrics.deployment_queue_depth.dec()
+
+async def process_redeploy(
+    deployment_id: str,
+    user_id: str,
+    zip_path: Optional[str] = None,
+    branch: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None
+):
+    """Background task to build a new version next to the running one and switch traffic to it"""
+    project_path = None
+    placement = None
+    new_replicas = []
+    retiring = []
+    # Set once the old version is gone, when its port is handed over without nginx
+    handed_over = False
+    logs = ['Redeploy started, current version keeps serving until the new one is ready']
+    if zip_path:
+        docker_service.work_paths.add(zip_path)
+    try:
+        deployment_data = firebase_service.db.collection('deployments').document(deployment_id).get().to_dict()
+        old_replicas = deployment_replicas(deployment_data)
+        
+        # Without nginx the public URL is the primary's host and port, so the new version is
+        # built on the same host and takes over the old port once it is ready
+        routed = domain_service.base_domain != "localhost"
+        pinned_host = old_replicas[0].get('docker_host') if old_replicas and not routed else None
+        
+        # Fetch new sources, placing the new version alongside
+        if zip_path:
+            with stage_timer("extract"):
+                source, source_logs = await docker_service.open_archive(zip_path)
+            resource_tier = deployment_data.get('resource_tier') or docker_service.default_resource_tier(source)
+            placement = await docker_service.place(user_id, deployment_data['name'], resource_tier, pinned_host)
+        else:
+            project_path, source_logs, placement = await _clone_while_placing(
+                deployment_data['repo_url'], branch or deployment_data.get('branch') or "main",
+                user_id, deployment_data['name'], deployment_data.get('resource_tier') or DEFAULT_RESOURCE_TIER,
+                cancel_token, pinned_host
+            )
+            source = project_path
+            resource_tier = deployment_data.get('resource_tier') or docker_service.default_resource_tier(source)
+        logs += source_logs
+        
+        # Build and start the new version with as many replicas as the old one
+        docker_service.start_prefetch(placement, source)
+        async with build_scheduler.slot(deployment_id, user_id):
+            container_id, port, docker_host, build_logs = await docker_service.build_and_deploy(
+                source, deployment_data['name'], user_id, deployment_id, resource_tier, cancel_token, placement
+            )
+            placement = None
+        logs += build_logs
+        new_replicas.append({'container_id': container_id, 'port': port, 'docker_host': docker_host})
+        # The new image is only pushed once the redeploy succeeds, so its replicas share the build host
+        for _ in range(len(old_replicas) - 1):
+            replica_id, replica_port, replica_host = await docker_service.run_replica(container_id, resource_tier, docker_host)
+            new_replicas.append({'container_id': replica_id, 'port': replica_port, 'docker_host': replica_host})
+        
+        with stage_timer("readiness"):
+            if not await docker_service.wait_replicas_ready(new_replicas, settings.WAKE_TIMEOUT):
+                raise Exception("New version did not become ready in time")
+        
+        if not routed and old_replicas:
+            # A port cannot move between containers: the old version stops, then the new image
+            # starts again on its port, so the URL stays the same after a brief gap
+            old_primary = old_replicas[0]
+            # The old port stays reserved so nothing else is handed it in between
+            if not await docker_service.remove_container(old_primary['container_id'], host=old_primary.get('docker_host')):
+                raise Exception("Could not stop the previous version to hand over its port")
+            await docker_service.remove_replicas(old_replicas[1:])
+            handed_over = True
+            temporary = new_replicas[0]
+            container_id, port, docker_host = await docker_service.run_replica(
+                temporary['container_id'], resource_tier, temporary['docker_host'], port=old_primary['port']
+            )
+            new_replicas[0] = {'container_id': container_id, 'port': port, 'docker_host': docker_host}
+            await docker_service.remove_replicas([temporary])
+            if not await docker_service.wait_until_ready(port, settings.WAKE_TIMEOUT, host=docker_host):
+                raise Exception("New version did not become ready on the previous port")
+            old_replicas = []
+        
+        # Switch traffic in a single nginx reload; the subdomain and public URL stay the same
+        public_url = _publish_deployment(deployment_id, new_replicas)
+        if routed:
+            reload = domain_service.schedule_reload()
+            outcome = await reload if reload else domain_service.last_reload
+            if not outcome or not outcome['success']:
+                # nginx kept the previous configuration; restore the matching route
+                if old_replicas:
+                    domain_service.create_nginx_config(deployment_id, old_replicas)
+                raise Exception("Routing switch failed, previous version is still serving")
+        logs.append("Traffic switched to the new version")
+        
+        await firebase_service.update_deployment(deployment_id, {
+            'status': DeploymentStatus.RUNNING.value,
+            'container_id': container_id,
+            'port': port,
+            'docker_host': docker_host,
+            'resource_tier': resource_tier,
+            'replicas': len(new_replicas),
+            'replica_set': new_replicas,
+            'public_url': public_url,
+            'scaled_to_zero': False,
+            # The previous version's image; the new one is recorded once pushed
+            'image_ref': None,
+            'build_logs': logs
+        })
+        new_replicas = []
+        image_registry.publish_later(deployment_id, container_id, docker_host)
+        
+        # Let requests already proxied to the old containers finish before removing them
+        if old_replicas:
+            retiring = old_replicas
+            await asyncio.sleep(settings.REDEPLOY_DRAIN_SECONDS)
+            await docker_service.remove_replicas(old_replicas)
+        
+        metrics.deployments_total.inc(deployment_type="redeploy", outcome="success")
+        logger.info(f"Redeploy of {deployment_id} completed successfully")
+        
+    except asyncio.CancelledError:
+        logger.info(f"Redeploy of {deployment_id} cancelled")
+        metrics.deployments_total.inc(deployment_type="redeploy", outcome="cancelled")
+        if retiring:
+            # Traffic already switched; only the drain was cut short
+            await docker_service.remove_replicas(retiring)
+        else:
+            if new_replicas:
+                await docker_service.remove_replicas(new_replicas)
+            if handed_over:
+                await firebase_service.update_deployment(deployment_id, {
+                    'status': DeploymentStatus.FAILED.value,
+                    'build_logs': logs + ['Redeploy cancelled after the previous version was stopped']
+                })
+            else:
+                await firebase_service.update_deployment(deployment_id, {
+                    'build_logs': logs + ['Redeploy cancelled, previous version is still serving']
+                })
+        raise
+    except Exception as e:
+        error_msg = f"Redeploy failed: {str(e)}"
+        logger.error(f"Redeploy of {deployment_id} failed: {error_msg}")
+        metrics.deployments_total.inc(deployment_type="redeploy", outcome="failure")
+        
+        if new_replicas:
+            await docker_service.remove_replicas(new_replicas)
+        if handed_over:
+            # The previous version already gave up its port
+            await firebase_service.update_deployment(deployment_id, {
+                'status': DeploymentStatus.FAILED.value,
+                'build_logs': logs + [error_msg]
+            })
+        else:
+            # The previous version is untouched; only record why the new one was discarded
+            await firebase_service.update_deployment(deployment_id, {
+                'build_logs': logs + [error_msg]
+            })
+    finally:
+        if placement:
+            docker_service.release_placement(placement)
+        if project_path:
+            docker_service.cleanup_project_files(project_path)
+        if zip_path:
+            docker_service.work_paths.discard(zip_path)
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+        _active_redeploys.discard(deployment_id)
+        metrics.deployment_queue_depth.dec()
 
-@router.post("/git", response_model=APIResponse)
+def _queue_redeploy(
+    background_tasks: BackgroundTasks,
+    deployment_id: str,
+    user_id: str,
+    zip_path: Optional[str],
+    branch: Optional[str]
+):
+    """Mark a deployment as redeploying and run the redeploy once the response is sent"""
+    _active_redeploys.add(deployment_id)
+    metrics.deployment_queue_depth.inc()
+    background_tasks.add_task(
+        deployment_tasks.run,
+        deployment_id,
+        process_redeploy,
+        deployment_id,
+        user_id,
+        zip_path,
+        branch
+    )
+
+async def _bulk_apply(
+    action: BulkAction,
+    deployment_id: str,
+    deployment_data: Dict[str, Any],
+    user_id: str,
+    branch: Optional[str],
+    background_tasks: BackgroundTasks
+) -> Dict[str, Any]:
+    """Do one deployment's part of a bulk action; record writes are returned for the caller to batch"""
+    replicas = deployment_replicas(deployment_data)
+    
+    if action == BulkAction.STOP:
+        if not deployment_data.get('container_id'):
+            return {'success': False, 'error': "No container to stop"}
+        if not await docker_service.stop_replicas(replicas):
+            return {'success': False, 'error': "Failed to stop container"}
+        # A manual stop is never woken automatically
+        return {
+            'success': True,
+            'status': DeploymentStatus.STOPPED.value,
+            'update': {'status': DeploymentStatus.STOPPED.value, 'scaled_to_zero': False}
+        }
+    
+    if action == BulkAction.START:
+        if not deployment_data.get('container_id'):
+            return {'success': False, 'error': "No container to start"}
+        if not await docker_service.start_replicas(replicas):
+            return {'success': False, 'error': "Failed to start container"}
+        if not await docker_service.wait_replicas_ready(replicas, settings.WAKE_TIMEOUT):
+            return {'success': False, 'error': "Container did not become ready in time"}
+        return {
+            'success': True,
+            'status': DeploymentStatus.RUNNING.value,
+            'update': {'status': DeploymentStatus.RUNNING.value, 'scaled_to_zero': False}
+        }
+    
+    if action == BulkAction.DELETE:
+        # Abort a build still in progress, then stop and remove containers if they exist
+        deployment_tasks.cancel(deployment_id)
+        await docker_service.remove_replicas(replicas)
+        domain_service.remove_nginx_config(deployment_id)
+        return {'success': True, 'status': 'deleted', 'delete': True}
+    
+    # Redeploy: uploaded deployments need a new archive each, so only Git ones can be rebuilt in bulk
+    if deployment_data['deployment_type'] != DeploymentType.GIT.value:
+        return {'success': False, 'error': "Uploaded deployments need a new archive to redeploy"}
+    if deployment_id in _active_redeploys or deployment_data.get('status') in IN_FLIGHT_STATUSES:
+        return {'success': False, 'error': "Deployment is already being built"}
+    if deployment_id in _scale_locks:
+        return {'success': False, 'error': "Deployment is being scaled"}
+    _queue_redeploy(background_tasks, deployment_id, user_id, None, branch)
+    return {'success': True, 'status': deployment_data.get('status')}
+
+@router.post("/git", response_model=APIResponse, dependencies=[Depends(rate_limit("deploy"))])
 async def deploy_from_git(
     deployment_request: GitDeploymentRequest,
     background_tasks: BackgroundTasks,
@@ -146,6 +621,7 @@ async def deploy_from_git(
     try:
         # Generate deployment name if not provided
         deployment_name = deployment_request.name or f"git-deploy-{uuid.uuid4().hex[:8]}"
+        resource_tier = deployment_request.resource_tier.value if deployment_request.resource_tier else None
         
         # Create deployment record
         deployment_data = {
@@ -156,6 +632,7 @@ async def deploy_from_git(
             'status': DeploymentStatus.PENDING.value,
             'repo_url': deployment_request.repo_url,
             'branch': deployment_request.branch,
+            'resource_tier': resource_tier,
             'build_logs': ['Deployment queued...']
         }
         
@@ -168,13 +645,17 @@ async def deploy_from_git(
             )
         
         # Start background deployment process
+        metrics.deployment_queue_depth.inc()
         background_tasks.add_task(
+            deployment_tasks.run,
+            deployment_id,
             process_git_deployment,
             deployment_id,
             current_user.uid,
             deployment_request.repo_url,
             deployment_request.branch,
-            deployment_name
+            deployment_name,
+            resource_tier
         )
         
         return APIResponse(
@@ -195,88 +676,201 @@ async def deploy_from_git(
             detail="Failed to start Git deployment"
         )
 
-@router.post("/zip", response_model=APIResponse)
+async def start_zip_deployment(
+    background_tasks: BackgroundTasks,
+    user_id: str,
+    zip_path: str,
+    name: Optional[str] = None,
+    description: Optional[str] = None,
+    resource_tier: Optional[str] = None
+) -> APIResponse:
+    """Create the record for an uploaded ZIP file and queue its deployment"""
+    # Generate deployment name if not provided
+    deployment_name = name or f"zip-deploy-{uuid.uuid4().hex[:8]}"
+    
+    # Create deployment record
+    deployment_data = {
+        'user_id': user_id,
+        'name': deployment_name,
+        'description': description or '',
+        'deployment_type': DeploymentType.ZIP.value,
+        'status': DeploymentStatus.PENDING.value,
+        'resource_tier': resource_tier,
+        'build_logs': ['ZIP file uploaded, deployment queued...']
+    }
+    
+    deployment_id = await firebase_service.create_deployment(deployment_data)
+    
+    if not deployment_id:
+        # Cleanup uploaded file on failure
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to create deployment record"
+        )
+    
+    # Start background deployment process
+    metrics.deployment_queue_depth.inc()
+    background_tasks.add_task(
+        deployment_tasks.run,
+        deployment_id,
+        process_zip_deployment,
+        deployment_id,
+        user_id,
+        zip_path,
+        deployment_name,
+        resource_tier
+    )
+    
+    return APIResponse(
+        success=True,
+        message="ZIP deployment started successfully",
+        data={
+            'deployment_id': deployment_id,
+            'status': DeploymentStatus.PENDING.value
+        }
+    )
+
+@router.post("/zip", response_model=APIResponse, dependencies=[Depends(rate_limit("deploy"))])
 async def deploy_from_zip(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     name: Optional[str] = Form(None),
     description: Optional[str] = Form(None),
+    resource_tier: Optional[ResourceTier] = Form(None),
     current_user: UserResponse = Depends(get_current_user)
 ):
-    """Deploy a website from a ZIP file"""
+    """Deploy a website from a ZIP file or a .tar.gz/.tar.zst tarball"""
     try:
         # Validate file type
-        if not file.filename.endswith('.zip'):
+        if not archive_suffix(file.filename):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Only ZIP files are allowed"
+                detail=f"Only {supported_archive_types()} archives are allowed"
             )
         
-        # Generate deployment name if not provided
-        deployment_name = name or f"zip-deploy-{uuid.uuid4().hex[:8]}"
+        # Save uploaded file; identical archives are stored only once
+        zip_path = await archive_store.save_upload(file, settings.UPLOAD_DIR, current_user.uid)
         
-        # Save uploaded file
-        zip_filename = f"{uuid.uuid4().hex}_{file.filename}"
-        zip_path = os.path.join(settings.UPLOAD_DIR, zip_filename)
-        
-        with open(zip_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Create deployment record
-        deployment_data = {
-            'user_id': current_user.uid,
-            'name': deployment_name,
-            'description': description or '',
-            'deployment_type': DeploymentType.ZIP.value,
-            'status': DeploymentStatus.PENDING.value,
-            'build_logs': ['ZIP file uploaded, deployment queued...']
-        }
+        return await start_zip_deployment(
+            background_tasks,
+            current_user.uid,
+            zip_path,
+            name,
+            description,
+            resource_tier.value if resource_tier else None
+        )
         
-        deployment_id = await firebase_service.create_deployment(deployment_data)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"ZIP deployment error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to start ZIP deployment"
+        )
+
+@router.post("/bulk", response_model=APIResponse, dependencies=[Depends(rate_limit("deploy"))])
+async def bulk_deployment_action(
+    bulk_request: BulkDeploymentRequest,
+    background_tasks: BackgroundTasks,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """
+    Stop, start, delete or redeploy many deployments at once.
+    Records are read and written in batches, the Docker work runs concurrently, and each deployment gets its own outcome.
+    """
+    try:
+        # Keep the caller's order, once per deployment
+        deployment_ids = list(dict.fromkeys(bulk_request.deployment_ids))
+        if not deployment_ids or len(deployment_ids) > settings.BULK_MAX_ITEMS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Between 1 and {settings.BULK_MAX_ITEMS} deployment IDs are allowed"
+            )
         
-        if not deployment_id:
-            # Cleanup uploaded file on failure
-            if os.path.exists(zip_path):
-                os.remove(zip_path)
+        deployments = await firebase_service.get_deployments(deployment_ids)
+        if deployments is None:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to create deployment record"
+                detail="Failed to read deployments"
             )
         
-        # Start background deployment process
-        background_tasks.add_task(
-            process_zip_deployment,
-            deployment_id,
-            current_user.uid,
-            zip_path,
-            deployment_name
-        )
+        action = bulk_request.action
+        semaphore = asyncio.Semaphore(settings.BULK_MAX_CONCURRENCY)
+        
+        async def apply(deployment_id: str) -> Dict[str, Any]:
+            deployment_data = deployments.get(deployment_id)
+            if not deployment_data:
+                return {'success': False, 'error': "Deployment not found"}
+            if deployment_data['user_id'] != current_user.uid:
+                return {'success': False, 'error': "Access denied"}
+            async with semaphore:
+                try:
+                    return await _bulk_apply(
+                        action, deployment_id, deployment_data, current_user.uid, bulk_request.branch, background_tasks
+                    )
+                except Exception as e:
+                    logger.error(f"Bulk {action.value} failed for deployment {deployment_id}: {str(e)}")
+                    return {'success': False, 'error': f"Failed to {action.value} deployment"}
+        
+        outcomes = dict(zip(deployment_ids, await asyncio.gather(*(apply(deployment_id) for deployment_id in deployment_ids))))
+        
+        updates = {deployment_id: outcome.pop('update') for deployment_id, outcome in outcomes.items() if 'update' in outcome}
+        deletes = [deployment_id for deployment_id, outcome in outcomes.items() if outcome.pop('delete', False)]
+        if updates and not await firebase_service.batch_update_deployments(updates):
+            for deployment_id in updates:
+                outcomes[deployment_id] = {'success': False, 'error': "Failed to update deployment record"}
+        if deletes and not await firebase_service.batch_delete_deployments(deletes):
+            for deployment_id in deletes:
+                outcomes[deployment_id] = {'success': False, 'error': "Failed to delete deployment record"}
+        
+        results = [
+            {
+                'deployment_id': deployment_id,
+                'success': outcome['success'],
+                'status': outcome.get('status'),
+                'error': outcome.get('error')
+            }
+            for deployment_id, outcome in outcomes.items()
+        ]
+        succeeded = sum(1 for result in results if result['success'])
         
         return APIResponse(
-            success=True,
-            message="ZIP deployment started successfully",
+            success=succeeded == len(results),
+            message=f"Bulk {action.value} succeeded for {succeeded} of {len(results)} deployments",
             data={
-                'deployment_id': deployment_id,
-                'status': DeploymentStatus.PENDING.value
+                'action': action.value,
+                'results': results,
+                'succeeded': succeeded,
+                'failed': len(results) - succeeded
             }
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"ZIP deployment error: {str(e)}")
+        logger.error(f"Bulk deployment error: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to start ZIP deployment"
+            detail="Failed to run bulk action"
         )
 
-@router.get("/", response_model=DeploymentListResponse)
-async def get_user_deployments(current_user: UserResponse = Depends(get_current_user)):
-    """Get all deployments for the current user"""
+@router.get("/", response_model=DeploymentListResponse, dependencies=[Depends(rate_limit("read"))])
+async def get_user_deployments(
+    if_none_match: Optional[str] = Header(None),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Get all deployments for the current user; 304 when If-None-Match carries the current ETag"""
     try:
         deployments_data = await firebase_service.get_user_deployments(current_user.uid)
         
+        # The ETag changes when a deployment is added, removed or written to
+        etag = _deployments_etag(deployments_data)
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_conditional_headers(etag))
+        
         deployments = []
         for deployment_data in deployments_data:
             # Handle datetime conversion
@@ -292,15 +886,22 @@ async def get_user_deployments(current_user: UserResponse = Depends(get_current_
                 container_id=deployment_data.get('container_id'),
                 port=deployment_data.get('port'),
                 public_url=deployment_data.get('public_url'),
+                resource_tier=deployment_data.get('resource_tier'),
+                replicas=len(deployment_replicas(deployment_data)) or 1,
+                queue_position=deployment_data.get('queue_position'),
+                queue_eta_seconds=deployment_data.get('queue_eta_seconds'),
+                scaled_to_zero=deployment_data.get('scaled_to_zero', False),
                 build_logs=deployment_data.get('build_logs', []),
                 created_at=deployment_data.get('created_at'),
                 updated_at=deployment_data.get('updated_at')
             )
             deployments.append(deployment)
         
-        return DeploymentListResponse(
-            deployments=deployments,
-            total=len(deployments)
+        # Serialized by pydantic's compiled serializer, skipping FastAPI's re-validation and encoding
+        return Response(
+            content=DeploymentListResponse(deployments=deployments, total=len(deployments)).model_dump_json(),
+            media_type="application/json",
+            headers=_conditional_headers(etag)
         )
         
     except Exception as e:
@@ -310,12 +911,71 @@ async def get_user_deployments(current_user: UserResponse = Depends(get_current_
             detail="Failed to retrieve deployments"
         )
 
-@router.get("/{deployment_id}", response_model=DeploymentResponse)
+@router.get("/events", dependencies=[Depends(rate_limit("stream"))])
+async def stream_deployment_events(
+    deployment_id: Optional[str] = None,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Stream status changes as Server-Sent Events, for one deployment or all of the user's deployments.
+    
+    The stream opens with a snapshot of each deployment, then sends every change to its record as it is
+    written, so clients do not need to poll.
+    """
+    try:
+        # Subscribe before reading the snapshot so no change in between is missed
+        subscription = deployment_events.subscribe(current_user.uid, deployment_id)
+        try:
+            if deployment_id:
+                snapshot = [{**_get_owned_deployment(deployment_id, current_user), 'id': deployment_id}]
+            else:
+                snapshot = await firebase_service.get_user_deployments(current_user.uid)
+                subscription.deployment_ids.update(deployment_data['id'] for deployment_data in snapshot)
+        except BaseException:
+            deployment_events.unsubscribe(subscription)
+            raise
+        
+        async def event_stream():
+            try:
+                for deployment_data in snapshot:
+                    event = snapshot_event(deployment_data['id'], deployment_data)
+                    yield f"event: snapshot\ndata: {json.dumps(event)}\n\n"
+                while True:
+                    try:
+                        event = await asyncio.wait_for(subscription.queue.get(), settings.EVENTS_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        # Keeps proxies from closing an idle stream
+                        yield ": keep-alive\n\n"
+                        continue
+                    event = {key: value for key, value in event.items() if key != 'user_id'}
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                    if deployment_id and event['type'] == 'deleted':
+                        return
+            finally:
+                deployment_events.unsubscribe(subscription)
+        
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error opening deployment event stream: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to open deployment event stream"
+        )
+
+@router.get("/{deployment_id}", response_model=DeploymentResponse, dependencies=[Depends(rate_limit("read"))])
 async def get_deployment(
     deployment_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     current_user: UserResponse = Depends(get_current_user)
 ):
-    """Get a specific deployment by ID"""
+    """Get a specific deployment by ID; 304 when If-None-Match carries the current ETag"""
     try:
         # Get deployment data
         deployment_doc = firebase_service.db.collection('deployments').document(deployment_id).get()
@@ -335,6 +995,11 @@ async def get_deployment(
                 detail="Access denied"
             )
         
+        etag = _deployments_etag([{**deployment_data, 'id': deployment_id}])
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_conditional_headers(etag))
+        response.headers.update(_conditional_headers(etag))
+        
         deployment = DeploymentResponse(
             id=deployment_id,
             user_id=deployment_data['user_id'],
@@ -347,6 +1012,11 @@ async def get_deployment(
             container_id=deployment_data.get('container_id'),
             port=deployment_data.get('port'),
             public_url=deployment_data.get('public_url'),
+            resource_tier=deployment_data.get('resource_tier'),
+            replicas=len(deployment_replicas(deployment_data)) or 1,
+            queue_position=deployment_data.get('queue_position'),
+            queue_eta_seconds=deployment_data.get('queue_eta_seconds'),
+            scaled_to_zero=deployment_data.get('scaled_to_zero', False),
             build_logs=deployment_data.get('build_logs', []),
             created_at=deployment_data.get('created_at'),
             updated_at=deployment_data.get('updated_at')
@@ -388,15 +1058,18 @@ async def delete_deployment(
                 detail="Access denied"
             )
         
-        # Stop and remove container if it exists
-        if deployment_data.get('container_id'):
-            await docker_service.remove_container(
-                deployment_data['container_id'], 
-                deployment_data.get('port')
-            )
+        # Abort a build still in progress, then stop and remove containers if they exist
+        deployment_tasks.cancel(deployment_id)
+        await docker_service.remove_replicas(deployment_replicas(deployment_data))
+        
+        domain_service.remove_nginx_config(deployment_id)
         
         # Delete deployment record
-        firebase_service.db.collection('deployments').document(deployment_id).delete()
+        if not await firebase_service.delete_deployment(deployment_id):
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to delete deployment record"
+            )
         
         return APIResponse(
             success=True,
@@ -437,14 +1110,15 @@ async def stop_deployment(
                 detail="Access denied"
             )
         
-        # Stop container
+        # Stop containers
         if deployment_data.get('container_id'):
-            success = await docker_service.stop_container(deployment_data['container_id'])
+            success = await docker_service.stop_replicas(deployment_replicas(deployment_data))
             
             if success:
-                # Update deployment status
+                # Update deployment status; a manual stop is never woken automatically
                 await firebase_service.update_deployment(deployment_id, {
-                    'status': DeploymentStatus.STOPPED.value
+                    'status': DeploymentStatus.STOPPED.value,
+                    'scaled_to_zero': False
                 })
                 
                 return APIResponse(
@@ -469,4 +1143,465 @@ async def stop_deployment(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to stop deployment"
-        ) 
\ No newline at end of file
+        ) 
+
+@router.post("/{deployment_id}/start", response_model=APIResponse)
+async def start_deployment(
+    deployment_id: str,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Start a stopped deployment"""
+    try:
+        deployment_data = _get_owned_deployment(deployment_id, current_user)
+        
+        if not deployment_data.get('container_id'):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="No container to start"
+            )
+        
+        replicas = deployment_replicas(deployment_data)
+        if not await docker_service.start_replicas(replicas):
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to start container"
+            )
+        
+        if not await docker_service.wait_replicas_ready(replicas, settings.WAKE_TIMEOUT):
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Container did not become ready in time"
+            )
+        
+        await firebase_service.update_deployment(deployment_id, {
+            'status': DeploymentStatus.RUNNING.value,
+            'scaled_to_zero': False
+        })
+        
+        return APIResponse(
+            success=True,
+            message="Deployment started successfully"
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error starting deployment: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to start deployment"
+        )
+
+@router.post("/{deployment_id}/cancel", response_model=APIResponse)
+async def cancel_deployment(
+    deployment_id: str,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Cancel an in-progress deployment or redeploy, whatever stage it is in"""
+    try:
+        _get_owned_deployment(deployment_id, current_user)
+        
+        if not deployment_tasks.cancel(deployment_id):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Deployment has no build in progress"
+            )
+        
+        return APIResponse(
+            success=True,
+            message="Deployment cancelled"
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Cancel deployment error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to cancel deployment"
+        )
+
+@router.post("/{deployment_id}/redeploy", response_model=APIResponse, dependencies=[Depends(rate_limit("deploy"))])
+async def redeploy_deployment(
+    deployment_id: str,
+    background_tasks: BackgroundTasks,
+    file: Optional[UploadFile] = File(None),
+    branch: Optional[str] = Form(None),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """
+    Rebuild a deployment from new sources without downtime.
+    Git deployments re-clone (optionally another branch); ZIP deployments take a new archive.
+    """
+    zip_path = None
+    try:
+        deployment_data = _get_owned_deployment(deployment_id, current_user)
+        
+        if deployment_id in _active_redeploys or deployment_data.get('status') in IN_FLIGHT_STATUSES:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Deployment is already being built"
+            )
+        if deployment_id in _scale_locks:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Deployment is being scaled"
+            )
+        
+        if deployment_data['deployment_type'] == DeploymentType.ZIP.value:
+            if not file or not archive_suffix(file.filename):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"A new archive ({supported_archive_types()}) is required to redeploy an uploaded deployment"
+                )
+            zip_path = await archive_store.save_upload(file, settings.UPLOAD_DIR, current_user.uid)
+        
+        _queue_redeploy(background_tasks, deployment_id, current_user.uid, zip_path, branch)
+        
+        return APIResponse(
+            success=True,
+            message="Redeploy started, the current version keeps serving until the new one is ready",
+            data={
+                'deployment_id': deployment_id,
+                'public_url': deployment_data.get('public_url')
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Redeploy error: {str(e)}")
+        if zip_path and os.path.exists(zip_path):
+            os.remove(zip_path)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to start redeploy"
+        )
+
+@router.post("/{deployment_id}/scale", response_model=APIResponse)
+async def scale_deployment(
+    deployment_id: str,
+    scale_request: ScaleRequest,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Change how many containers serve a deployment, reusing its built image"""
+    try:
+        if not 1 <= scale_request.replicas <= settings.MAX_REPLICAS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Replicas must be between 1 and {settings.MAX_REPLICAS}"
+            )
+        
+        # Without nginx there is no upstream to spread traffic over; only the primary is reachable
+        if scale_request.replicas > 1 and domain_service.base_domain == "localhost":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Scaling beyond one replica needs nginx routing (set BASE_DOMAIN)"
+            )
+        
+        # The replica set is read, changed and written back, so one scale at a time
+        async with _scale_lock(deployment_id):
+            deployment_data = _get_owned_deployment(deployment_id, current_user)
+            
+            if deployment_id in _active_redeploys or deployment_data.get('status') in IN_FLIGHT_STATUSES:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Deployment is being built, scale it once that finishes"
+                )
+            
+            if deployment_data.get('status') != DeploymentStatus.RUNNING.value:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Only running deployments can be scaled"
+                )
+            
+            replicas = list(deployment_replicas(deployment_data))
+            if not replicas:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Deployment has no container"
+                )
+            
+            primary = replicas[0]
+            resource_tier = deployment_data.get('resource_tier') or DEFAULT_RESOURCE_TIER
+            requested = scale_request.replicas - len(replicas)
+            removed = []
+            failed = 0
+            
+            if requested > 0:
+                # Start containers one at a time so port allocation never races, then wait for all
+                started = []
+                for _ in range(requested):
+                    try:
+                        container_id, port, docker_host = await docker_service.run_replica(
+                            primary['container_id'], resource_tier, primary.get('docker_host'), deployment_data.get('image_ref')
+                        )
+                        started.append({
+                            'container_id': container_id,
+                            'port': port,
+                            'docker_host': docker_host
+                        })
+                    except Exception as e:
+                        logger.error(f"Failed to start replica for {deployment_id}: {str(e)}")
+                        failed += 1
+                
+                ready = await asyncio.gather(*(
+                    docker_service.wait_until_ready(replica['port'], settings.WAKE_TIMEOUT, host=replica['docker_host'])
+                    for replica in started
+                ))
+                for replica, is_ready in zip(started, ready):
+                    if is_ready:
+                        replicas.append(replica)
+                    else:
+                        logger.error(f"Replica {replica['container_id']} of {deployment_id} did not become ready")
+                        removed.append(replica)
+                        failed += 1
+            elif requested < 0:
+                # The primary is never removed; the newest replicas go first
+                removed = replicas[scale_request.replicas:]
+                replicas = replicas[:scale_request.replicas]
+            
+            # Only ready replicas join the upstream, and removed ones leave it before they are stopped
+            if domain_service.base_domain != "localhost":
+                domain_service.create_nginx_config(deployment_id, replicas)
+                reload = domain_service.schedule_reload()
+                if reload and removed:
+                    await reload
+            
+            await firebase_service.update_deployment(deployment_id, {
+                'replicas': len(replicas),
+                'replica_set': replicas
+            })
+            
+            if removed:
+                await docker_service.remove_replicas(removed)
+            
+            if failed:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Started only {requested - failed} of {requested} new replicas"
+                )
+            
+            return APIResponse(
+                success=True,
+                message=f"Deployment scaled to {len(replicas)} replicas",
+                data={
+                    'replicas': len(replicas),
+                    'replica_set': replicas
+                }
+            )
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error scaling deployment: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to scale deployment"
+        )
+
+@router.get("/{deployment_id}/stats", response_model=APIResponse, dependencies=[Depends(rate_limit("read"))])
+async def get_deployment_stats(
+    deployment_id: str,
+    limit: int = Query(60, ge=1, le=settings.STATS_HISTORY_SIZE),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Get recent CPU/memory samples and percentiles for a deployment's container"""
+    try:
+        deployment_data = _get_owned_deployment(deployment_id, current_user)
+        
+        container_id = deployment_data.get('container_id')
+        if not container_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Deployment has no container"
+            )
+        
+        return APIResponse(
+            success=True,
+            message="Container stats retrieved successfully",
+            data={
+                'container_id': container_id,
+                'sample_interval': stats_sampler.interval,
+                'samples': stats_sampler.get_samples(container_id, limit),
+                'summary': stats_sampler.summarize(container_id)
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting deployment stats: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve deployment stats"
+        )
+
+@router.get("/{deployment_id}/resources", response_model=APIResponse, dependencies=[Depends(rate_limit("read"))])
+async def get_deployment_resources(
+    deployment_id: str,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Get a deployment's resource tier and a right-sizing recommendation from observed usage"""
+    try:
+        deployment_data = _get_owned_deployment(deployment_id, current_user)
+        
+        container_id = deployment_data.get('container_id')
+        if not container_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Deployment has no container"
+            )
+        
+        recommendation = resource_recommender.recommend(container_id, deployment_data.get('resource_tier'))
+        
+        return APIResponse(
+            success=True,
+            message="Resource recommendation retrieved successfully",
+            data={
+                'limits': resource_recommender.tier_limits(recommendation['current_tier']),
+                **recommendation
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting deployment resources: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve deployment resources"
+        )
+
+@router.post("/{deployment_id}/resources", response_model=APIResponse)
+async def update_deployment_resources(
+    deployment_id: str,
+    update_request: ResourceUpdateRequest,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Change a deployment's resource tier in place, or apply the recommended tier when none is given"""
+    try:
+        deployment_data = _get_owned_deployment(deployment_id, current_user)
+        
+        container_id = deployment_data.get('container_id')
+        replicas = deployment_replicas(deployment_data)
+        if not container_id or not replicas:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Deployment has no container"
+            )
+        
+        if update_request.tier:
+            resource_tier = update_request.tier.value
+        else:
+            recommendation = resource_recommender.recommend(container_id, deployment_data.get('resource_tier'))
+            resource_tier = recommendation['recommended_tier']
+            if not resource_tier:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=recommendation['reason']
+                )
+        
+        # The tier is recorded for the whole deployment, so every replica must take it
+        updated = await docker_service.update_replicas_resources(replicas, resource_tier)
+        if not all(updated):
+            # Put the replicas that did change back on the recorded tier
+            previous_tier = deployment_data.get('resource_tier') or DEFAULT_RESOURCE_TIER
+            await docker_service.update_replicas_resources(
+                [replica for replica, ok in zip(replicas, updated) if ok], previous_tier
+            )
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to update container resources"
+            )
+        
+        await firebase_service.update_deployment(deployment_id, {
+            'resource_tier': resource_tier
+        })
+        
+        return APIResponse(
+            success=True,
+            message=f"Deployment resized to the {resource_tier} tier",
+            data={
+                'resource_tier': resource_tier,
+                'limits': resource_recommender.tier_limits(resource_tier)
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error updating deployment resources: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to update deployment resources"
+        )
+
+@router.get("/{deployment_id}/logs", dependencies=[Depends(rate_limit("stream"))])
+async def get_deployment_logs(
+    deployment_id: str,
+    tail: int = Query(settings.LOGS_DEFAULT_TAIL, ge=0),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    max_bytes: int = Query(settings.LOGS_MAX_BYTES, ge=1, le=settings.LOGS_MAX_BYTES),
+    follow: bool = False,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Get runtime logs for a deployment's container.
+    
+    With follow=true the logs are streamed as Server-Sent Events until the client disconnects.
+    """
+    try:
+        deployment_data = _get_owned_deployment(deployment_id, current_user)
+        
+        container_id = deployment_data.get('container_id')
+        if not container_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Deployment has no container"
+            )
+        
+        if follow:
+            async def event_stream():
+                try:
+                    async for line in docker_service.follow_container_logs(
+                        container_id, tail, since, host=deployment_data.get('docker_host')
+                    ):
+                        yield f"data: {json.dumps(line)}\n\n"
+                except Exception as e:
+                    logger.error(f"Log stream for {deployment_id} ended with error: {str(e)}")
+                    yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+            
+            return StreamingResponse(
+                event_stream(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        
+        logs, truncated = await docker_service.get_container_logs(
+            container_id,
+            tail=tail,
+            since=since,
+            until=until,
+            max_bytes=max_bytes,
+            host=deployment_data.get('docker_host')
+        )
+        
+        return APIResponse(
+            success=True,
+            message="Container logs retrieved successfully",
+            data={
+                'container_id': container_id,
+                'logs': logs,
+                'truncated': truncated
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting deployment logs: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve deployment logs"
+        )
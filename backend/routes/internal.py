@@ -0,0 +1,102 @@
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from domain_service import domain_service
+from idle_service import idle_monitor
+from host_pool import host_pool
+import hmac
+import httpx
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/internal", tags=["internal"], include_in_schema=False)
+
+# Headers that describe a single hop and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade'
+}
+
+# Shared by woken requests so upstream connections are pooled
+_wake_client: Optional[httpx.AsyncClient] = None
+
+def _upstream_client() -> httpx.AsyncClient:
+    global _wake_client
+    if _wake_client is None:
+        _wake_client = httpx.AsyncClient(timeout=300.0)
+    return _wake_client
+
+async def close_wake_client():
+    """Close the pooled client used to forward woken requests"""
+    global _wake_client
+    if _wake_client is not None:
+        await _wake_client.aclose()
+        _wake_client = None
+
+@router.api_route("/wake", methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+async def wake_deployment(request: Request):
+    """
+    Wake a scaled-to-zero deployment and forward the held request to it.
+    nginx routes here when a deployment's container refuses connections.
+    """
+    token = request.headers.get('x-zipp-wake-token', '')
+    if not hmac.compare_digest(token, domain_service.wake_token()):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
+        )
+
+    host = request.headers.get('host', '')
+    deployment_id = domain_service.deployment_for_host(host)
+    if not deployment_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deployment not found"
+        )
+
+    woken, deployment_data = await idle_monitor.wake(deployment_id)
+    if not woken:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Deployment is not available"
+        )
+
+    # Forward the original request to the freshly started container
+    original_uri = request.headers.get('x-zipp-original-uri', '/')
+    upstream_address = host_pool.get(deployment_data.get('docker_host')).address
+    headers = {
+        key: value for key, value in request.headers.items()
+        if key.lower() not in HOP_BY_HOP_HEADERS and not key.lower().startswith('x-zipp-')
+    }
+    # Stream the body through; requests without one must not gain a chunked body on the way
+    has_body = 'content-length' in request.headers or 'transfer-encoding' in request.headers
+    client = _upstream_client()
+    try:
+        upstream = await client.send(
+            client.build_request(
+                request.method,
+                f"http://{upstream_address}:{deployment_data['port']}{original_uri}",
+                headers=headers,
+                content=request.stream() if has_body else None
+            ),
+            stream=True
+        )
+    except httpx.HTTPError as e:
+        logger.error(f"Failed to forward woken request for {deployment_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Deployment did not respond"
+        )
+
+    # Raw bytes are relayed as sent, so Content-Encoding and Content-Length still hold
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        headers={
+            key: value for key, value in upstream.headers.items()
+            if key.lower() not in HOP_BY_HOP_HEADERS
+        },
+        background=BackgroundTask(upstream.aclose)
+    )
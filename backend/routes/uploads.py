@@ -0,0 +1,226 @@
+from fastapi import APIRouter, HTTPException, Depends, status, BackgroundTasks, Request, Header
+from models import APIResponse, UploadCreateRequest, UserResponse
+from auth import get_current_user
+from rate_limit import rate_limit
+from upload_service import upload_store
+from archive_store import archive_store
+from routes.deployments import start_zip_deployment
+from project_source import archive_suffix, supported_archive_types
+from config import settings
+import logging
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/deployments/uploads", tags=["uploads"])
+
+def _get_owned_session(upload_id: str, current_user: UserResponse) -> Dict[str, Any]:
+    """Fetch an upload session, raising 404/403 unless it belongs to the current user"""
+    session = upload_store.get(upload_id)
+
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload not found or expired"
+        )
+
+    if session['user_id'] != current_user.uid:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
+        )
+
+    return session
+
+def _upload_status(session: Dict[str, Any]) -> Dict[str, Any]:
+    """Session status, flagging uploads whose archive is already stored"""
+    upload_status = upload_store.status(session)
+    digest = session['metadata'].get('sha256')
+    upload_status['already_stored'] = bool(digest) and archive_store.contains(
+        digest, session['filename'], session['user_id']
+    )
+    return upload_status
+
+@router.post("", response_model=APIResponse, dependencies=[Depends(rate_limit("deploy"))])
+async def create_upload(
+    upload_request: UploadCreateRequest,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """
+    Start a resumable archive upload (.zip, .tar.gz or .tar.zst).
+    Send the file as chunks with PUT /chunks/{offset}, then POST /complete to deploy it.
+    When `sha256` names an archive this user uploaded before, no chunks need to be sent.
+    """
+    try:
+        if not archive_suffix(upload_request.filename):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Only {supported_archive_types()} archives are allowed"
+            )
+
+        session = upload_store.create(
+            current_user.uid,
+            upload_request.filename,
+            upload_request.size,
+            upload_request.chunk_size,
+            metadata={
+                'sha256': upload_request.sha256,
+                'name': upload_request.name,
+                'description': upload_request.description,
+                'resource_tier': upload_request.resource_tier.value if upload_request.resource_tier else None
+            }
+        )
+
+        return APIResponse(
+            success=True,
+            message="Upload started",
+            data=_upload_status(session)
+        )
+
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Create upload error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to start upload"
+        )
+
+@router.get("/{upload_id}", response_model=APIResponse, dependencies=[Depends(rate_limit("read"))])
+async def get_upload(
+    upload_id: str,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Which chunks have been received, so an interrupted upload can resume"""
+    try:
+        session = _get_owned_session(upload_id, current_user)
+
+        return APIResponse(
+            success=True,
+            message="Upload status retrieved",
+            data=_upload_status(session)
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Get upload error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get upload status"
+        )
+
+@router.put("/{upload_id}/chunks/{offset}", response_model=APIResponse)
+async def upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    x_chunk_sha256: str = Header(...),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """
+    Write one chunk at its byte offset; the raw request body is the chunk.
+    Chunks may be sent in any order and in parallel, and re-sent after a failure.
+    """
+    try:
+        session = _get_owned_session(upload_id, current_user)
+
+        chunk = await upload_store.write_chunk(session, offset, request.stream(), x_chunk_sha256)
+
+        return APIResponse(
+            success=True,
+            message="Chunk received",
+            data=chunk
+        )
+
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Upload chunk error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to store chunk"
+        )
+
+@router.post("/{upload_id}/complete", response_model=APIResponse)
+async def complete_upload(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Assemble a fully received upload and deploy it like a direct archive upload"""
+    try:
+        session = _get_owned_session(upload_id, current_user)
+
+        metadata = session['metadata']
+        try:
+            # Held until the session is gone, so a second complete can't find its data moved away
+            async with upload_store.completing(upload_id):
+                zip_path = None
+                if metadata.get('sha256'):
+                    zip_path = archive_store.link_existing(
+                        metadata['sha256'], session['filename'], settings.UPLOAD_DIR, current_user.uid
+                    )
+                if not zip_path:
+                    data_path = await upload_store.complete(session)
+                    zip_path = await archive_store.store_file(
+                        data_path, settings.UPLOAD_DIR, session['filename'], current_user.uid, metadata.get('sha256')
+                    )
+                upload_store.abort(upload_id)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=str(e)
+            )
+
+        return await start_zip_deployment(
+            background_tasks,
+            current_user.uid,
+            zip_path,
+            metadata.get('name'),
+            metadata.get('description'),
+            metadata.get('resource_tier')
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Complete upload error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to complete upload"
+        )
+
+@router.delete("/{upload_id}", response_model=APIResponse)
+async def abort_upload(
+    upload_id: str,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Discard an upload and the chunks received so far"""
+    try:
+        _get_owned_session(upload_id, current_user)
+        upload_store.abort(upload_id)
+
+        return APIResponse(
+            success=True,
+            message="Upload discarded"
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Abort upload error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to discard upload"
+        )
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List, Deque
+from config import settings
+from docker_service import docker_service
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class ContainerStatsSampler:
+    """Periodically samples resource usage of deployment containers into per-container ring buffers"""
+
+    def __init__(self, interval: float, history_size: int, max_concurrency: int):
+        self.interval = interval
+        self.history_size = history_size
+        self.max_concurrency = max_concurrency
+        self.history: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._throttle_totals: Dict[str, tuple] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the background sampling loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Container stats sampler started (every {self.interval}s)")
+
+    async def stop(self):
+        """Stop the background sampling loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sample_once()
+            except Exception as e:
+                logger.warning(f"Container stats sampling failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def sample_once(self):
+        """Take one stats sample of every running deployment container"""
+        containers = await docker_service.list_containers(filters={"name": "instantsite_", "status": "running"})
+        # Kept from this listing so a metrics scrape never has to ask the Docker hosts
+        metrics.running_containers.set(len(containers))
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def sample(host, container):
+            async with semaphore:
+                try:
+                    # Waits until the daemon has two readings to diff
+                    raw = await host.api.stats(container['Id'])
+                    self._record(container['Id'], raw)
+                except Exception as e:
+                    logger.debug(f"Could not sample stats for {container['Id']}: {e}")
+
+        await asyncio.gather(*(sample(host, container) for host, container in containers))
+
+        # Drop history for containers that are no longer running
+        live_ids = {container['Id'] for _, container in containers}
+        for container_id in list(self.history):
+            if container_id not in live_ids:
+                self.history.pop(container_id, None)
+                self._throttle_totals.pop(container_id, None)
+
+    def _record(self, container_id: str, raw: Dict[str, Any]):
+        sample = self._parse_stats(container_id, raw)
+        buffer = self.history.get(container_id)
+        if buffer is None:
+            buffer = self.history[container_id] = deque(maxlen=self.history_size)
+        buffer.append(sample)
+
+    def _parse_stats(self, container_id: str, raw: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert a raw Docker stats payload into a compact sample"""
+        cpu_stats = raw.get('cpu_stats', {})
+        precpu_stats = raw.get('precpu_stats', {})
+        cpu_delta = cpu_stats.get('cpu_usage', {}).get('total_usage', 0) - \
+            precpu_stats.get('cpu_usage', {}).get('total_usage', 0)
+        system_delta = cpu_stats.get('system_cpu_usage', 0) - precpu_stats.get('system_cpu_usage', 0)
+        online_cpus = cpu_stats.get('online_cpus') or \
+            len(cpu_stats.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+        cpu_percent = (cpu_delta / system_delta) * online_cpus * 100 if system_delta > 0 and cpu_delta > 0 else 0.0
+
+        # Throttling counters are cumulative, so report the ratio since the previous sample
+        throttling = cpu_stats.get('throttling_data', {})
+        periods = throttling.get('periods', 0)
+        throttled = throttling.get('throttled_periods', 0)
+        prev_periods, prev_throttled = self._throttle_totals.get(container_id, (periods, throttled))
+        self._throttle_totals[container_id] = (periods, throttled)
+        period_delta = periods - prev_periods
+        throttled_ratio = (throttled - prev_throttled) / period_delta if period_delta > 0 else 0.0
+
+        memory_stats = raw.get('memory_stats', {})
+        memory_detail = memory_stats.get('stats', {})
+        # Exclude page cache, matching what `docker stats` reports (cgroup v2 / v1)
+        cache = memory_detail.get('inactive_file', memory_detail.get('cache', 0))
+        memory_usage = max(memory_stats.get('usage', 0) - cache, 0)
+        memory_limit = memory_stats.get('limit', 0)
+        memory_percent = memory_usage / memory_limit * 100 if memory_limit else 0.0
+
+        # Cumulative bytes received, used as a connection-activity signal
+        network_rx = sum(network.get('rx_bytes', 0) for network in (raw.get('networks') or {}).values())
+
+        return {
+            'timestamp': time.time(),
+            'cpu_percent': round(cpu_percent, 2),
+            'cpu_throttled_ratio': round(throttled_ratio, 4),
+            'memory_usage_bytes': memory_usage,
+            'memory_limit_bytes': memory_limit,
+            'memory_percent': round(memory_percent, 2),
+            'network_rx_bytes': network_rx,
+        }
+
+    def get_samples(self, container_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return the most recent samples for a container, oldest first"""
+        samples = list(self.history.get(container_id, ()))
+        if limit:
+            samples = samples[-limit:]
+        return samples
+
+    def summarize(self, container_id: str) -> Dict[str, Any]:
+        """Percentile summary of the buffered history for a container"""
+        samples = self.get_samples(container_id)
+        summary = {'samples': len(samples)}
+        for field in ('cpu_percent', 'cpu_throttled_ratio', 'memory_usage_bytes', 'memory_percent'):
+            values = sorted(sample[field] for sample in samples)
+            summary[field] = {
+                'p50': _percentile(values, 50),
+                'p90': _percentile(values, 90),
+                'p99': _percentile(values, 99),
+                'max': values[-1] if values else None,
+            }
+        return summary
+
+def _percentile(sorted_values: List[float], percent: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+# Global stats sampler instance
+stats_sampler = ContainerStatsSampler(
+    interval=settings.STATS_SAMPLE_INTERVAL,
+    history_size=settings.STATS_HISTORY_SIZE,
+    max_concurrency=settings.STATS_MAX_CONCURRENCY
+)
@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
+from config import settings
+from project_source import is_valid_archive
+
+logger = logging.getLogger(__name__)
+
+# Smallest chunk size a client may choose; keeps the per-chunk marker count sane
+MIN_CHUNK_SIZE = 256 * 1024
+# Bytes gathered from the request body before each write, which runs off the event loop
+WRITE_BATCH_SIZE = 1024 * 1024
+
+class ChunkedUploadStore:
+    """Resumable uploads assembled on disk from independently sent chunks.
+
+    Each session is a directory holding its metadata, a sparse data file the chunks are
+    written into at their offsets, and one marker file per verified chunk. Markers are
+    created atomically, so chunks may arrive in any order and in parallel; writes of the
+    same chunk are serialized, and a session being completed takes no more writes.
+    """
+
+    def __init__(self, root: str, default_chunk_size: int, max_chunk_size: int,
+                 max_size: int, ttl: float, sweep_interval: float):
+        self.root = root
+        self.default_chunk_size = default_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._task: Optional[asyncio.Task] = None
+        # (upload ID, chunk index) -> [lock, holders and waiters]
+        self._chunk_locks: Dict[Tuple[str, int], list] = {}
+        # Upload ID -> chunk writes in progress
+        self._writes: Dict[str, int] = {}
+        self._completing: set = set()
+
+    def create(self, user_id: str, filename: str, total_size: int,
+               chunk_size: Optional[int] = None, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Open an upload session and preallocate its data file"""
+        chunk_size = chunk_size or self.default_chunk_size
+        if total_size <= 0 or total_size > self.max_size:
+            raise ValueError(f"Upload size must be between 1 byte and {self.max_size} bytes")
+        if not MIN_CHUNK_SIZE <= chunk_size <= self.max_chunk_size:
+            raise ValueError(f"Chunk size must be between {MIN_CHUNK_SIZE} and {self.max_chunk_size} bytes")
+
+        session = {
+            'upload_id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'filename': os.path.basename(filename),
+            'total_size': total_size,
+            'chunk_size': chunk_size,
+            'chunk_count': math.ceil(total_size / chunk_size),
+            'created_at': time.time(),
+            'metadata': metadata or {}
+        }
+        session_dir = self._session_dir(session['upload_id'])
+        os.makedirs(os.path.join(session_dir, 'chunks'))
+        # Sparse: no disk is used until chunks are written
+        with open(os.path.join(session_dir, 'data'), 'wb') as f:
+            f.truncate(total_size)
+        with open(os.path.join(session_dir, 'session.json'), 'w') as f:
+            json.dump(session, f)
+        return session
+
+    def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self._session_dir(upload_id), 'session.json'), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def status(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        """Which chunks have arrived, and when the session expires if nothing else does"""
+        received = self._received(session)
+        missing = [index for index in range(session['chunk_count']) if index not in received]
+        return {
+            'upload_id': session['upload_id'],
+            'filename': session['filename'],
+            'total_size': session['total_size'],
+            'chunk_size': session['chunk_size'],
+            'chunk_count': session['chunk_count'],
+            'received_chunks': sorted(received),
+            'missing_chunks': missing,
+            'bytes_received': sum(self._chunk_length(session, index) for index in received),
+            'complete': not missing,
+            'expires_at': self._last_activity(session['upload_id']) + self.ttl
+        }
+
+    async def write_chunk(self, session: Dict[str, Any], offset: int,
+                          body: AsyncIterator[bytes], sha256: str) -> Dict[str, Any]:
+        """Write a chunk's body straight into the data file at its offset and verify it"""
+        if offset < 0 or offset % session['chunk_size'] or offset >= session['total_size']:
+            raise ValueError(f"Offset must be a multiple of the chunk size ({session['chunk_size']}) within the upload")
+        upload_id = session['upload_id']
+        if upload_id in self._completing:
+            raise ValueError("Upload is being completed")
+        index = offset // session['chunk_size']
+
+        entry = self._chunk_locks.setdefault((upload_id, index), [asyncio.Lock(), 0])
+        entry[1] += 1
+        self._writes[upload_id] = self._writes.get(upload_id, 0) + 1
+        try:
+            async with entry[0]:
+                return await self._write_chunk(session, index, offset, body, sha256)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chunk_locks[(upload_id, index)]
+            self._writes[upload_id] -= 1
+            if not self._writes[upload_id]:
+                del self._writes[upload_id]
+
+    async def _write_chunk(self, session: Dict[str, Any], index: int, offset: int,
+                           body: AsyncIterator[bytes], sha256: str) -> Dict[str, Any]:
+        expected = self._chunk_length(session, index)
+
+        session_dir = self._session_dir(session['upload_id'])
+        marker = os.path.join(session_dir, 'chunks', str(index))
+        # A re-sent chunk overwrites its region; it only counts as received again once verified
+        try:
+            os.remove(marker)
+        except FileNotFoundError:
+            pass
+
+        digest = hashlib.sha256()
+        written = 0
+        pending = bytearray()
+        fd = os.open(os.path.join(session_dir, 'data'), os.O_WRONLY)
+        try:
+            async for piece in body:
+                if written + len(pending) + len(piece) > expected:
+                    raise ValueError(f"Chunk at offset {offset} must be {expected} bytes")
+                digest.update(piece)
+                pending += piece
+                if len(pending) >= WRITE_BATCH_SIZE:
+                    await asyncio.to_thread(os.pwrite, fd, bytes(pending), offset + written)
+                    written += len(pending)
+                    pending.clear()
+            if pending:
+                await asyncio.to_thread(os.pwrite, fd, bytes(pending), offset + written)
+                written += len(pending)
+        finally:
+            os.close(fd)
+
+        if written != expected:
+            raise ValueError(f"Chunk at offset {offset} must be {expected} bytes, received {written}")
+        if digest.hexdigest() != sha256.strip().lower():
+            raise ValueError(f"Checksum mismatch for chunk at offset {offset}")
+
+        # Written under a temporary name and renamed, so a marker is never seen half-written
+        partial = f"{marker}.{uuid.uuid4().hex}"
+        with open(partial, 'w') as f:
+            f.write(digest.hexdigest())
+        os.replace(partial, marker)
+        return {'index': index, 'offset': offset, 'size': written}
+
+    @asynccontextmanager
+    async def completing(self, upload_id: str):
+        """Claim a session for completion; chunk writes and other completions are refused meanwhile"""
+        if upload_id in self._completing:
+            raise ValueError("Upload is already being completed")
+        if self._writes.get(upload_id):
+            raise ValueError("Chunks of this upload are still being written")
+        self._completing.add(upload_id)
+        try:
+            yield
+        finally:
+            self._completing.discard(upload_id)
+
+    async def complete(self, session: Dict[str, Any]) -> str:
+        """Verify a fully received upload and return the path of its assembled file"""
+        missing = self.status(session)['missing_chunks']
+        if missing:
+            raise ValueError(f"Upload is missing {len(missing)} chunks")
+
+        corrupt = await asyncio.to_thread(self._verify_chunks, session)
+        if corrupt:
+            raise ValueError(f"Chunks {corrupt} no longer match their checksums; send them again")
+
+        session_dir = self._session_dir(session['upload_id'])
+        data_path = os.path.join(session_dir, 'data')
+        if not await asyncio.to_thread(is_valid_archive, data_path, session['filename']):
+            raise ValueError("Uploaded file is not a valid archive of its type")
+        return data_path
+
+    def abort(self, upload_id: str):
+        shutil.rmtree(self._session_dir(upload_id), ignore_errors=True)
+
+    def start(self):
+        """Start the loop that removes abandoned sessions"""
+        if self.sweep_interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Upload session sweeper started (every {self.sweep_interval}s)")
+
+    async def stop(self):
+        """Stop the sweeper loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                expired = await asyncio.to_thread(self.expire)
+                if expired:
+                    logger.info(f"Removed {len(expired)} abandoned upload sessions")
+            except Exception as e:
+                logger.warning(f"Upload session sweep failed: {e}")
+
+    def expire(self) -> List[str]:
+        """Remove sessions idle for longer than the TTL"""
+        expired = []
+        if not os.path.isdir(self.root):
+            return expired
+        cutoff = time.time() - self.ttl
+        for upload_id in os.listdir(self.root):
+            if self._last_activity(upload_id) < cutoff:
+                self.abort(upload_id)
+                expired.append(upload_id)
+        return expired
+
+    def _session_dir(self, upload_id: str) -> str:
+        return os.path.join(self.root, upload_id)
+
+    def _received(self, session: Dict[str, Any]) -> set:
+        chunks_dir = os.path.join(self._session_dir(session['upload_id']), 'chunks')
+        return {int(name) for name in os.listdir(chunks_dir) if name.isdigit()}
+
+    def _verify_chunks(self, session: Dict[str, Any]) -> List[int]:
+        """Re-hash every chunk region against its marker, dropping the markers of those that differ"""
+        session_dir = self._session_dir(session['upload_id'])
+        corrupt = []
+        with open(os.path.join(session_dir, 'data'), 'rb') as f:
+            for index in range(session['chunk_count']):
+                marker = os.path.join(session_dir, 'chunks', str(index))
+                with open(marker, 'r') as m:
+                    recorded = m.read().strip()
+                f.seek(index * session['chunk_size'])
+                digest = hashlib.sha256()
+                remaining = self._chunk_length(session, index)
+                while remaining:
+                    block = f.read(min(remaining, WRITE_BATCH_SIZE))
+                    if not block:
+                        break
+                    digest.update(block)
+                    remaining -= len(block)
+                if digest.hexdigest() != recorded:
+                    os.remove(marker)
+                    corrupt.append(index)
+        return corrupt
+
+    def _chunk_length(self, session: Dict[str, Any], index: int) -> int:
+        return min(session['chunk_size'], session['total_size'] - index * session['chunk_size'])
+
+    def _last_activity(self, upload_id: str) -> float:
+        """Newest modification time in the session; chunk writes touch the data file"""
+        session_dir = self._session_dir(upload_id)
+        latest = 0.0
+        for path in (session_dir, os.path.join(session_dir, 'data'), os.path.join(session_dir, 'chunks')):
+            try:
+                latest = max(latest, os.path.getmtime(path))
+            except OSError:
+                continue
+        return latest
+
+# Global upload session store
+upload_store = ChunkedUploadStore(
+    root=os.path.join(settings.UPLOAD_DIR, 'sessions'),
+    default_chunk_size=settings.UPLOAD_CHUNK_SIZE_MB * 1024 * 1024,
+    max_chunk_size=settings.UPLOAD_MAX_CHUNK_SIZE_MB * 1024 * 1024,
+    max_size=settings.UPLOAD_MAX_SIZE_MB * 1024 * 1024,
+    ttl=settings.UPLOAD_SESSION_TTL,
+    sweep_interval=settings.UPLOAD_SWEEP_INTERVAL
+)
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from typing import Optional, Dict, Any, Callable, Awaitable
+from config import settings
+from firebase_config import firebase_service
+from docker_service import docker_service
+
+logger = logging.getLogger(__name__)
+
+class ServiceWarmup:
+    """Connects the API's dependencies after it has started serving.
+
+    Firebase and the Docker hosts are connected in the background and retried until they
+    answer, so a slow or unavailable dependency delays readiness instead of startup. The
+    background services that need them start once they are up.
+    """
+
+    def __init__(self, retry_interval: float, check_timeout: float, check_ttl: float):
+        self.retry_interval = retry_interval
+        self.check_timeout = check_timeout
+        self.check_ttl = check_ttl
+        self.complete = False
+        self.started_at = time.time()
+        self.completed_at: Optional[float] = None
+        self._dependencies: Dict[str, Dict[str, Any]] = {}
+        self._checked_at = 0.0
+        self._check_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start warming up in the background"""
+        if self._task is None or self._task.done():
+            self.started_at = time.time()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Abandon a warm-up that is still running"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        attempt = 0
+        while True:
+            attempt += 1
+            dependencies = await self.check(force=True)
+            if dependencies['firebase']['ok'] and any(
+                state['ok'] for name, state in dependencies.items() if name.startswith('docker:')
+            ):
+                try:
+                    await self._start_services()
+                    break
+                except Exception as e:
+                    logger.warning(f"Warm-up attempt {attempt} failed: {e}")
+            else:
+                failing = [name for name, state in dependencies.items() if not state['ok']]
+                logger.warning(f"Warm-up attempt {attempt}: waiting for {', '.join(failing)}")
+            await asyncio.sleep(self.retry_interval)
+
+        self.complete = True
+        self.completed_at = time.time()
+        logger.info(f"Warm-up complete in {self.completed_at - self.started_at:.1f}s")
+
+    async def _start_services(self):
+        """Sync state from the dependencies, then start the services that poll them"""
+        # Track the ports bound on each host and the ports sleeping deployments wake on
+        from domain_service import domain_service
+        from models import DeploymentStatus
+        stopped = await firebase_service.get_deployments_by_status([DeploymentStatus.STOPPED.value])
+        sleeping = [deployment for deployment in stopped if deployment.get('scaled_to_zero')]
+        await asyncio.to_thread(docker_service.cleanup_orphaned_ports, sleeping)
+
+        # Rebuild nginx routes from the routed deployment set (stopped ones stay routed for waking)
+        if domain_service.base_domain != "localhost":
+            routed = await firebase_service.get_deployments_by_status([
+                DeploymentStatus.RUNNING.value,
+                DeploymentStatus.STOPPED.value
+            ])
+            domain_service.sync_routes(routed)
+
+        # Size the build scheduler now rather than on the first deployment
+        from build_scheduler import build_scheduler
+        if build_scheduler.limit is None:
+            build_scheduler.limit = await asyncio.to_thread(build_scheduler._derive_limit)
+            logger.info(f"Build concurrency limit: {build_scheduler.limit}")
+
+        # Start container resource sampling
+        from stats_service import stats_sampler
+        stats_sampler.start()
+
+        # Start idle detection for scale-to-zero
+        from idle_service import idle_monitor
+        idle_monitor.start()
+
+        # Reconcile deployment records with containers and disk, then keep them in sync
+        from reconciler import reconciler
+        reconciler.start()
+
+        # Start periodic image garbage collection
+        from image_gc import image_gc
+        image_gc.start()
+
+        # Start periodic repair of per-user deployment counters
+        from counter_verifier import counter_verifier
+        counter_verifier.start()
+
+        # Start periodic cleanup of pushed deployment images
+        from image_registry import image_registry
+        image_registry.start()
+
+    async def check(self, force: bool = False) -> Dict[str, Dict[str, Any]]:
+        """State of each dependency, re-checked at most every check_ttl seconds"""
+        if self._check_lock is None:
+            self._check_lock = asyncio.Lock()
+        async with self._check_lock:
+            if force or time.time() - self._checked_at >= self.check_ttl:
+                checks = [('firebase', lambda: asyncio.to_thread(firebase_service.initialize_firebase))]
+                checks += [(f"docker:{host.name}", host.api.ping) for host in docker_service.hosts]
+                results = await asyncio.gather(*(self._probe(check) for _, check in checks))
+                self._dependencies = {name: result for (name, _), result in zip(checks, results)}
+                self._checked_at = time.time()
+        return self._dependencies
+
+    async def readiness(self) -> Dict[str, Any]:
+        """Whether the API can serve deployments: warm-up done, Firebase and a Docker host up"""
+        dependencies = await self.check()
+        ready = self.complete and dependencies['firebase']['ok'] and any(
+            state['ok'] for name, state in dependencies.items() if name.startswith('docker:')
+        )
+        return {
+            'ready': ready,
+            'warmup': 'complete' if self.complete else 'pending',
+            'dependencies': dependencies
+        }
+
+    async def _probe(self, check: Callable[[], Awaitable[Any]]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(check(), timeout=self.check_timeout)
+            return {'ok': True, 'latency_ms': round((time.perf_counter() - start) * 1000, 1)}
+        except asyncio.TimeoutError:
+            return {'ok': False, 'error': f"no response within {self.check_timeout}s"}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+# Global warm-up instance
+service_warmup = ServiceWarmup(
+    retry_interval=settings.WARMUP_RETRY_INTERVAL,
+    check_timeout=settings.READINESS_CHECK_TIMEOUT,
+    check_ttl=settings.READINESS_CACHE_SECONDS
+)